@@ -1,33 +1,79 @@
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import metrics
+from cache import TTLCache
 from models import schemas, user as user_model
-from models.database import SessionLocal
+from models.database import AsyncSessionLocal, SessionLocal
 
 # Secret key - override with env var in production
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-this-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days by default
 
+
+def _cost_settings(scheme: str) -> dict:
+    """
+    Hash cost parameters from the environment, e.g. ARGON2_TIME_COST,
+    ARGON2_MEMORY_COST (KiB), ARGON2_PARALLELISM or BCRYPT_ROUNDS. Unset
+    values keep passlib's defaults. Existing hashes made with other
+    parameters are re-hashed on the next successful login.
+    """
+    # env var suffix -> passlib setting (argon2's time_cost is its "rounds")
+    names = {
+        "argon2": {"TIME_COST": "rounds", "MEMORY_COST": "memory_cost", "PARALLELISM": "parallelism"},
+        "bcrypt": {"ROUNDS": "rounds"},
+    }[scheme]
+    settings = {}
+    for env_name, setting in names.items():
+        value = os.getenv(f"{scheme.upper()}_{env_name}")
+        if value:
+            settings[f"{scheme}__{setting}"] = int(value)
+    return settings
+
+
 # Prefer Argon2 (no 72-byte limit and generally more secure). Fall back to
 # bcrypt if Argon2 backend isn't available in the environment.
 try:
     # this will succeed if argon2-cffi is installed
     CryptContext(schemes=["argon2"], deprecated="auto")
-    pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
     _HASH_SCHEME = "argon2"
 except Exception:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     _HASH_SCHEME = "bcrypt"
+pwd_context = CryptContext(
+    schemes=[_HASH_SCHEME], deprecated="auto", **_cost_settings(_HASH_SCHEME)
+)
+
+# Hashing runs on its own small thread pool (argon2-cffi and bcrypt release
+# the GIL), so login bursts can't take over the threads that serve other
+# requests. Beyond HASH_QUEUE_LIMIT waiting jobs we answer 503 right away.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
+# Users resolved from access tokens, keyed by id. Entries are dropped on
+# change via invalidate_user; the TTL bounds staleness for anything else.
+# USER_CACHE_TTL=0 disables caching.
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
 
 def get_db():
     db = SessionLocal()
@@ -37,8 +83,40 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with metrics.PASSWORD_HASH_SECONDS.time("verify"):
+        return pwd_context.verify(plain_password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """
+    passlib's needs_update ignores changed time cost / parallelism, so the
+    parameters encoded in the hash are compared to the configured ones too.
+    """
+    if pwd_context.needs_update(hashed_password):
+        return True
+    handler = pwd_context.handler(_HASH_SCHEME)
+    current = handler.from_string(hashed_password)
+    if _HASH_SCHEME == "argon2":
+        return (current.rounds, current.memory_cost, current.parallelism) != (
+            handler.default_rounds,
+            handler.memory_cost,
+            handler.parallelism,
+        )
+    return current.rounds != handler.default_rounds
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
 
 
 def get_password_hash(password: str) -> str:
@@ -54,7 +132,44 @@ def get_password_hash(password: str) -> str:
             raise ValueError(
                 "password cannot be longer than 72 bytes, truncate manually if necessary (e.g. my_password[:72])"
             )
-    return pwd_context.hash(password)
+    with metrics.PASSWORD_HASH_SECONDS.time("hash"):
+        return pwd_context.hash(password)
+
+
+def _timed_queue(fn, submitted_at):
+    def run(*args):
+        metrics.PASSWORD_QUEUE_SECONDS.observe(time.perf_counter() - submitted_at)
+        return fn(*args)
+    return run
+
+
+async def _run_hashing(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password checks in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    if metrics.ENABLED:
+        fn = _timed_queue(fn, time.perf_counter())
+    # the slot is held until the job finishes, even if the request is cancelled
+    future = _hash_executor.submit(fn, *args)
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+
+async def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Returns (valid, new_hash); new_hash is set when the stored hash was made
+    with outdated cost parameters and should be replaced.
+    """
+    return await _run_hashing(verify_and_update, plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -68,33 +183,80 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[user_model.User]:
-    return db.query(user_model.User).filter(user_model.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[user_model.User]:
+    result = await db.execute(select(user_model.User).where(user_model.User.email == email))
+    return result.scalars().first()
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[user_model.User]:
-    user = get_user_by_email(db, email)
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[user_model.User]:
+    user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> user_model.User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_access_token(token: str) -> schemas.TokenData:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = get_user_by_email(db, email=email)
+        raise _credentials_exception()
+    email: str = payload.get("sub")
+    if email is None:
+        raise _credentials_exception()
+    return schemas.TokenData(email=email, user_id=payload.get("uid"))
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Drop a user from the cache; call after changing anything in UserRead.
+    """
+    user_cache.invalidate(user_id)
+
+
+async def get_current_user_id(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
+) -> int:
+    """
+    Authenticated user id, for handlers that need nothing else. Resolved
+    like get_current_user, so the user must still exist: from user_cache
+    when possible, otherwise with one primary-key query.
+    """
+    user = await get_current_user(token, db)
+    return user.id
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
+) -> schemas.UserRead:
+    """
+    Authenticated user as a read-only snapshot, served from user_cache when
+    possible and otherwise loaded with a single primary-key query.
+    """
+    token_data = decode_access_token(token)
+    if token_data.user_id is not None:
+        cached = user_cache.get(token_data.user_id)
+        if cached is not None:
+            return cached
+        user = await db.get(user_model.User, token_data.user_id)
+    else:
+        user = await get_user_by_email(db, email=token_data.email)
     if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+
+    snapshot = schemas.UserRead.model_validate(user)
+    user_cache.set(user.id, snapshot)
+    return snapshot
@@ -0,0 +1,17 @@
+"""
+Benchmark and load-test suite.
+
+    python -m benchmarks --suite all --out bench.json
+
+Three suites:
+
+- estimator: single vs. batch prediction, training and artifact load time
+- endpoints: per-endpoint latency through an in-process ASGI client
+- load: concurrent users replaying the frontend's request pattern
+
+Endpoints run against a SQLite stand-in seeded from
+data/combined_parking_data.csv (needs aiosqlite, see requirements.txt
+here) unless --database postgres is given, which uses the DATABASE_*
+settings like the app. Results are JSON with p50/p95/p99 and throughput
+per benchmark, so runs can be compared over time.
+"""
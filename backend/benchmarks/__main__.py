@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from .stats import print_table
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_app_suites(args, workdir):
+    import httpx
+
+    from parking_time_estimators.datasets import read_parking
+
+    from . import endpoints, load
+    from .standin import postgres_app, prepare_environment, sqlite_app
+
+    prepare_environment(workdir, args.data)
+
+    import main
+
+    if args.no_geo_cache:
+        main.GEO_CACHE_ENABLED = False
+
+    if args.database == "postgres":
+        app_context = postgres_app()
+    else:
+        app_context = sqlite_app(workdir, args.parking_csv)
+
+    spots = read_parking(args.parking_csv)
+    results = []
+    async with app_context as app:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            if args.suite in ("endpoints", "all"):
+                results += await endpoints.run(
+                    client,
+                    spots,
+                    repeat=args.repeat,
+                    seed=args.seed,
+                    postgres=args.database == "postgres",
+                )
+            if args.suite in ("load", "all"):
+                results += await load.run(
+                    client,
+                    spots,
+                    concurrency=args.concurrency,
+                    duration=args.duration,
+                    seed=args.seed,
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Run the benchmarks")
+    parser.add_argument(
+        "--suite", choices=("estimator", "endpoints", "load", "all"), default="all"
+    )
+    parser.add_argument("--database", choices=("sqlite", "postgres"), default="sqlite")
+    parser.add_argument(
+        "--data",
+        default=os.path.join(BACKEND, "synthentic_parking_occupancy.csv"),
+        help="training data, CSV or Parquet",
+    )
+    parser.add_argument(
+        "--parking-csv",
+        default=os.path.join(BACKEND, "..", "data", "combined_parking_data.csv"),
+        help="parking spots to seed the stand-in and sample locations from",
+    )
+    parser.add_argument("--repeat", type=int, default=200, help="calls per benchmark")
+    parser.add_argument("--concurrency", type=int, default=20, help="load: virtual users")
+    parser.add_argument("--duration", type=float, default=10.0, help="load: seconds per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-geo-cache", action="store_true", help="disable the /nearest response cache"
+    )
+    parser.add_argument("--workdir", help="keep artifacts here instead of a temp dir")
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+
+        if args.suite in ("estimator", "all"):
+            from . import estimator
+
+            results += estimator.run(args.data, args.parking_csv, repeat=args.repeat, seed=args.seed)
+        if args.suite != "estimator":
+            results += asyncio.run(run_app_suites(args, workdir))
+
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print_table(results)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Per-endpoint latency through an in-process ASGI client. Requests are
+sequential, so the numbers are service time without queueing; client
+overhead is included (it shares the event loop with the app).
+"""
+import time
+
+import numpy as np
+
+from .stats import summarize
+
+SUITE = "endpoints"
+
+# roughly 200 m around a parking spot
+JITTER_DEG = 0.002
+
+
+class PointSampler:
+    """
+    Random request locations near known parking spots, reproducible by seed.
+    """
+
+    def __init__(self, spots, seed=0):
+        spots = spots.dropna(subset=["latitude", "longitude"])
+        self.ids = spots["id"].tolist()
+        self.latitude = spots["latitude"].to_numpy(dtype=float)
+        self.longitude = spots["longitude"].to_numpy(dtype=float)
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self):
+        i = self.rng.integers(len(self.latitude))
+        lat, lon = self.rng.uniform(-JITTER_DEG, JITTER_DEG, size=2)
+        return float(self.latitude[i] + lat), float(self.longitude[i] + lon)
+
+
+async def login(client, email="bench@example.com", password="bench-password"):
+    """
+    Registers the benchmark user if needed and returns auth headers.
+    """
+    await client.post("/register", json={"email": email, "password": password, "name": "Bench"})
+    response = await client.post("/token", data={"username": email, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def timed(client, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return time.perf_counter() - start, response
+
+
+async def bench(name, make_request, repeat, warmup=3):
+    """
+    Runs make_request() `repeat` times; returns the summary with the number
+    of non-2xx responses.
+    """
+    for _ in range(warmup):
+        await make_request()
+    durations = []
+    errors = 0
+    for _ in range(repeat):
+        duration, response = await make_request()
+        durations.append(duration)
+        errors += not response.is_success
+    return summarize(SUITE, name, durations, errors=errors)
+
+
+async def run(client, spots, repeat=200, seed=0, postgres=False):
+    """
+    spots: the parking table as read by datasets.read_parking.
+    """
+    headers = await login(client)
+    sample = PointSampler(spots, seed)
+    spot_ids = sample.ids
+    results = []
+
+    def nearest(path):
+        async def request():
+            lat, lon = sample()
+            return await timed(client, "GET", path, params={"latitude": lat, "longitude": lon})
+        return request
+
+    results.append(await bench("nearest", nearest("/nearest"), repeat))
+    results.append(
+        await bench("nearest_with_estimates", nearest("/nearest_with_estimates"), repeat)
+    )
+
+    fixed = sample()
+    results.append(
+        await bench(
+            "nearest_same_point",
+            lambda: timed(
+                client, "GET", "/nearest", params={"latitude": fixed[0], "longitude": fixed[1]}
+            ),
+            repeat,
+        )
+    )
+
+    def estimate_body():
+        lat, lon = sample()
+        return {
+            "total_capacity": 10,
+            "latitude": lat,
+            "longitude": lon,
+            "parking_id": spot_ids[sample.rng.integers(len(spot_ids))],
+        }
+
+    results.append(
+        await bench(
+            "estimate_search_time",
+            lambda: timed(client, "POST", "/estimate_search_time", json=estimate_body()),
+            repeat,
+        )
+    )
+    results.append(
+        await bench(
+            "estimate_search_time_batch_20",
+            lambda: timed(
+                client,
+                "POST",
+                "/estimate_search_time/batch",
+                json={"spots": [estimate_body() for _ in range(20)]},
+            ),
+            repeat,
+        )
+    )
+    results.append(
+        await bench(
+            "users_me", lambda: timed(client, "GET", "/users/me", headers=headers), repeat
+        )
+    )
+    results.append(
+        await bench(
+            "history",
+            lambda: timed(
+                client,
+                "POST",
+                "/history",
+                headers=headers,
+                json={"parking_id": spot_ids[0], "saved_time": 1.0},
+            ),
+            repeat,
+        )
+    )
+    # password hashing dominates, so fewer rounds
+    results.append(
+        await bench(
+            "token",
+            lambda: timed(
+                client,
+                "POST",
+                "/token",
+                data={"username": "bench@example.com", "password": "bench-password"},
+            ),
+            max(5, repeat // 20),
+            warmup=1,
+        )
+    )
+
+    if postgres:
+        words = ["str", "platz", "weg", "Leopold", "Markt"]
+        results.append(
+            await bench(
+                "parking_search",
+                lambda: timed(
+                    client,
+                    "GET",
+                    "/parking",
+                    params={"location": words[sample.rng.integers(len(words))]},
+                ),
+                repeat,
+            )
+        )
+
+    return results
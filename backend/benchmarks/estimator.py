@@ -0,0 +1,134 @@
+"""
+Estimator microbenchmarks: training, artifact load, single vs. batch
+prediction (fast NumPy path and the sklearn Pipeline) and table lookup.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from parking_time_estimators.artifacts import data_hash, load_artifact, save_artifact
+from parking_time_estimators.estimator import FOREST_PARAMS, ParkingCapacityEstimator
+from parking_time_estimators.lookup import build_table
+
+from .stats import measure, summarize
+
+SUITE = "estimator"
+
+
+def sample_spots(n, rng, parking_csv):
+    df = pd.read_csv(parking_csv, usecols=["id", "capacity", "latitude", "longitude"]).dropna()
+    return df.sample(n=min(n, len(df)), replace=n > len(df), random_state=rng.integers(1 << 31))
+
+
+def run(data_path, parking_csv, repeat=200, train_repeat=1, seed=0):
+    rng = np.random.default_rng(seed)
+    results = []
+
+    train_durations = measure(
+        lambda: ParkingCapacityEstimator.train(data_path), train_repeat, warmup=0
+    )
+    results.append(summarize(SUITE, "train", train_durations, rows=len(pd.read_csv(data_path))))
+
+    model = ParkingCapacityEstimator.train(data_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "estimator.joblib")
+        save_artifact(model, path, data_hash(data_path), FOREST_PARAMS)
+        results.append(
+            summarize(
+                SUITE,
+                "artifact_load",
+                measure(lambda: load_artifact(path), 5),
+                size_bytes=os.path.getsize(path),
+            )
+        )
+        results.append(
+            summarize(
+                SUITE,
+                "artifact_load_no_mmap",
+                measure(lambda: load_artifact(path, mmap_mode=None), 5),
+            )
+        )
+
+        estimator = ParkingCapacityEstimator(data_path, artifact_path=path)
+        estimator.model
+
+        spot = sample_spots(1, rng, parking_csv).iloc[0]
+        results.append(
+            summarize(
+                SUITE,
+                "predict_single",
+                measure(
+                    lambda: estimator.predict(
+                        "WT", 8, spot.capacity, spot.latitude, spot.longitude
+                    ),
+                    repeat,
+                ),
+            )
+        )
+        results.append(
+            summarize(
+                SUITE,
+                "predict_search_time_single",
+                measure(
+                    lambda: estimator.predict_search_time(
+                        "WT", 8, spot.capacity, spot.latitude, spot.longitude
+                    ),
+                    repeat,
+                ),
+            )
+        )
+
+        for batch in (20, 1000):
+            spots = sample_spots(batch, rng, parking_csv)
+            capacity = spots.capacity.to_numpy()
+            latitude = spots.latitude.to_numpy()
+            longitude = spots.longitude.to_numpy()
+            durations = measure(
+                lambda: estimator.predict_search_time_many("WT", 8, capacity, latitude, longitude),
+                max(10, repeat // 10),
+            )
+            results.append(
+                summarize(SUITE, f"predict_batch_{batch}", durations, batch_size=batch)
+            )
+
+            frame = pd.DataFrame(
+                {
+                    "day_type": "WT",
+                    "total_capacity": capacity,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "hour_sin": np.sin(2 * np.pi * 8 / 24),
+                    "hour_cos": np.cos(2 * np.pi * 8 / 24),
+                }
+            )
+            durations = measure(lambda: estimator.model.predict(frame), max(10, repeat // 10))
+            results.append(
+                summarize(SUITE, f"pipeline_predict_batch_{batch}", durations, batch_size=batch)
+            )
+
+        spots = sample_spots(1000, rng, parking_csv)
+        start = time.perf_counter()
+        table, _ = build_table(
+            estimator,
+            spots.id.to_numpy(),
+            spots.capacity.to_numpy(),
+            spots.latitude.to_numpy(),
+            spots.longitude.to_numpy(),
+        )
+        results.append(
+            summarize(SUITE, "table_build_1000_spots", [time.perf_counter() - start])
+        )
+        ids = spots.id.tolist()[:20]
+        results.append(
+            summarize(
+                SUITE,
+                "table_lookup_20",
+                measure(lambda: table.search_times(ids, "WT", 8), repeat),
+                batch_size=20,
+            )
+        )
+
+    return results
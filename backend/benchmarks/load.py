@@ -0,0 +1,101 @@
+"""
+Load scenario: concurrent virtual users replaying the frontend's request
+pattern for a fixed duration.
+
+- per_spot: GET /nearest, then one POST /estimate_search_time per
+  returned spot, issued concurrently (the original MapPage behaviour)
+- combined: a single GET /nearest_with_estimates
+
+Reports latency per request and per full page load, plus throughput.
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from .endpoints import PointSampler
+from .stats import summarize
+
+SUITE = "load"
+
+
+async def per_spot_page(client, sample, record):
+    lat, lon = sample()
+    start = time.perf_counter()
+    response = await client.get("/nearest", params={"latitude": lat, "longitude": lon})
+    record("GET /nearest", time.perf_counter() - start, response)
+    if not response.is_success:
+        return
+
+    async def estimate(spot):
+        begin = time.perf_counter()
+        r = await client.post(
+            "/estimate_search_time",
+            json={
+                "total_capacity": spot["capacity"] or 0,
+                "latitude": spot["latitude"],
+                "longitude": spot["longitude"],
+                "parking_id": spot["id"],
+            },
+        )
+        record("POST /estimate_search_time", time.perf_counter() - begin, r)
+
+    await asyncio.gather(*(estimate(spot) for spot in response.json()))
+
+
+async def combined_page(client, sample, record):
+    lat, lon = sample()
+    start = time.perf_counter()
+    response = await client.get(
+        "/nearest_with_estimates", params={"latitude": lat, "longitude": lon}
+    )
+    record("GET /nearest_with_estimates", time.perf_counter() - start, response)
+
+
+SCENARIOS = {"per_spot": per_spot_page, "combined": combined_page}
+
+
+async def run_scenario(client, spots, scenario, concurrency=20, duration=10.0, seed=0):
+    page = SCENARIOS[scenario]
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    pages = []
+
+    def record(route, duration, response):
+        durations[route].append(duration)
+        errors[route] += not response.is_success
+
+    async def user(i):
+        sample = PointSampler(spots, seed + i)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await page(client, sample, record)
+            pages.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    wall_time = time.perf_counter() - start
+
+    common = {"scenario": scenario, "concurrency": concurrency}
+    results = [
+        summarize(SUITE, f"{scenario}/page", pages, wall_time=wall_time, **common)
+    ]
+    for route, values in durations.items():
+        results.append(
+            summarize(
+                SUITE,
+                f"{scenario}/{route}",
+                values,
+                wall_time=wall_time,
+                errors=errors[route],
+                **common,
+            )
+        )
+    return results
+
+
+async def run(client, spots, concurrency=20, duration=10.0, seed=0):
+    results = []
+    for scenario in SCENARIOS:
+        results += await run_scenario(client, spots, scenario, concurrency, duration, seed)
+    return results
@@ -0,0 +1,115 @@
+"""
+Runs main.app in-process for the endpoint and load benchmarks, either on a
+SQLite stand-in seeded from combined_parking_data.csv or on the Postgres
+database configured through DATABASE_*.
+
+The SQLite stand-in has no PostGIS or pg_trgm, so /nearest is always
+answered by the in-memory spatial index and /parking is not benchmarked.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from parking_time_estimators.artifacts import data_hash, save_artifact
+from parking_time_estimators.datasets import read_parking
+from parking_time_estimators.estimator import FOREST_PARAMS, ParkingCapacityEstimator
+
+PARKING_DDL = """
+    CREATE TABLE parking (
+        id VARCHAR(200) PRIMARY KEY,
+        address VARCHAR(255),
+        capacity DECIMAL(10,2),
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
+        parking_type VARCHAR(50)
+    )
+"""
+
+
+def prepare_environment(workdir, data_path):
+    """
+    Points the app at an artifact and search time table in workdir and
+    trains the artifact if needed. Must run before main is imported.
+    """
+    artifact = os.path.join(workdir, "estimator.joblib")
+    if not os.path.exists(artifact):
+        model = ParkingCapacityEstimator.train(data_path)
+        save_artifact(model, artifact, data_hash(data_path), FOREST_PARAMS)
+    os.environ["ESTIMATOR_ARTIFACT"] = artifact
+    os.environ["SEARCH_TIME_TABLE"] = os.path.join(workdir, "search_times")
+    # the benchmarks drive the refreshes themselves
+    os.environ.setdefault("MODEL_REFRESH_SECONDS", "3600")
+
+
+@asynccontextmanager
+async def sqlite_app(workdir, parking_csv):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    import auth
+    import main
+    from models.database import Base
+    from models import user as user_model
+    from spatial_index import SpatialIndex, load_parking_columns
+
+    path = os.path.join(workdir, "standin.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 30}
+    )
+    session_factory = async_sessionmaker(
+        async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False
+    )
+
+    with engine.begin() as conn:
+        conn.execute(text(PARKING_DDL))
+        Base.metadata.create_all(
+            conn,
+            tables=[
+                user_model.User.__table__,
+                user_model.HistoryEvent.__table__,
+                user_model.OccupancyObservation.__table__,
+            ],
+        )
+    read_parking(parking_csv).to_sql("parking", engine, if_exists="append", index=False)
+
+    with engine.connect() as conn:
+        columns = load_parking_columns(conn)
+    main.spatial_index = SpatialIndex(columns, "standin")
+    main._parking_fingerprint = "standin"
+    main.search_times.rebuild(
+        columns["id"], columns["capacity"], columns["latitude"], columns["longitude"]
+    )
+
+    async def get_db():
+        async with session_factory() as db:
+            yield db
+
+    main.app.dependency_overrides[auth.get_async_db] = get_db
+    main.history_writer.session_factory = session_factory
+    main.history_writer.start()
+    try:
+        yield main.app
+    finally:
+        await main.history_writer.close()
+        main.app.dependency_overrides.clear()
+        await async_engine.dispose()
+        engine.dispose()
+
+
+@asynccontextmanager
+async def postgres_app(timeout=300):
+    import main
+
+    async with main.lifespan(main.app):
+        # the refresh thread loads the index and the search time table
+        for _ in range(int(timeout / 0.5)):
+            index_ready = main.spatial_index is not None or not main.SPATIAL_INDEX_ENABLED
+            if index_ready and main.search_times.get() is not None:
+                break
+            await asyncio.sleep(0.5)
+        else:
+            raise RuntimeError("parking data did not load within the timeout")
+        yield main.app
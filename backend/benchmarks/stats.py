@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+
+
+def summarize(suite, name, durations, wall_time=None, **extra):
+    """
+    Latency percentiles in milliseconds plus throughput. Without a wall
+    time, throughput assumes the calls ran back to back.
+    """
+    durations = np.asarray(durations, dtype=float)
+    if wall_time is None:
+        wall_time = float(durations.sum())
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+    result = {
+        "suite": suite,
+        "name": name,
+        "n": int(durations.size),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(float(durations.mean()) * 1000, 4),
+        "min_ms": round(float(durations.min()) * 1000, 4),
+        "max_ms": round(float(durations.max()) * 1000, 4),
+        "throughput_per_s": round(durations.size / wall_time, 2) if wall_time > 0 else None,
+    }
+    result.update(extra)
+    return result
+
+
+def measure(fn, repeat, warmup=1):
+    """
+    Durations in seconds of `repeat` calls of fn, after `warmup` calls.
+    """
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def measure_async(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        await fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def print_table(results):
+    print(f"{'benchmark':<48} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per s':>10}")
+    for r in results:
+        print(
+            f"{r['suite'] + '/' + r['name']:<48} {r['n']:>6} {r['p50_ms']:>10.3f} "
+            f"{r['p95_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['throughput_per_s'] or 0:>10.1f}"
+        )
@@ -0,0 +1,182 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries also expire after a TTL.
+    Thread-safe; counts hits and misses.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def values(self):
+        with self._lock:
+            return [entry[1] for entry in self._data.values()]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class InMemoryCacheBackend:
+    """
+    Per-process backend for GeoCellCache; also the stand-in for the shared
+    backend in tests. Stores encoded bytes so memory use is exact.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl=ttl)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["memory_bytes"] = sum(len(value) for value in self._cache.values())
+        return stats
+
+
+class RedisCacheBackend:
+    """
+    Shared backend so all workers (and instances) reuse each other's
+    results. Needs the optional `redis` package.
+    """
+
+    def __init__(self, url, prefix="parkiest:"):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = None
+
+    async def get(self, key):
+        value = await self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, ttl):
+        if ttl > 0:
+            await self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    async def refresh_memory(self):
+        self.memory_bytes = (await self.client.info("memory"))["used_memory"]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+class GeoCellCache:
+    """
+    Caches location-based responses per quantized lat/lon cell, radius and
+    (day type, hour) bucket. Entries never outlive the hour they were
+    computed in, so estimates are recomputed when the bucket rolls over.
+    """
+
+    METERS_PER_DEGREE = 111_320
+
+    def __init__(self, backend, cell_size_m=25, ttl=300):
+        self.backend = backend
+        self.cell_size_m = cell_size_m
+        self.ttl = ttl
+
+    def cell(self, latitude, longitude):
+        """
+        Cell indices and the cell center the cached result is computed for.
+        """
+        lat_step = self.cell_size_m / self.METERS_PER_DEGREE
+        row = math.floor(latitude / lat_step)
+        center_lat = (row + 0.5) * lat_step
+        lon_step = lat_step / max(math.cos(math.radians(center_lat)), 1e-6)
+        col = math.floor(longitude / lon_step)
+        return (row, col), center_lat, (col + 0.5) * lon_step
+
+    @property
+    def half_diagonal_m(self):
+        """
+        Farthest a point of a cell can be from its center.
+        """
+        return self.cell_size_m * math.sqrt(2) / 2
+
+    def key(self, namespace, cell, radius_m, day_type, hour, version=""):
+        return f"{namespace}:{version}:{cell[0]}:{cell[1]}:{radius_m:g}:{day_type}:{hour}"
+
+    def ttl_now(self, now=None):
+        now = now or datetime.now()
+        until_next_hour = 3600 - (now.minute * 60 + now.second + now.microsecond / 1e6)
+        return min(self.ttl, until_next_hour)
+
+    async def get(self, key):
+        value = await self.backend.get(key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key, value):
+        await self.backend.set(key, json.dumps(value).encode(), self.ttl_now())
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats["cell_size_m"] = self.cell_size_m
+        return stats
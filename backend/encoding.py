@@ -0,0 +1,158 @@
+"""
+Response encoding for spot listings (/parking, /nearest and friends).
+
+Listings are lists of flat records, encoded as negotiated by Accept:
+
+    application/json                       list of objects (default)
+    application/msgpack                    the same, as MessagePack
+    application/json; layout=columns       {"id": [...], "address": [...], ...}
+    application/msgpack; layout=columns
+
+The columnar layout names each field once instead of once per row and
+compresses better. JSON is encoded with orjson, several times faster than
+the json module for these payloads (which stays the fallback without it);
+MessagePack needs the msgpack package, without it clients get JSON.
+
+Bodies of at least COMPRESS_MIN_BYTES are compressed with brotli (if the
+brotli package is there) or gzip, as Accept-Encoding allows. Small bodies
+are sent as they are: below about a kilobyte compression saves less than
+it costs.
+
+Database rows can be encoded directly (rows_response): values go from the
+cursor's tuples into the encoder without per-row model objects.
+"""
+import gzip
+import json
+import os
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# fast settings: on a few kB of JSON they already get most of the ratio
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_MSGPACK_ALIASES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+_JSON_ALIASES = (JSON, "application/*", "*/*")
+
+
+def dumps_json(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _parse(header):
+    """
+    (value, params, q) per comma-separated entry, highest q first (stable).
+    """
+    entries = []
+    for part in (header or "").split(","):
+        value, *params = (p.strip() for p in part.split(";"))
+        if not value:
+            continue
+        options = {}
+        for param in params:
+            name, _, option = param.partition("=")
+            options[name.strip().lower()] = option.strip().strip('"').lower()
+        try:
+            q = float(options.pop("q", 1))
+        except ValueError:
+            q = 0.0
+        entries.append((value.lower(), options, q))
+    return sorted(entries, key=lambda entry: -entry[2])
+
+
+def negotiate(accept):
+    """
+    (media type, layout) for an Accept header; JSON records by default.
+    """
+    for value, options, q in _parse(accept):
+        if q <= 0:
+            continue
+        layout = "columns" if options.get("layout") == "columns" else "records"
+        if value in _MSGPACK_ALIASES and msgpack is not None:
+            return MSGPACK, layout
+        if value in _JSON_ALIASES:
+            return JSON, layout
+    return JSON, "records"
+
+
+def content_coding(accept_encoding):
+    """
+    The compression to use for an Accept-Encoding header, or None.
+    """
+    accepted = {value: q for value, _, q in _parse(accept_encoding)}
+    for coding, available in (("br", brotli is not None), ("gzip", True)):
+        if available and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _response(request, content, headers=None):
+    """
+    Encodes `content(layout)` as negotiated with the request.
+    """
+    media_type, layout = negotiate(request.headers.get("accept"))
+    data = content(layout)
+    body = msgpack.packb(data) if media_type == MSGPACK else dumps_json(data)
+
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        coding = content_coding(request.headers.get("accept-encoding"))
+        if coding is not None:
+            body = compress(body, coding)
+            headers["Content-Encoding"] = coding
+    if layout == "columns":
+        media_type += "; layout=columns"
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def records_response(request, records, headers=None):
+    """
+    Response for a list of dicts with the same keys.
+    """
+    def content(layout):
+        if layout == "columns":
+            fields = list(records[0]) if records else []
+            return {field: [record[field] for record in records] for field in fields}
+        return records
+
+    return _response(request, content, headers)
+
+
+def rows_response(request, fields, rows, headers=None):
+    """
+    Response for database rows (tuples). Values past len(fields), such as
+    a sort key, are left out.
+    """
+    def content(layout):
+        if layout == "columns":
+            columns = list(zip(*rows)) or [()] * len(fields)
+            return {field: list(column) for field, column in zip(fields, columns)}
+        return [dict(zip(fields, row)) for row in rows]
+
+    return _response(request, content, headers)
@@ -0,0 +1,186 @@
+"""
+Server-sent updates of search time estimates (GET /updates).
+
+A client subscribes to its candidate spots, or to an area, and keeps the
+stream open: it first gets the current estimates, then only the spots
+whose estimate changed. Changes come from the hour bucket rolling over,
+newly blended occupancy observations or a swapped model; the broadcaster
+polls a cheap version key for those every `interval` seconds.
+
+When the key changes, the estimates of every subscribed spot are computed
+once, in one batch, and fanned out: each subscriber gets one event with
+just its changed spots. Subscribers that stop reading are dropped (their
+EventSource reconnects and gets a fresh snapshot).
+"""
+import asyncio
+import json
+import math
+from collections import defaultdict
+
+
+class Subscription:
+    def __init__(self, spot_ids, max_pending):
+        self.spot_ids = spot_ids
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = False
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+
+class EstimateBroadcaster:
+    def __init__(self, estimate, version, interval=5.0, min_change=0.1, max_pending=16):
+        # estimate(spot_ids, capacity, latitude, longitude) -> (estimates, context),
+        # blocking; context is sent along (e.g. the day type and hour)
+        self.estimate = estimate
+        # cheap key that changes whenever estimates may have changed
+        self.version = version
+        self.interval = interval
+        # minutes; smaller changes are not pushed
+        self.min_change = min_change
+        self.max_pending = max_pending
+        self._spots = {}
+        self._subscribers = defaultdict(set)
+        self._last = {}
+        self._version = None
+        self._task = None
+
+    def __len__(self):
+        return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    async def _estimate(self, spot_ids):
+        capacity, latitude, longitude = zip(*(self._spots[spot_id] for spot_id in spot_ids))
+        estimates, context = await asyncio.to_thread(
+            self.estimate, spot_ids, capacity, latitude, longitude
+        )
+        # no estimate (null) where the formula needs an unknown capacity
+        return {
+            spot_id: float(e) if math.isfinite(e) else None
+            for spot_id, e in zip(spot_ids, estimates)
+        }, context
+
+    async def subscribe(self, spots):
+        """
+        Registers the spots (dicts with id, capacity, latitude, longitude)
+        and returns the subscription plus its snapshot event.
+        """
+        for spot in spots:
+            capacity = spot["capacity"]
+            self._spots.setdefault(
+                spot["id"],
+                (
+                    float(capacity) if capacity is not None else math.nan,
+                    float(spot["latitude"]),
+                    float(spot["longitude"]),
+                ),
+            )
+        spot_ids = list(dict.fromkeys(spot["id"] for spot in spots))
+        subscription = Subscription(spot_ids, self.max_pending)
+        for spot_id in spot_ids:
+            self._subscribers[spot_id].add(subscription)
+
+        try:
+            estimates, context = await self._estimate(spot_ids)
+        except BaseException:
+            # failed, or cancelled by a disconnect: stream() never got the
+            # subscription to unsubscribe it
+            self.unsubscribe(subscription)
+            raise
+        for spot_id, value in estimates.items():
+            self._last.setdefault(spot_id, value)
+        return subscription, _event("snapshot", estimates, context)
+
+    def unsubscribe(self, subscription):
+        for spot_id in subscription.spot_ids:
+            subscribers = self._subscribers.get(spot_id)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[spot_id]
+                self._spots.pop(spot_id, None)
+                self._last.pop(spot_id, None)
+
+    def _changed(self, old, new):
+        if old is None or new is None:
+            return old is not new
+        return abs(new - old) >= self.min_change
+
+    async def check(self):
+        """
+        Recomputes and pushes if the version key changed. Returns the
+        number of spots whose estimate changed.
+        """
+        version = self.version()
+        if version == self._version:
+            return 0
+        spot_ids = list(self._subscribers)
+        if not spot_ids:
+            self._version = version
+            return 0
+
+        estimates, context = await self._estimate(spot_ids)
+        changed = {
+            spot_id: value
+            for spot_id, value in estimates.items()
+            # unsubscribed while computing
+            if spot_id in self._last and self._changed(self._last[spot_id], value)
+        }
+        self._last.update(changed)
+
+        updates = defaultdict(dict)
+        for spot_id, value in changed.items():
+            for subscription in self._subscribers.get(spot_id, ()):
+                updates[subscription][spot_id] = value
+        for subscription, spot_estimates in updates.items():
+            subscription.push(_event("update", spot_estimates, context))
+        # only now: if computing failed, the next check retries
+        self._version = version
+        return len(changed)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Could not push estimate updates: {e}")
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stream(self, spots, is_disconnected, keepalive=15.0):
+        """
+        Server-sent events for a new subscription to `spots`, which lasts
+        as long as the stream is consumed.
+        """
+        subscription, snapshot = await self.subscribe(spots)
+        try:
+            yield snapshot
+            while not subscription.dropped:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    # comment line, keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+def _event(name, estimates, context):
+    data = json.dumps({"estimated_search_time_minutes": estimates, **context})
+    return f"event: {name}\ndata: {data}\n\n"
@@ -0,0 +1,45 @@
+"""
+Production server: a gunicorn master with uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+With preload_app the master imports main and loads the model, spatial
+index and search time table once (main.preload) before forking, so the
+workers start warm and share that memory copy-on-write instead of each
+loading its own copy. gc.freeze() keeps the collector from writing to
+the preloaded objects, which would otherwise unshare their pages.
+
+Workers are restarted gracefully on SIGHUP (new workers are forked from
+the preloaded master, old ones finish their requests within
+graceful_timeout), and after max_requests (+ jitter) to bound leaks.
+A retrained model does not need a restart, see MODEL_REFRESH_SECONDS.
+"""
+import gc
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+
+# heartbeat files on tmpfs, a disk-backed /tmp can stall workers in Docker
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = os.getenv("ACCESS_LOG", "-") or None
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        import main
+
+        main.preload()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        gc.freeze()
@@ -0,0 +1,148 @@
+"""
+Write-behind buffer for /history events.
+
+Events are queued in memory and flushed in bulk, either when the buffer
+reaches batch_size or every flush_interval seconds, and once more on
+shutdown. Each flush is a single transaction: one multi-row INSERT for the
+events plus one UPDATE statement that adds the summed saved_time per user.
+
+A batch that fails on a connection or server error is kept and retried by
+the next flush. One the database rejects for its data (an integrity or
+data error, e.g. the spot or user was deleted meanwhile) is written in
+halves instead, down to the rejected events, which are dropped: retrying
+them could never succeed and would hold up every event behind them.
+"""
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import user as user_model
+
+
+class HistoryWriter:
+    def __init__(
+        self,
+        session_factory,
+        batch_size=500,
+        flush_interval=1.0,
+        max_pending=100_000,
+        on_flush=None,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # events beyond this are dropped while the DB is unreachable
+        self.max_pending = max_pending
+        # called with the set of user ids whose saved_time changed
+        self.on_flush = on_flush
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._size_flush = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, parking_id, saved_time, timestamp):
+        if len(self._pending) >= self.max_pending:
+            raise OverflowError("history buffer is full")
+        self._pending.append(
+            {
+                "user_id": user_id,
+                "parking_id": parking_id,
+                "saved_time": saved_time,
+                "timestamp": timestamp,
+            }
+        )
+        if len(self._pending) >= self.batch_size and (
+            self._size_flush is None or self._size_flush.done()
+        ):
+            self._size_flush = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                try:
+                    await self._write(batch)
+                except (IntegrityError, DataError) as e:
+                    try:
+                        await self._write_valid(batch, e)
+                    except Exception as e:
+                        print(f"History flush failed, {len(self._pending)} events pending: {e}")
+                        return
+                except Exception as e:
+                    # keep the events for the next attempt, oldest first
+                    self._pending[:0] = batch
+                    print(f"History flush failed, {len(self._pending)} events pending: {e}")
+                    return
+
+    async def _write_valid(self, batch, error):
+        """
+        Writes a batch the database rejected with `error` in halves, down to
+        the single rejected events, which are dropped. On any other error
+        the events not written yet are put back (oldest first) and it raises.
+        """
+        parts = [(batch, error)]
+        while parts:
+            part, error = parts.pop()
+            if error is None:
+                try:
+                    await self._write(part)
+                    continue
+                except (IntegrityError, DataError) as e:
+                    error = e
+                except Exception:
+                    self._pending[:0] = part + [event for rest, _ in reversed(parts) for event in rest]
+                    raise
+            if len(part) == 1:
+                event = part[0]
+                print(
+                    f"Dropping history event of user {event['user_id']} "
+                    f"for {event['parking_id']!r}: {error.orig}"
+                )
+                continue
+            middle = len(part) // 2
+            parts += [(part[middle:], None), (part[:middle], None)]
+
+    async def _write(self, batch):
+        deltas = defaultdict(float)
+        for event in batch:
+            deltas[event["user_id"]] += event["saved_time"]
+
+        async with self.session_factory() as db:
+            await db.execute(insert(user_model.HistoryEvent), batch)
+            # Core table, so SQLAlchemy runs one executemany UPDATE rather
+            # than an ORM bulk update by primary key
+            users = user_model.User.__table__
+            await db.execute(
+                update(users)
+                .where(users.c.id == bindparam("uid"))
+                .values(saved_time=func.coalesce(users.c.saved_time, 0) + bindparam("delta")),
+                [{"uid": uid, "delta": delta} for uid, delta in deltas.items()],
+            )
+            await db.commit()
+
+        if self.on_flush is not None:
+            self.on_flush(set(deltas))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
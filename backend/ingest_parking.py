@@ -0,0 +1,268 @@
+"""
+Incremental ingestion of the parking inventory.
+
+    python ingest_parking.py --lines ../data/opendata_parking_lots.csv
+    python ingest_parking.py --points ../data/combined_parking_data.parquet --prune
+
+--lines takes the Munich opendata export: one LINESTRING per parking
+stretch in EPSG:25832 (ETRS89 / UTM zone 32N), which becomes a spot at
+the line's center. --points takes the combined_parking_data layout
+(CSV or Parquet) with coordinates already in WGS84.
+
+Sources are read in chunks; each chunk is converted in a few vectorized
+NumPy passes (no per-row geometry objects) and streamed with COPY into a
+temporary staging table, geom included, as EWKT. A single INSERT ... ON
+CONFLICT then merges staging into parking and only touches rows whose
+values changed; --prune also deletes spots of the same parking types
+that are no longer in the source (unless history or observations refer
+to them). The parking zones are rebuilt on top (see zones.py).
+Everything runs in one transaction: the live table keeps its indexes,
+readers see the old or the new inventory, never a mix, and /nearest picks
+up the change at the next parking refresh.
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from models.database import engine
+from parking_time_estimators.datasets import PARKING_DTYPES, iter_chunks
+from zones import rebuild_zones
+
+# Columns of the opendata parking lot export used here
+LINE_DTYPES = {
+    "FID": "string",
+    "angebot": np.float32,
+    "strasse": "string",
+    "shape": "string",
+}
+LINE_PARKING_TYPE = "Parkplatz"
+
+# ETRS89 / UTM zone 32N, on the GRS80 ellipsoid
+UTM_ZONE = 32
+UTM_SCALE = 0.9996
+UTM_FALSE_EASTING = 500_000.0
+GRS80_A = 6_378_137.0
+GRS80_F = 1 / 298.257222101
+
+COLUMNS = list(PARKING_DTYPES)
+
+STAGING_SQL = """
+    CREATE TEMPORARY TABLE parking_staging (LIKE parking INCLUDING DEFAULTS)
+    ON COMMIT DROP
+"""
+
+COPY_SQL = (
+    f"COPY parking_staging ({', '.join(COLUMNS)}, geom) FROM STDIN WITH (FORMAT csv)"
+)
+
+# Unchanged rows are skipped, so a refresh of an unchanged source writes
+# nothing; DISTINCT ON keeps one row per id if a source repeats one.
+UPSERT_SQL = f"""
+    WITH upserted AS (
+        INSERT INTO parking ({', '.join(COLUMNS)}, geom)
+        SELECT DISTINCT ON (id) {', '.join(COLUMNS)}, geom
+        FROM parking_staging
+        ORDER BY id
+        ON CONFLICT (id) DO UPDATE SET
+            {', '.join(f"{c} = EXCLUDED.{c}" for c in COLUMNS[1:])},
+            geom = EXCLUDED.geom
+        WHERE ({', '.join(f"parking.{c}" for c in COLUMNS[1:])})
+            IS DISTINCT FROM ({', '.join(f"EXCLUDED.{c}" for c in COLUMNS[1:])})
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+    FROM upserted
+"""
+
+PRUNE_SQL = """
+    DELETE FROM parking p
+    WHERE p.parking_type IN (SELECT DISTINCT parking_type FROM parking_staging)
+        AND NOT EXISTS (SELECT 1 FROM parking_staging s WHERE s.id = p.id)
+        AND NOT EXISTS (SELECT 1 FROM history h WHERE h.parking_id = p.id)
+        AND NOT EXISTS (SELECT 1 FROM occupancy_observations o WHERE o.parking_id = p.id)
+"""
+
+
+def utm_to_wgs84(easting, northing, zone=UTM_ZONE):
+    """
+    Inverse transverse Mercator (Krüger series to n^4, sub-millimetre within
+    a zone), northern hemisphere. ETRS89 and WGS84 differ by well under a
+    metre, so the geodetic coordinates are used as WGS84 directly.
+    Returns (longitude, latitude) in degrees.
+    """
+    n = GRS80_F / (2 - GRS80_F)
+    e = np.sqrt(GRS80_F * (2 - GRS80_F))
+    rectifying_radius = GRS80_A / (1 + n) * (1 + n**2 / 4 + n**4 / 64)
+    beta = (
+        n / 2 - 2 * n**2 / 3 + 37 * n**3 / 96 - n**4 / 360,
+        n**2 / 48 + n**3 / 15 - 437 * n**4 / 1440,
+        17 * n**3 / 480 - 37 * n**4 / 840,
+        4397 * n**4 / 161280,
+    )
+
+    xi = np.asarray(northing, dtype=float) / (UTM_SCALE * rectifying_radius)
+    eta = (np.asarray(easting, dtype=float) - UTM_FALSE_EASTING) / (
+        UTM_SCALE * rectifying_radius
+    )
+    xi_prime, eta_prime = xi.copy(), eta.copy()
+    for j, b in enumerate(beta, start=1):
+        xi_prime -= b * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_prime -= b * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+    # conformal latitude, then geodetic latitude by fixed-point iteration
+    tau_prime = np.sin(xi_prime) / np.hypot(np.sinh(eta_prime), np.cos(xi_prime))
+    tau = tau_prime.copy()
+    for _ in range(5):
+        sigma = np.sinh(e * np.arctanh(e * tau / np.sqrt(1 + tau**2)))
+        tau_i = tau * np.sqrt(1 + sigma**2) - sigma * np.sqrt(1 + tau**2)
+        tau += (
+            (tau_prime - tau_i)
+            / np.sqrt(1 + tau_i**2)
+            * (1 + (1 - e**2) * tau**2)
+            / ((1 - e**2) * np.sqrt(1 + tau**2))
+        )
+
+    central_meridian = 6 * zone - 183
+    longitude = central_meridian + np.degrees(np.arctan2(np.sinh(eta_prime), np.cos(xi_prime)))
+    latitude = np.degrees(np.arctan(tau))
+    return longitude, latitude
+
+
+def line_centers(shapes):
+    """
+    Centers (mean vertex) of WKT LINESTRINGs, as (x, y) arrays in the input
+    coordinates; the same definition as the existing combined_parking_data.
+    All vertices are parsed in one pass, missing or non-LINESTRING
+    geometries give NaN.
+    """
+    shapes = pd.Series(shapes, dtype="string")
+    valid = shapes.str.match(r"LINESTRING\s*\(", na=False).to_numpy(dtype=bool)
+    x = np.full(len(shapes), np.nan)
+    y = np.full(len(shapes), np.nan)
+    if not valid.any():
+        return x, y
+
+    vertex_counts = shapes[valid].str.count(",").to_numpy(dtype=np.int64) + 1
+    # one string with all coordinates, parsed in a single call
+    flat = " ".join(shapes[valid].astype(object)).replace("LINESTRING", " ")
+    flat = flat.replace("(", " ").replace(")", " ").replace(",", " ")
+    values = np.array(flat.split(), dtype=float)
+    if len(values) != 2 * vertex_counts.sum():
+        raise ValueError("LINESTRING with other than two coordinates per vertex")
+
+    line = np.repeat(np.arange(len(vertex_counts)), vertex_counts)
+    x[valid] = np.bincount(line, values[0::2]) / vertex_counts
+    y[valid] = np.bincount(line, values[1::2]) / vertex_counts
+    return x, y
+
+
+def lines_to_parking(chunk):
+    """
+    Opendata parking stretches to the parking table layout.
+    """
+    easting, northing = line_centers(chunk["shape"])
+    longitude, latitude = utm_to_wgs84(easting, northing)
+    return pd.DataFrame(
+        {
+            "id": chunk["FID"].to_numpy(),
+            "address": chunk["strasse"].to_numpy(),
+            "capacity": chunk["angebot"].to_numpy(),
+            "latitude": latitude,
+            "longitude": longitude,
+            "parking_type": LINE_PARKING_TYPE,
+        }
+    )
+
+
+def with_geom(frame):
+    """
+    Appends the geom column as EWKT, parsed by PostGIS on COPY; NULL where
+    a coordinate is missing.
+    """
+    geom = (
+        "SRID=4326;POINT("
+        + frame["longitude"].map(repr)
+        + " "
+        + frame["latitude"].map(repr)
+        + ")"
+    )
+    missing = frame["longitude"].isna() | frame["latitude"].isna()
+    return frame[COLUMNS].assign(geom=geom.mask(missing))
+
+
+def iter_sources(lines=(), points=()):
+    for path in lines:
+        for chunk in iter_chunks(path, LINE_DTYPES):
+            yield lines_to_parking(chunk)
+    for path in points:
+        yield from iter_chunks(path, PARKING_DTYPES)
+
+
+def ingest_parking(lines=(), points=(), prune=False):
+    """
+    Stages all sources and merges them into parking in one transaction.
+    Returns (staged, inserted, updated, deleted) row counts.
+    """
+    conn = engine.raw_connection()
+    staged = deleted = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute(STAGING_SQL)
+            for frame in iter_sources(lines, points):
+                buffer = io.StringIO()
+                with_geom(frame).to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                cur.copy_expert(COPY_SQL, buffer)
+                staged += len(frame)
+            cur.execute("ANALYZE parking_staging")
+            cur.execute(UPSERT_SQL)
+            inserted, updated = cur.fetchone()
+            if prune:
+                cur.execute(PRUNE_SQL)
+                deleted = cur.rowcount
+            rebuild_zones(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return staged, inserted, updated, deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge parking sources into the parking table")
+    parser.add_argument(
+        "--lines",
+        nargs="+",
+        default=[],
+        help="opendata parking lots with EPSG:25832 LINESTRINGs, CSV or Parquet",
+    )
+    parser.add_argument(
+        "--points",
+        nargs="+",
+        default=[],
+        help="combined_parking_data layout (WGS84), CSV or Parquet",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="delete spots of the ingested parking types that are not in the sources",
+    )
+    args = parser.parse_args(argv)
+    if not args.lines and not args.points:
+        parser.error("nothing to ingest, pass --lines and/or --points")
+
+    start = time.perf_counter()
+    staged, inserted, updated, deleted = ingest_parking(args.lines, args.points, args.prune)
+    print(
+        f"Staged {staged} rows: {inserted} inserted, {updated} updated, "
+        f"{deleted} deleted in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
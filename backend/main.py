@@ -1,27 +1,221 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import bindparam, func, insert, text, update
 from datetime import timedelta
 
-from models.database import engine, Base
+from models.database import engine, Base, AsyncSessionLocal, async_engine
 from models import user as user_model
 from models import schemas
 import auth
+import encoding
+import metrics
+import profiling
+from cache import GeoCellCache, InMemoryCacheBackend, RedisCacheBackend
+from estimate_updates import EstimateBroadcaster
+from history_buffer import HistoryWriter
 
 from fastapi.middleware.cors import CORSMiddleware
 
-from parking_time_estimators.estimator import ParkingCapacityEstimator
+from parking_time_estimators.estimator import (
+    DAY_TYPES, HOURS, ParkingCapacityEstimator, search_time_from_occupancy
+)
+from parking_time_estimators.lookup import SearchTimeLookup
+from parking_time_estimators.online import OnlineOccupancy
+from spatial_index import SpatialIndex, haversine_m, load_parking_columns, parking_fingerprint
+from zones import ZoneIndex, fill_missing_zones
 
+from contextlib import asynccontextmanager
 from datetime import datetime
-import random
+from typing import List, Literal, Optional
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# The model itself is loaded on first use, from the artifact written by
+# `python -m parking_time_estimators.train` (trained here only if missing).
+# Predictions use the flat export of that model when there is one, see
+# parking_time_estimators.flat_forest.
+estimator = ParkingCapacityEstimator(
+    "/app/synthentic_parking_occupancy.csv",
+    artifact_path=os.getenv("ESTIMATOR_ARTIFACT", "/app/artifacts/estimator.joblib"),
+    flat_path=os.getenv("ESTIMATOR_FLAT", "/app/artifacts/forest_flat"),
+    stage_timer=profiling.stage,
+)
+
+# Precomputed search times per spot/day type/hour, see parking_time_estimators.lookup
+search_times = SearchTimeLookup(
+    os.getenv("SEARCH_TIME_TABLE", "/app/artifacts/search_times"), estimator
+)
+
+
+# In-memory nearest-parking index, see spatial_index.py. /nearest falls
+# back to PostGIS while it is disabled or not loaded yet. The zones of
+# /nearest?group=zones (see zones.py) are built along with it.
+SPATIAL_INDEX_ENABLED = os.getenv("SPATIAL_INDEX_ENABLED", "1") == "1"
+PARKING_REFRESH_SECONDS = float(os.getenv("PARKING_REFRESH_SECONDS", "300"))
+spatial_index = None
+zone_index = None
+# ids of all spots as of the last refresh, for cheap checks of client ids
+parking_ids = None
+_parking_fingerprint = None
+_parking_refresh_lock = threading.Lock()
+
+
+def refresh_parking_data(force=False):
+    """
+    Reloads the spatial and zone indexes and incrementally rebuilds the
+    search time table whenever the parking table changed (or the model,
+    with force). Runs from both refresh threads, one at a time, so indexes
+    and zones are always published from the same load.
+    """
+    global spatial_index, zone_index, parking_ids, _parking_fingerprint
+    with _parking_refresh_lock:
+        with engine.connect() as conn:
+            fingerprint = parking_fingerprint(conn)
+            if fingerprint == _parking_fingerprint and not force:
+                return
+            columns = load_parking_columns(conn)
+
+        if fingerprint != _parking_fingerprint:
+            # the PostGIS fallback of /nearest?group=zones reads parking_zones
+            try:
+                count = fill_missing_zones(engine)
+                if count is not None:
+                    print(f"Parking zones were empty, built {count}.")
+            except Exception as e:
+                print(f"Could not fill the parking zones: {e}")
+
+        if SPATIAL_INDEX_ENABLED and fingerprint != _parking_fingerprint:
+            # both built before either is published
+            index = SpatialIndex(columns, fingerprint)
+            spatial_index, zone_index = index, ZoneIndex(index)
+            print(f"Spatial index loaded ({len(spatial_index)} spots, {len(zone_index)} zones).")
+
+        parking_ids = frozenset(columns["id"])
+        recomputed = search_times.rebuild(
+            columns["id"], columns["capacity"], columns["latitude"], columns["longitude"]
+        )
+        print(f"Search time table up to date ({recomputed} spots recomputed).")
+        _parking_fingerprint = fingerprint
+
+
+def parking_refresh_loop():
+    while True:
+        try:
+            refresh_parking_data()
+        except Exception as e:
+            print(f"Could not refresh parking data: {e}")
+        time.sleep(PARKING_REFRESH_SECONDS)
 
-print("Loading parking capacity estimator model...")
-estimator = ParkingCapacityEstimator("/app/synthentic_parking_occupancy.csv")
-print("Model loaded.")
 
+# Live occupancy observations blended into the forest predictions, see
+# parking_time_estimators.online. The same loop swaps in a retrained
+# estimator artifact without a restart.
+ONLINE_UPDATES = os.getenv("ONLINE_UPDATES", "1") == "1"
+MODEL_REFRESH_SECONDS = float(os.getenv("MODEL_REFRESH_SECONDS", "60"))
+online_occupancy = OnlineOccupancy(
+    engine, prior_weight=float(os.getenv("ONLINE_PRIOR_WEIGHT", "5"))
+)
+
+
+def model_refresh_loop():
+    while True:
+        time.sleep(MODEL_REFRESH_SECONDS)
+        try:
+            if estimator.reload():
+                print(f"Estimator model swapped ({estimator.fingerprint}).")
+                refresh_parking_data(force=True)
+            if ONLINE_UPDATES:
+                online_occupancy.refresh()
+        except Exception as e:
+            print(f"Could not refresh the model: {e}")
 
-app = FastAPI()
+
+# Write-behind buffering for /history, see history_buffer.py. With
+# HISTORY_WRITE_BEHIND=0 (or ?sync=true) events are written immediately.
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "1") == "1"
+history_writer = HistoryWriter(
+    AsyncSessionLocal,
+    batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0")),
+    on_flush=lambda user_ids: [auth.invalidate_user(user_id) for user_id in user_ids],
+)
+
+
+# Response cache for location-based lookups, keyed by geo cell, radius and
+# the (day type, hour) bucket. Set GEO_CACHE_REDIS_URL to share it between
+# workers (needs the redis package).
+GEO_CACHE_ENABLED = os.getenv("GEO_CACHE_ENABLED", "1") == "1"
+if os.getenv("GEO_CACHE_REDIS_URL"):
+    _geo_cache_backend = RedisCacheBackend(os.environ["GEO_CACHE_REDIS_URL"])
+else:
+    _geo_cache_backend = InMemoryCacheBackend(
+        maxsize=int(os.getenv("GEO_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("GEO_CACHE_TTL", "300")),
+    )
+geo_cache = GeoCellCache(
+    _geo_cache_backend,
+    cell_size_m=float(os.getenv("GEO_CACHE_CELL_M", "25")),
+    ttl=float(os.getenv("GEO_CACHE_TTL", "300")),
+)
+
+
+# Set once the estimator is loaded, see /ready. Under gunicorn that happens
+# in the master before the workers are forked (gunicorn.conf.py calls
+# preload), otherwise in a background thread at startup.
+model_ready = threading.Event()
+
+
+def load_model():
+    try:
+        estimator.load()
+    except Exception as e:
+        print(f"Could not load the estimator: {e}")
+        return
+    model_ready.set()
+
+
+def preload():
+    """
+    Loads the read-only state every worker needs: the model, the spatial
+    index and the search time table. Run in the gunicorn master, so forked
+    workers start warm and share these pages copy-on-write. The master's
+    pooled DB connections are closed, they must not be shared by workers.
+    """
+    start = time.perf_counter()
+    load_model()
+    try:
+        refresh_parking_data()
+    except Exception as e:
+        print(f"Could not load parking data: {e}")
+    engine.dispose()
+    print(f"Preloaded in {time.perf_counter() - start:.1f}s.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not model_ready.is_set():
+        threading.Thread(target=load_model, daemon=True).start()
+    # Requests fall back to PostGIS and the forest until this has run once
+    # (immediately up to date if preloaded)
+    threading.Thread(target=parking_refresh_loop, daemon=True).start()
+    threading.Thread(target=model_refresh_loop, daemon=True).start()
+    history_writer.start()
+    estimate_updates.start()
+    yield
+    await estimate_updates.close()
+    await history_writer.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -33,33 +227,109 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Request latency / in-flight per route plus hot-path timers, see metrics.py
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.Gauge(
+        "parkiest_db_pool_connections",
+        "Connections per state in the SQLAlchemy pools",
+        ("engine", "state"),
+        callback=lambda: metrics.pool_stats({"sync": engine, "async": async_engine}),
+    )
+    metrics.Gauge(
+        "parkiest_history_pending_events",
+        "History events waiting for the next write-behind flush",
+        callback=lambda: {(): len(history_writer)},
+    )
+    metrics.Gauge(
+        "parkiest_update_subscribers",
+        "Open /updates streams",
+        callback=lambda: {(): len(estimate_updates)},
+    )
+
+    @app.get("/metrics", include_in_schema=False)
+    def read_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Opt-in request profiles and slow request capture, see profiling.py
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+
+def require_profile_token(request: Request):
+    # the debug endpoints do not exist without a token
+    if profiling.PROFILE_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.is_admin(request.headers.get(profiling.HEADER)):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+@app.get("/debug/slow_requests", include_in_schema=False, dependencies=[Depends(require_profile_token)])
+async def read_slow_requests():
+    """
+    Summaries of the captured slow and profiled requests, newest first.
+    """
+    return await run_in_threadpool(profiling.slow_requests.summaries)
+
+
+@app.get("/debug/slow_requests/{record_id}", include_in_schema=False, dependencies=[Depends(require_profile_token)])
+async def read_slow_request(record_id: str):
+    """
+    One captured request: SQL statements, stage timings and stack samples.
+    """
+    record = await run_in_threadpool(profiling.slow_requests.read, record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return Response(
+        record,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{record_id}.json"'},
+    )
+
 
 @app.get("/")
 async def hello():
     return {"msg": "Hello"}
 
 
+@app.get("/ready")
+async def read_ready():
+    """
+    Readiness probe: 503 until the estimator is loaded. The spatial index
+    and the search time table are reported too but not required, requests
+    fall back to PostGIS and the forest without them.
+    """
+    state = {
+        "model": model_ready.is_set(),
+        "spatial_index": spatial_index is not None,
+        "search_time_table": search_times.get() is not None,
+        "pid": os.getpid(),
+    }
+    return JSONResponse(state, status_code=200 if state["model"] else 503)
+
+
 @app.post("/register", response_model=schemas.UserRead, status_code=status.HTTP_201_CREATED)
-def register(user_in: schemas.UserCreate, db: Session = Depends(auth.get_db)):
-    existing = db.query(user_model.User).filter(user_model.User.email == user_in.email).first()
+async def register(user_in: schemas.UserCreate, db: AsyncSession = Depends(auth.get_async_db)):
+    existing = await auth.get_user_by_email(db, user_in.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     try:
-        hashed = auth.get_password_hash(user_in.password)
+        hashed = await auth.hash_password(user_in.password)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     user = user_model.User(email=user_in.email, hashed_password=hashed, name=user_in.name, saved_time=0.0)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(auth.get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(auth.get_async_db)):
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,99 +338,561 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @app.get("/users/me", response_model=schemas.UserRead)
-def read_users_me(current_user: user_model.User = Depends(auth.get_current_user)):
+async def read_users_me(current_user: schemas.UserRead = Depends(auth.get_current_user)):
     return current_user
 
-@app.get("/parking")
-def read_parking(location: str, db: Session = Depends(auth.get_db)):
-    if not location:
-        return []
-    parking_spots = db.query(user_model.Parking).filter(user_model.Parking.address.contains(location)).all()
-    return parking_spots
+# capacity as float8, so rows go to the encoder as they are; the score
+# (last, not part of the response) is only the sort and cursor key
+PARKING_FIELDS = ("id", "address", "capacity", "latitude", "longitude", "parking_type")
+PARKING_SEARCH_COLUMNS = """
+    SELECT id, address, capacity::float8 AS capacity, latitude, longitude, parking_type,
+           similarity(address, :location) AS score
+    FROM parking
+    WHERE address ILIKE :pattern ESCAPE '\\'
+"""
+PARKING_SEARCH_SQL = text(PARKING_SEARCH_COLUMNS + """
+    ORDER BY score DESC, id
+    LIMIT :limit
+""")
+# keyset pagination: continue after the (score, id) of the previous page
+PARKING_SEARCH_AFTER_SQL = text(PARKING_SEARCH_COLUMNS + """
+      AND (similarity(address, :location) < CAST(:after_score AS real)
+           OR (similarity(address, :location) = CAST(:after_score AS real) AND id > :after_id))
+    ORDER BY score DESC, id
+    LIMIT :limit
+""")
 
-@app.get("/nearest")
-def read_nearest(
-    latitude: float,
-    longitude: float,
-    radius_m: float = 500,        # radius in meters
-    db: Session = Depends(auth.get_db)
+
+def _encode_cursor(score: float, parking_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, parking_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        score, parking_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), str(parking_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/parking", response_model=List[schemas.ParkingSpotRead])
+async def read_parking(
+    location: str,
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(auth.get_async_db)
 ):
     """
-    Returns the nearest parking spots within the specified radius.
-    Uses PostGIS geography-based distance queries.
-    """
-
-    sql = text("""
-        SELECT
-            id,
-            address,
-            capacity,
-            latitude,
-            longitude,
-            parking_type,
-            ST_Distance(
-                geom,
-                ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
-            ) AS distance_m
+    Address search backed by the pg_trgm GIN index, best matches first.
+    Returns at most `limit` rows; when there are more, the X-Next-Cursor
+    response header holds the cursor for the next page. Encoded as
+    negotiated by Accept, see encoding.py.
+    """
+    if not location:
+        return encoding.rows_response(request, PARKING_FIELDS, [])
+
+    escaped = location.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    params = {"location": location, "pattern": f"%{escaped}%", "limit": limit + 1}
+    if cursor:
+        params["after_score"], params["after_id"] = _decode_cursor(cursor)
+        rows = (await db.execute(PARKING_SEARCH_AFTER_SQL, params)).fetchall()
+    else:
+        rows = (await db.execute(PARKING_SEARCH_SQL, params)).fetchall()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(rows[-1].score, rows[-1].id)
+
+    return encoding.rows_response(request, PARKING_FIELDS, rows, headers)
+
+NEAREST_SQL = text("""
+    SELECT
+        id,
+        address,
+        capacity::float8 AS capacity,
+        latitude,
+        longitude,
+        parking_type,
+        ST_Distance(
+            geom,
+            ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
+        ) AS distance_m
+    FROM parking
+    WHERE ST_DWithin(
+        geom,
+        ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,
+        :radius
+    )
+    ORDER BY distance_m
+    LIMIT :limit;
+""")
+
+# Zones with a segment within the radius, by distance to their centroid
+NEAREST_ZONES_SQL = text("""
+    SELECT
+        id,
+        address,
+        capacity::float8 AS capacity,
+        latitude,
+        longitude,
+        parking_type,
+        spot_count,
+        representative_id,
+        ST_Distance(
+            geom,
+            ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
+        ) AS distance_m
+    FROM parking_zones
+    WHERE id IN (
+        SELECT zone_id
         FROM parking
         WHERE ST_DWithin(
             geom,
             ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,
             :radius
         )
-        ORDER BY distance_m
-        LIMIT 20;
-    """)
+    )
+    ORDER BY distance_m
+    LIMIT :limit;
+""")
+
+REPRESENTATIVES_SQL = text("""
+    SELECT id, capacity::float8 AS capacity, latitude, longitude
+    FROM parking
+    WHERE id = ANY(:ids)
+""")
+
+ZONE_SPOTS_SQL = text("""
+    SELECT
+        id,
+        address,
+        capacity::float8 AS capacity,
+        latitude,
+        longitude,
+        parking_type,
+        ST_Distance(
+            geom,
+            ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography
+        ) AS distance_m
+    FROM parking
+    WHERE zone_id = :zone_id AND geom IS NOT NULL
+    ORDER BY distance_m
+""")
+
+
+NEAREST_LIMIT = 20
+
+
+async def query_nearest(
+    db: AsyncSession,
+    latitude: float,
+    longitude: float,
+    radius_m: float,
+    group: str = "spots",
+    limit: int = NEAREST_LIMIT,
+):
+    """
+    The `limit` nearest spots, or with group="zones" the nearest zones.
+    """
+    index = zone_index if group == "zones" else spatial_index
+    if index is not None:
+        with metrics.NEAREST_STAGE_SECONDS.time("index_query"):
+            return index.nearest(latitude, longitude, radius_m, limit)
+
+    with metrics.NEAREST_STAGE_SECONDS.time("postgis_query"):
+        results = (await db.execute(NEAREST_ZONES_SQL if group == "zones" else NEAREST_SQL, {
+            "lat": latitude,
+            "lon": longitude,
+            "radius": radius_m,
+            "limit": limit
+        })).fetchall()
+
+    with metrics.NEAREST_STAGE_SECONDS.time("postgis_rows"):
+        # columns are cast in SQL, the rows only need to become dicts
+        return [row._asdict() for row in results]
+
+
+# Candidates the geo-cell cache keeps per cell, so that the nearest
+# NEAREST_LIMIT of any point in the cell are almost always among them
+GEO_CACHE_CANDIDATES = 2 * NEAREST_LIMIT
+
+
+async def cached_nearby(namespace, latitude, longitude, radius_m, compute, version="", within=None):
+    """
+    Serves the nearest NEAREST_LIMIT results of
+    `compute(latitude, longitude, radius_m, limit)` (ordered by distance)
+    through the geo-cell cache.
+
+    On a miss, GEO_CACHE_CANDIDATES candidates are computed for the cell
+    center, within radius_m plus the cell's half-diagonal, which covers
+    every point of the cell. Each request re-measures distance_m from its
+    own point, keeps the candidates within radius_m and returns the
+    nearest. `within(record, latitude, longitude, radius_m)` decides what
+    is within radius_m when it is not distance_m (zones: any segment);
+    None means it cannot tell. When the candidates may lack a result for
+    this point (they were cut off by the limit too close to it), or
+    within() cannot tell, the result is computed for the point instead.
+    """
+    if not GEO_CACHE_ENABLED:
+        return await compute(latitude, longitude, radius_m, NEAREST_LIMIT)
+
+    hour, day_type = get_current_hour_and_day_initial()
+    cell, center_lat, center_lon = geo_cache.cell(latitude, longitude)
+    key = geo_cache.key(namespace, cell, radius_m, day_type, hour, version=version)
+    with metrics.NEAREST_STAGE_SECONDS.time("cache_get"):
+        candidates = await geo_cache.get(key)
+    if candidates is None:
+        candidates = await compute(
+            center_lat, center_lon, radius_m + geo_cache.half_diagonal_m, GEO_CACHE_CANDIDATES
+        )
+        with metrics.NEAREST_STAGE_SECONDS.time("cache_set"):
+            await geo_cache.set(key, candidates)
+    if not candidates:
+        return []
+
+    # distance of the farthest candidate from the cell center, before
+    # distance_m is re-measured from this point; every get decodes fresh
+    # records (and a miss hands us our own), so they are updated in place
+    reach_m = max(spot["distance_m"] for spot in candidates)
+    spots = candidates
+    distances = haversine_m(
+        latitude,
+        longitude,
+        [spot["latitude"] for spot in spots],
+        [spot["longitude"] for spot in spots],
+    )
+    for spot, distance in zip(spots, distances.tolist()):
+        spot["distance_m"] = distance
+    if within is None:
+        spots = [spot for spot in spots if spot["distance_m"] <= radius_m]
+    else:
+        inside = [within(spot, latitude, longitude, radius_m) for spot in spots]
+        if None in inside:
+            return await compute(latitude, longitude, radius_m, NEAREST_LIMIT)
+        spots = [spot for spot, ok in zip(spots, inside) if ok]
+    spots.sort(key=lambda spot: spot["distance_m"])
+
+    if len(candidates) >= GEO_CACHE_CANDIDATES:
+        # candidates left out are at least this far from the point
+        cut_off_m = reach_m - float(
+            haversine_m(latitude, longitude, [center_lat], [center_lon])[0]
+        )
+        if len(spots) < NEAREST_LIMIT or spots[NEAREST_LIMIT - 1]["distance_m"] > cut_off_m:
+            return await compute(latitude, longitude, radius_m, NEAREST_LIMIT)
+    return spots[:NEAREST_LIMIT]
+
+
+def _zone_within(zone, latitude, longitude, radius_m):
+    if zone_index is None:
+        return None
+    distance = zone_index.nearest_member_m(zone["id"], latitude, longitude)
+    return None if distance is None else distance <= radius_m
+
+
+def _listing_response(request, spots):
+    # rendered here rather than by FastAPI, so serialization can be timed
+    with metrics.NEAREST_STAGE_SECONDS.time("serialize"):
+        return encoding.records_response(request, spots)
+
+
+def _cache_version(*parts):
+    # short digest of whatever the cached result depends on
+    return hashlib.md5(":".join(str(p) for p in parts).encode()).hexdigest()[:12]
+
+
+@app.get("/nearest", response_model=List[schemas.NearbyParkingRead])
+async def read_nearest(
+    request: Request,
+    latitude: float,
+    longitude: float,
+    radius_m: float = 500,        # radius in meters
+    group: Literal["spots", "zones"] = "spots",
+    db: AsyncSession = Depends(auth.get_async_db)
+):
+    """
+    Returns the nearest parking spots within the specified radius.
+    Served from the geo-cell cache or the in-memory spatial index, or
+    PostGIS geography-based distance queries while the index is not
+    available.
+
+    With group=zones, returns the zones with a spot within the radius
+    instead (street segments merged per street and grid cell, see
+    zones.py), nearest centroid first; /zones/{zone_id}/spots lists their
+    segments.
+    """
+    async def compute(lat, lon, radius, limit):
+        return await query_nearest(db, lat, lon, radius, group, limit)
+
+    spots = await cached_nearby(
+        "nearest" if group == "spots" else "nearest_zones",
+        latitude, longitude, radius_m, compute,
+        version=_cache_version(_parking_fingerprint),
+        within=_zone_within if group == "zones" else None,
+    )
+    return _listing_response(request, spots)
 
-    results = db.execute(sql, {
-        "lat": latitude,
-        "lon": longitude,
-        "radius": radius_m
-    }).fetchall()
 
+def _capacities(spots):
+    # some spots have no capacity on record
+    return np.array(
+        [float(spot["capacity"]) if spot["capacity"] is not None else np.nan for spot in spots]
+    )
+
+
+async def representative_spots(db, zones):
+    """
+    The representative segment of each zone (id, capacity, latitude,
+    longitude); the zone itself, under the representative's id, where
+    the segment is gone.
+    """
+    ids = [zone["representative_id"] for zone in zones]
+    if zone_index is not None:
+        found = zone_index.spots_by_id(ids)
+    else:
+        rows = (await db.execute(REPRESENTATIVES_SQL, {"ids": ids})).fetchall()
+        found = {row.id: row._asdict() for row in rows}
     return [
-        {
-            "id": row.id,
-            "address": row.address,
-            "capacity": row.capacity,
-            "latitude": row.latitude,
-            "longitude": row.longitude,
-            "parking_type": row.parking_type,
-            "distance_m": float(row.distance_m)
-        }
-        for row in results
+        found.get(spot_id) or {**zone, "id": spot_id}
+        for spot_id, zone in zip(ids, zones)
     ]
 
+
+async def nearest_with_estimates(db, latitude, longitude, radius_m, group="spots", limit=NEAREST_LIMIT):
+    """
+    The nearest spots (or zones) with their estimated search times, by
+    distance.
+    """
+    spots = await query_nearest(db, latitude, longitude, radius_m, group, limit)
+    if not spots:
+        return []
+
+    # a zone is estimated by the occupancy of its representative segment,
+    # as that segment (capacity, location) like in the search time table;
+    # only the search time uses the zone's capacity
+    basis = await representative_spots(db, spots) if group == "zones" else spots
+
+    hour, day_type = get_current_hour_and_day_initial()
+    # may fall back to the forest, which must not block the event loop
+    with metrics.NEAREST_STAGE_SECONDS.time("estimates"):
+        occupancy = await run_in_threadpool(
+            estimate_occupancy,
+            day_type,
+            hour,
+            spot_ids=[spot["id"] for spot in basis],
+            total_capacity=_capacities(basis),
+            latitude=[spot["latitude"] for spot in basis],
+            longitude=[spot["longitude"] for spot in basis],
+        )
+    estimates = search_time_from_occupancy(occupancy, _capacities(spots))
+
+    for spot, estimate in zip(spots, estimates):
+        # no estimate (null) where the formula needs the unknown capacity
+        spot["estimated_search_time_minutes"] = float(estimate) if np.isfinite(estimate) else None
+    return spots
+
+
+@app.get("/nearest_with_estimates", response_model=List[schemas.NearbyParkingRead])
+async def read_nearest_with_estimates(
+    request: Request,
+    latitude: float,
+    longitude: float,
+    radius_m: float = 500,        # radius in meters
+    group: Literal["spots", "zones"] = "spots",
+    db: AsyncSession = Depends(auth.get_async_db)
+):
+    """
+    Same candidates as /nearest, each with its estimated search time,
+    ranked by estimated search time (fastest first). Replaces one /nearest
+    call plus one /estimate_search_time call per spot.
+    """
+    async def compute(lat, lon, radius, limit):
+        return await nearest_with_estimates(db, lat, lon, radius, group, limit)
+
+    spots = await cached_nearby(
+        "nearest_with_estimates" if group == "spots" else "nearest_zones_with_estimates",
+        latitude, longitude, radius_m, compute,
+        version=_cache_version(
+            _parking_fingerprint, estimator.fingerprint, online_occupancy.version
+        ),
+        within=_zone_within if group == "zones" else None,
+    )
+    spots.sort(
+        key=lambda spot: (
+            spot["estimated_search_time_minutes"] is None,
+            spot["estimated_search_time_minutes"] or 0.0,
+        )
+    )
+    return _listing_response(request, spots)
+
+
+@app.get("/zones/{zone_id}/spots", response_model=List[schemas.NearbyParkingRead])
+async def read_zone_spots(
+    request: Request,
+    zone_id: str,
+    latitude: float,
+    longitude: float,
+    db: AsyncSession = Depends(auth.get_async_db)
+):
+    """
+    The parking spots of a zone from /nearest?group=zones, nearest to the
+    given point first.
+    """
+    index = zone_index
+    if index is not None:
+        spots = index.members(zone_id, latitude, longitude)
+    else:
+        results = (await db.execute(ZONE_SPOTS_SQL, {
+            "zone_id": zone_id,
+            "lat": latitude,
+            "lon": longitude,
+        })).fetchall()
+        spots = [row._asdict() for row in results] or None
+    if spots is None:
+        raise HTTPException(status_code=404, detail="Unknown zone")
+    return _listing_response(request, spots)
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    """
+    Hit ratio and memory use of the response and user caches.
+    """
+    if hasattr(geo_cache.backend, "refresh_memory"):
+        await geo_cache.backend.refresh_memory()
+    return {"geo_cell": geo_cache.stats(), "users": auth.user_cache.stats()}
+
+def constraint_name(error):
+    """
+    Name of the constraint an IntegrityError violated, if the driver says:
+    psycopg2 in diag, asyncpg on the exception the DB-API error wraps.
+    """
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None:
+        return diag.constraint_name
+    return getattr(error.orig.__cause__, "constraint_name", None)
+
+
+async def parking_exists(db, parking_id):
+    # spots added since the last refresh are not in parking_ids yet
+    if parking_ids is not None and parking_id in parking_ids:
+        return True
+    result = await db.execute(text("SELECT 1 FROM parking WHERE id = :id"), {"id": parking_id})
+    return result.first() is not None
+
+
 @app.post("/history", response_model=schemas.HistoryEventRead, status_code=status.HTTP_201_CREATED)
-def create_history_event(
+async def create_history_event(
     event_in: schemas.HistoryEventCreate,
-    current_user: user_model.User = Depends(auth.get_current_user),
-    db: Session = Depends(auth.get_db)
+    response: Response,
+    sync: bool = False,
+    user_id: int = Depends(auth.get_current_user_id),
+    db: AsyncSession = Depends(auth.get_async_db)
 ):
+    """
+    Records a history event. By default the event is queued and written in
+    bulk shortly after (202, no id yet); sync=true writes it before answering.
+    """
+    if not await parking_exists(db, event_in.parking_id):
+        raise HTTPException(status_code=422, detail="Unknown parking id")
+
+    if HISTORY_WRITE_BEHIND and not sync:
+        timestamp = datetime.utcnow()
+        try:
+            history_writer.add(user_id, event_in.parking_id, event_in.saved_time, timestamp)
+        except OverflowError:
+            raise HTTPException(status_code=503, detail="History is temporarily unavailable")
+        response.status_code = status.HTTP_202_ACCEPTED
+        return schemas.HistoryEventRead(
+            id=None,
+            user_id=user_id,
+            parking_id=event_in.parking_id,
+            saved_time=event_in.saved_time,
+            timestamp=timestamp
+        )
+
     event = user_model.HistoryEvent(
-        user_id=current_user.id,
+        user_id=user_id,
         parking_id=event_in.parking_id,
         saved_time=event_in.saved_time
     )
 
-    # add event to DB
+    # add event and update user's total saved time in one transaction;
+    # the increment happens in the DB so concurrent events can't race
     db.add(event)
-    db.commit()
-    db.refresh(event)
-
-    # update user's total saved time
-    current_user.saved_time += event_in.saved_time
-    db.commit()
+    await db.execute(
+        update(user_model.User)
+        .where(user_model.User.id == user_id)
+        .values(saved_time=func.coalesce(user_model.User.saved_time, 0) + event_in.saved_time)
+    )
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        # the spot or the user was deleted since they were checked
+        constraint = constraint_name(e)
+        if constraint == "history_parking_id_fkey":
+            raise HTTPException(status_code=422, detail="Unknown parking id")
+        if constraint == "history_user_id_fkey":
+            auth.invalidate_user(user_id)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        raise
+    auth.invalidate_user(user_id)
     return event
 
-def get_current_hour_and_day_initial():
+@app.post("/observations", status_code=status.HTTP_201_CREATED)
+async def create_observations(
+    batch: schemas.OccupancyObservationBatch,
+    user_id: int = Depends(auth.get_current_user_id),
+    db: AsyncSession = Depends(auth.get_async_db)
+):
+    """
+    Stores occupancy observations (append-only). They show up in the
+    estimates with the next model refresh, within MODEL_REFRESH_SECONDS.
+    """
     now = datetime.now()
+    rows = []
+    for observation in batch.observations:
+        if observation.occupied + observation.free == 0:
+            raise HTTPException(status_code=422, detail="occupied + free must be positive")
+        observed_at = observation.observed_at or now
+        rows.append({
+            "parking_id": observation.parking_id,
+            "observed_at": local_time(observed_at),
+            "occupied": observation.occupied,
+            "free": observation.free,
+        })
+
+    try:
+        await db.execute(insert(user_model.OccupancyObservation), rows)
+        await db.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=422, detail="Unknown parking id")
+    return {"stored": len(rows)}
+
+
+def local_time(moment):
+    # naive server local time, like the estimator's hour buckets
+    if moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def get_current_hour_and_day_initial(at=None):
+    """
+    Hour and day type of `at` (a datetime), or of now.
+    """
+    now = local_time(at) if at is not None else datetime.now()
     hour_24 = now.hour
 
     weekday_idx = now.weekday()
@@ -173,24 +905,311 @@ def get_current_hour_and_day_initial():
     
     return hour_24, day_initial
 
+
+def estimate_occupancy(day_type, hour, spot_ids, total_capacity, latitude, longitude):
+    """
+    Occupancy from the precomputed table where the spot is known (with
+    the capacity and coordinates on record), falling back to one batched
+    forest call for the rest, blended with the live observations of each
+    spot.
+    """
+    table = search_times.get()
+    if table is not None:
+        with metrics.ESTIMATE_SECONDS.time("table"), profiling.stage("estimates.table"):
+            # spots sent with other attributes than on record go to the forest
+            occupancy = table.lookup(spot_ids, day_type, hour, total_capacity, latitude, longitude)
+        metrics.ESTIMATE_BATCH_SIZE.observe(len(spot_ids), "table")
+    else:
+        occupancy = np.full(len(spot_ids), np.nan)
+
+    missing = np.isnan(occupancy)
+    if missing.any():
+        with metrics.ESTIMATE_SECONDS.time("forest"), profiling.stage("estimates.forest"):
+            occupancy[missing] = estimator.predict_many(
+                day_type,
+                hour,
+                np.asarray(total_capacity, dtype=float)[missing],
+                np.asarray(latitude, dtype=float)[missing],
+                np.asarray(longitude, dtype=float)[missing],
+            )
+        metrics.ESTIMATE_BATCH_SIZE.observe(int(missing.sum()), "forest")
+    if ONLINE_UPDATES:
+        with metrics.ESTIMATE_SECONDS.time("online"), profiling.stage("estimates.online"):
+            occupancy = online_occupancy.blend(spot_ids, day_type, hour, occupancy)
+    return occupancy
+
+
+def estimate_search_times(day_type, hour, spot_ids, total_capacity, latitude, longitude):
+    occupancy = estimate_occupancy(
+        day_type, hour, spot_ids, total_capacity, latitude, longitude
+    )
+    return search_time_from_occupancy(occupancy, total_capacity)
+
+
 @app.post("/estimate_search_time")
 def estimate_search_time(
     input: schemas.EstimateSearchTimeRequest
 ):
     """
-    Estimate parking search time based on input features.
+    Estimate parking search time based on input features, for now or the
+    given arrival time.
+    """
+    hour, day_type = get_current_hour_and_day_initial(input.arrival_at)
+
+    return {"estimated_search_time_minutes": float(estimate_search_times(
+        day_type,
+        hour,
+        spot_ids=[input.parking_id],
+        total_capacity=[input.total_capacity],
+        latitude=[input.latitude],
+        longitude=[input.longitude]
+    )[0])
+    }
+
+
+@app.post("/estimate_search_time/batch")
+def estimate_search_time_batch(
+    input: schemas.EstimateSearchTimeBatchRequest
+):
+    """
+    Estimate parking search time for many spots in one call.
+    Estimates are returned in the order of the input spots.
+    """
+    # one batched call per distinct (hour, day type), usually just one
+    groups = {}
+    for i, spot in enumerate(input.spots):
+        bucket = get_current_hour_and_day_initial(spot.arrival_at or input.arrival_at)
+        groups.setdefault(bucket, []).append(i)
+
+    estimates = np.empty(len(input.spots))
+    for (hour, day_type), indices in groups.items():
+        spots = [input.spots[i] for i in indices]
+        estimates[indices] = estimate_search_times(
+            day_type,
+            hour,
+            spot_ids=[spot.parking_id for spot in spots],
+            total_capacity=[spot.total_capacity for spot in spots],
+            latitude=[spot.latitude for spot in spots],
+            longitude=[spot.longitude for spot in spots],
+        )
+
+    return {"estimated_search_time_minutes": [float(e) for e in estimates]}
+
+
+ARRIVAL_WINDOW_MAX = timedelta(hours=24)
+
+
+def arrival_buckets(start, end=None):
+    """
+    (day type index, hour) of every hour bucket from start to end (both
+    naive local times), as two index arrays.
+    """
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    days, hours = [], []
+    while True:
+        _, day_type = get_current_hour_and_day_initial(hour)
+        days.append(DAY_TYPES.index(day_type))
+        hours.append(hour.hour)
+        hour += timedelta(hours=1)
+        if end is None or hour > end:
+            return np.array(days), np.array(hours)
+
+
+def estimate_occupancy_profiles(spot_ids, total_capacity, latitude, longitude, quantiles=None):
+    """
+    Occupancy of each spot for every day type and hour, shape
+    (n_spots, len(DAY_TYPES), HOURS), blended with the live observations.
+
+    Without quantiles known spots come from the precomputed table and the
+    rest from one forest pass; with quantiles everything comes from the
+    forest, which also returns the per-tree quantiles (None for models
+    without trees).
+    """
+    total_capacity = np.asarray(total_capacity, dtype=float)
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    bounds = []
+    if quantiles is None:
+        occupancy = np.full((len(spot_ids), len(DAY_TYPES), HOURS), np.nan)
+        table = search_times.get()
+        if table is not None:
+            rows = table.matching_rows(spot_ids, total_capacity, latitude, longitude)
+            occupancy[rows >= 0] = table.occupancy[rows[rows >= 0]]
+        missing = np.isnan(occupancy).any(axis=(1, 2))
+        if missing.any():
+            with metrics.ESTIMATE_SECONDS.time("profile"), profiling.stage("estimates.profile"):
+                occupancy[missing] = estimator.predict_profile(
+                    total_capacity[missing], latitude[missing], longitude[missing]
+                )
+            metrics.ESTIMATE_BATCH_SIZE.observe(int(missing.sum()), "profile")
+    else:
+        with metrics.ESTIMATE_SECONDS.time("profile"), profiling.stage("estimates.profile"):
+            occupancy, bounds = estimator.predict_profile(
+                total_capacity, latitude, longitude, quantiles=quantiles
+            )
+        metrics.ESTIMATE_BATCH_SIZE.observe(len(spot_ids), "profile")
+
+    if ONLINE_UPDATES:
+        for d, day_type in enumerate(DAY_TYPES):
+            for hour in range(HOURS):
+                for values in (occupancy, *(b for b in bounds if b is not None)):
+                    values[:, d, hour] = online_occupancy.blend(
+                        spot_ids, day_type, hour, values[:, d, hour]
+                    )
+    return occupancy, bounds
+
+
+def _minutes(values):
+    # JSON-safe: null where the formula needs an unknown capacity
+    return [float(v) if np.isfinite(v) else None for v in np.ravel(values)]
+
+
+@app.post("/estimate_search_time/profile")
+def estimate_search_time_profile(
+    input: schemas.EstimateSearchTimeProfileRequest
+):
+    """
+    Full-day search time profiles (24 hours per day type) of up to 50
+    spots, plus the estimate for the arrival time (a spot's own
+    arrival_at, the request's, or now), or the mean over an arrival window
+    of up to 24 hours.
+
+    With confidence, every value also gets lower and upper bounds from the
+    spread of the forest's trees, e.g. 0.8 for their 10th and 90th
+    percentile. They show how much the trees disagree, they are not a
+    calibrated interval.
     """
+    window = None
+    if input.arrival_until is not None:
+        window = local_time(input.arrival_until) - local_time(input.arrival_at or datetime.now())
+        if window < timedelta(0) or window > ARRIVAL_WINDOW_MAX:
+            raise HTTPException(
+                status_code=422,
+                detail="arrival_until must be within 24 hours after arrival_at",
+            )
+
+    spots = input.spots
+    spot_ids = [spot.parking_id for spot in spots]
+    total_capacity = np.array([spot.total_capacity for spot in spots], dtype=float)
+    quantiles = None
+    if input.confidence is not None:
+        tail = (1 - input.confidence) / 2
+        quantiles = (tail, 1 - tail)
+    occupancy, bounds = estimate_occupancy_profiles(
+        spot_ids,
+        total_capacity,
+        [spot.latitude for spot in spots],
+        [spot.longitude for spot in spots],
+        quantiles,
+    )
+
+    capacity = total_capacity[:, None, None]
+    profiles = search_time_from_occupancy(occupancy, capacity)
+    if bounds and bounds[0] is not None:
+        lower, upper = (search_time_from_occupancy(b, capacity) for b in bounds)
+        # the formula is not monotonic for (almost) full spots
+        lower, upper = np.minimum(lower, upper), np.maximum(lower, upper)
+    else:
+        lower = upper = None
+
+    now = datetime.now()
+    results = []
+    for i, spot in enumerate(spots):
+        start = local_time(spot.arrival_at or input.arrival_at or now)
+        days, hours = arrival_buckets(start, start + window if window is not None else None)
+        result = {
+            "parking_id": spot.parking_id,
+            "estimated_search_time_minutes": _minutes(profiles[i, days, hours].mean())[0],
+            "profile": {
+                day_type: _minutes(profiles[i, d]) for d, day_type in enumerate(DAY_TYPES)
+            },
+        }
+        if lower is not None:
+            result["lower"] = _minutes(lower[i, days, hours].mean())[0]
+            result["upper"] = _minutes(upper[i, days, hours].mean())[0]
+            result["profile_lower"] = {
+                day_type: _minutes(lower[i, d]) for d, day_type in enumerate(DAY_TYPES)
+            }
+            result["profile_upper"] = {
+                day_type: _minutes(upper[i, d]) for d, day_type in enumerate(DAY_TYPES)
+            }
+        results.append(result)
+
+    return {"confidence": input.confidence if lower is not None else None, "spots": results}
+
+
+# Pushed estimate updates, see estimate_updates.py. The version key covers
+# everything an estimate depends on besides the spot itself.
+UPDATES_MAX_SPOTS = int(os.getenv("UPDATES_MAX_SPOTS", "200"))
+
+PARKING_BY_ID_SQL = text("""
+    SELECT id, capacity, latitude, longitude
+    FROM parking
+    WHERE id IN :ids AND latitude IS NOT NULL AND longitude IS NOT NULL
+""").bindparams(bindparam("ids", expanding=True))
+
+
+def _estimate_for_updates(spot_ids, total_capacity, latitude, longitude):
     hour, day_type = get_current_hour_and_day_initial()
+    estimates = estimate_search_times(
+        day_type,
+        hour,
+        spot_ids=spot_ids,
+        total_capacity=total_capacity,
+        latitude=latitude,
+        longitude=longitude,
+    )
+    return estimates, {"day_type": day_type, "hour": hour}
 
-    
 
-    
+def _updates_version():
+    return (
+        get_current_hour_and_day_initial(),
+        estimator.fingerprint,
+        online_occupancy.version if ONLINE_UPDATES else None,
+    )
+
+
+estimate_updates = EstimateBroadcaster(
+    _estimate_for_updates,
+    _updates_version,
+    interval=float(os.getenv("UPDATES_CHECK_SECONDS", "5")),
+    min_change=float(os.getenv("UPDATES_MIN_CHANGE", "0.1")),
+)
+
+
+@app.get("/updates")
+async def stream_updates(
+    request: Request,
+    spot_id: List[str] = Query([]),
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    radius_m: float = 500,
+):
+    """
+    Server-sent events with the estimated search times of the given spots
+    (repeat spot_id) or of the spots /nearest returns for an area: one
+    `snapshot` event, then `update` events with only the changed spots.
+    """
+    area = latitude is not None and longitude is not None
+    if not spot_id and not area:
+        raise HTTPException(status_code=422, detail="Pass spot_id or latitude and longitude")
+    if len(spot_id) > UPDATES_MAX_SPOTS:
+        raise HTTPException(status_code=422, detail=f"At most {UPDATES_MAX_SPOTS} spots")
 
-    return {"estimated_search_time_minutes": estimator.predict_search_time(
-        day_type=day_type,
-        hour=hour,
-        total_capacity=input.total_capacity,
-        latitude=input.latitude,
-        longitude=input.longitude
-    ) + random.uniform(-2, 2)
-    }
\ No newline at end of file
+    # a session only for the lookup, not held for the life of the stream
+    async with AsyncSessionLocal() as db:
+        spots = []
+        if area:
+            spots += await query_nearest(db, latitude, longitude, radius_m)
+        if spot_id:
+            rows = (await db.execute(PARKING_BY_ID_SQL, {"ids": spot_id})).fetchall()
+            spots += [row._asdict() for row in rows]
+    if not spots:
+        raise HTTPException(status_code=404, detail="No parking spots found")
+
+    return StreamingResponse(
+        estimate_updates.stream(spots, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,285 @@
+"""
+Minimal Prometheus-style metrics: counters, gauges and histograms kept in
+process memory and rendered in the text exposition format at /metrics.
+
+With METRICS_ENABLED=0 the middleware is not installed, timers return a
+shared no-op context manager and observe/inc return right away, so the
+instrumented code paths cost one attribute check.
+
+Metrics are per process; with several workers each one reports its own
+(scrape them individually, or aggregate by instance label).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# seconds; covers sub-millisecond lookups up to slow password hashing
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Set/inc/dec gauge, or a callback gauge whose value is read at render
+    time (`callback` returns {label values tuple: value}).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception:
+                values = {}
+            with self._lock:
+                self._values = dict(values)
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels):
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                label_str = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{label_str} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Hot-path metrics, shared by main.py, auth.py and models/database.py
+
+REQUEST_SECONDS = Histogram(
+    "parkiest_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "parkiest_http_requests_in_flight", "Requests currently being served", ("method", "route")
+)
+NEAREST_STAGE_SECONDS = Histogram(
+    "parkiest_nearest_stage_duration_seconds",
+    "Time per stage of the nearest-parking endpoints (index_query, "
+    "postgis_query, postgis_rows, cache_get, cache_set, estimates, serialize)",
+    ("stage",),
+)
+ESTIMATE_SECONDS = Histogram(
+    "parkiest_estimator_duration_seconds",
+    "Occupancy estimation time by source (search time table or forest)",
+    ("source",),
+)
+ESTIMATE_BATCH_SIZE = Histogram(
+    "parkiest_estimator_batch_size",
+    "Spots per estimation call by source",
+    ("source",),
+    buckets=SIZE_BUCKETS,
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "parkiest_password_hash_duration_seconds",
+    "Password hashing time (hash / verify), excluding queueing",
+    ("operation",),
+)
+PASSWORD_QUEUE_SECONDS = Histogram(
+    "parkiest_password_hash_queue_seconds", "Time password jobs waited for a hashing thread"
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "parkiest_db_pool_wait_seconds",
+    "Time spent waiting to check out a pooled DB connection",
+    ("engine",),
+)
+
+
+def pool_stats(engines):
+    """
+    Callback for a pool gauge: {(engine name, state): value} for the
+    QueuePool-like pools of {name: engine} (size, checked_in, checked_out,
+    overflow).
+    """
+    values = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        for state, fn in (
+            ("size", pool.size),
+            ("checked_in", pool.checkedin),
+            ("checked_out", pool.checkedout),
+            # negative while the pool is not full yet
+            ("overflow", lambda: max(pool.overflow(), 0)),
+        ):
+            values[(name, state)] = fn()
+    return values
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and in-flight requests per route
+    template (e.g. /parking, not /parking?location=...).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _route(self, scope):
+        from starlette.routing import Match
+
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method, route, str(status_code))
+            REQUESTS_IN_FLIGHT.dec(method, route)
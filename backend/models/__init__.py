@@ -1,5 +1,13 @@
-from .database import Base, engine, SessionLocal
+from .database import Base, engine, SessionLocal, async_engine, AsyncSessionLocal
 from .user import User
 from . import schemas
 
-__all__ = ["Base", "engine", "SessionLocal", "User", "schemas"]
+__all__ = [
+    "Base",
+    "engine",
+    "SessionLocal",
+    "async_engine",
+    "AsyncSessionLocal",
+    "User",
+    "schemas",
+]
@@ -1,6 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import time
+
+import metrics
+import profiling
 
 # PostgreSQL connection URL
 # SQLALCHEMY_DATABASE_URL = (
@@ -15,15 +21,81 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "mydb")
 SQLALCHEMY_DATABASE_URL = (
     f"postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
 )
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
+)
+
+# Connection pool sizing, shared by the sync and the async engine
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+
+def _timed_pool(pool_class, engine_name):
+    """
+    Pool class that reports how long checkouts take (waiting for a free
+    connection, or opening a new one) to metrics.DB_POOL_WAIT_SECONDS.
+    """
+    class TimedPool(pool_class):
+        def _do_get(self):
+            if not metrics.ENABLED:
+                return super()._do_get()
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, engine_name)
 
-# PostgreSQL engine (no SQLite-specific arguments)
+    return TimedPool
+
+
+# PostgreSQL engine (no SQLite-specific arguments). Used by background
+# jobs and CLIs; request handlers go through async_engine.
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     pool_pre_ping=True,          # recommended for containerized DBs
-    pool_size=5,
-    max_overflow=10
+    poolclass=_timed_pool(QueuePool, "sync"),
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# asyncpg-backed engine for the request handlers
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    pool_pre_ping=True,
+    poolclass=_timed_pool(AsyncAdaptedQueuePool, "async"),
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+def _profile_statements(sync_engine):
+    """
+    Records the statements run for a traced request, with their durations,
+    in its profiling trace (see profiling.py).
+    """
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and profiling.current() is not None:
+            context._profiling_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = profiling.current()
+        start = getattr(context, "_profiling_start", None)
+        if trace is not None and start is not None:
+            trace.add_statement(statement, time.perf_counter() - start, executemany)
+
+
+if profiling.ENABLED:
+    _profile_statements(engine)
+    _profile_statements(async_engine.sync_engine)
+
 Base = declarative_base()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -30,12 +30,31 @@ class ParkingRead(BaseModel):
     class Config:
         from_attributes = True
 
+# Spot listings are encoded by encoding.py without validation, these
+# models document them
+class ParkingSpotRead(BaseModel):
+    id: str
+    address: Optional[str]
+    capacity: Optional[float]
+    latitude: float
+    longitude: float
+    parking_type: Optional[str]
+
+class NearbyParkingRead(ParkingSpotRead):
+    distance_m: float
+    # /nearest_with_estimates only
+    estimated_search_time_minutes: Optional[float] = None
+    # group=zones only
+    spot_count: Optional[int] = None
+    representative_id: Optional[str] = None
+
 class HistoryEventCreate(BaseModel):
     parking_id: str
     saved_time: float
 
 class HistoryEventRead(BaseModel):
-    id: int
+    # None while the event is still queued for a write-behind flush
+    id: Optional[int] = None
     user_id: int
     parking_id: str
     saved_time: float
@@ -48,6 +67,33 @@ class EstimateSearchTimeRequest(BaseModel):
     total_capacity: int
     latitude: float
     longitude: float
+    # lets the server answer from the precomputed search time table
+    parking_id: Optional[str] = None
+    # defaults to now; naive times are server local time
+    arrival_at: Optional[datetime] = None
+
+class EstimateSearchTimeBatchRequest(BaseModel):
+    spots: List[EstimateSearchTimeRequest]
+    # for spots without their own arrival_at
+    arrival_at: Optional[datetime] = None
+
+class EstimateSearchTimeProfileRequest(BaseModel):
+    spots: List[EstimateSearchTimeRequest] = Field(min_length=1, max_length=50)
+    arrival_at: Optional[datetime] = None
+    # estimate the mean over arrival_at .. arrival_until (at most 24 hours)
+    arrival_until: Optional[datetime] = None
+    # e.g. 0.8 for bounds at the 10th and 90th percentile of the trees
+    confidence: Optional[float] = Field(None, gt=0, lt=1)
+
+class OccupancyObservationCreate(BaseModel):
+    parking_id: str
+    occupied: int = Field(ge=0)
+    free: int = Field(ge=0)
+    # defaults to the time the server receives it
+    observed_at: Optional[datetime] = None
+
+class OccupancyObservationBatch(BaseModel):
+    observations: List[OccupancyObservationCreate] = Field(min_length=1, max_length=10000)
 
 
 class Token(BaseModel):
@@ -57,3 +103,4 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[int] = None
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, DateTime, Float
 from datetime import datetime
 from .database import Base
 
@@ -32,3 +32,12 @@ class HistoryEvent(Base):
     parking_id = Column(String, nullable=False)
     saved_time = Column(Float, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+class OccupancyObservation(Base):
+    __tablename__ = "occupancy_observations"
+
+    id = Column(BigInteger, primary_key=True)
+    parking_id = Column(String, nullable=False)
+    observed_at = Column(DateTime, default=datetime.now)
+    occupied = Column(Integer, nullable=False)
+    free = Column(Integer, nullable=False)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import joblib
+import sklearn
+
+# Bump whenever the feature schema or the pickled layout changes, so that
+# old artifacts are rejected instead of silently mispredicting.
+ARTIFACT_VERSION = 1
+
+FEATURES = [
+    "day_type",
+    "total_capacity",
+    "latitude",
+    "longitude",
+    "hour_sin",
+    "hour_cos",
+]
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def data_hash(path, chunk_size=1 << 20):
+    """
+    sha256 of the training data file, stored with the artifact so a model
+    can be traced back to the exact data it was fitted on.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _replace_atomically(path, write):
+    """
+    Writes `path` through write(tmp_path) to a temporary file in the same
+    directory, then renames it over path, so readers never see it half
+    written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_artifact(model, path, training_data_hash, params=None):
+    """
+    Writes the fitted pipeline plus its metadata. The dump is uncompressed
+    so it can be loaded with mmap_mode. Both files are swapped in
+    atomically, the metadata sidecar first: a reader can see the new
+    fingerprint before the new model (and then loads the model to check),
+    but never the new model with a stale or partial sidecar.
+    """
+    artifact = {
+        "version": ARTIFACT_VERSION,
+        "features": FEATURES,
+        "data_sha256": training_data_hash,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "sklearn_version": sklearn.__version__,
+        "params": params or {},
+        "model": model,
+    }
+    metadata = {k: v for k, v in artifact.items() if k != "model"}
+
+    def write_metadata(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _replace_atomically(metadata_path(path), write_metadata)
+    _replace_atomically(path, lambda tmp_path: joblib.dump(artifact, tmp_path))
+    return artifact
+
+
+def metadata_path(path):
+    return f"{path}.json"
+
+
+def read_metadata(path):
+    """
+    Metadata sidecar written next to the artifact, readable without
+    unpickling the model.
+    """
+    with open(metadata_path(path)) as f:
+        return json.load(f)
+
+
+def fingerprint(metadata):
+    """
+    Identifies one trained model; precomputed tables built from it store
+    this value so they can tell when they are stale.
+    """
+    return f"v{metadata['version']}:{metadata['data_sha256']}:{metadata['trained_at']}"
+
+
+def load_artifact(path, mmap_mode="r"):
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+
+    if not isinstance(artifact, dict) or artifact.get("version") != ARTIFACT_VERSION:
+        raise ArtifactError(
+            f"{path} is not a version {ARTIFACT_VERSION} estimator artifact"
+        )
+    if artifact["features"] != FEATURES:
+        raise ArtifactError(f"{path} was trained on features {artifact['features']}")
+    return artifact
@@ -0,0 +1,135 @@
+"""
+Typed, column-pruned loading of the occupancy and parking datasets.
+
+Both Parquet and CSV are accepted; the format is picked by file suffix.
+Only the needed columns are read, with compact dtypes (categorical day
+type, float32 coordinates), so large histories are never materialized as
+object-dtype frames. CSV is parsed in chunks, Parquet is memory-mapped
+and read by row group.
+
+    python -m parking_time_estimators.datasets \
+        synthentic_parking_occupancy.csv synthetic_parking_occupancy.parquet
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+CHUNK_ROWS = 250_000
+
+DAY_TYPE = pd.CategoricalDtype(["WT", "SA", "SO"])
+
+# Columns the estimator trains on
+OCCUPANCY_DTYPES = {
+    "day_type": DAY_TYPE,
+    "hour": np.int8,
+    "total_capacity": np.float32,
+    "latitude": np.float32,
+    "longitude": np.float32,
+    "occupancy_rate": np.float32,
+}
+
+# Columns of the parking table seed (combined_parking_data)
+PARKING_DTYPES = {
+    "id": "string",
+    "address": "string",
+    "capacity": np.float32,
+    "latitude": np.float64,
+    "longitude": np.float64,
+    "parking_type": "category",
+}
+
+
+def is_parquet(path):
+    return str(path).lower().endswith(PARQUET_SUFFIXES)
+
+
+def iter_chunks(path, dtypes, chunk_rows=CHUNK_ROWS):
+    """
+    Yields DataFrames with exactly the columns of `dtypes`, cast to them.
+    """
+    columns = list(dtypes)
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas().astype(dtypes)
+    else:
+        yield from pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunk_rows)
+
+
+def read_table(path, dtypes, chunk_rows=CHUNK_ROWS):
+    chunks = [chunk[list(dtypes)] for chunk in iter_chunks(path, dtypes, chunk_rows)]
+    if not chunks:
+        return pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in dtypes.items()})
+    # categoricals with identical categories stay categorical on concat
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_occupancy(path, chunk_rows=CHUNK_ROWS):
+    return read_table(path, OCCUPANCY_DTYPES, chunk_rows)
+
+
+def read_parking(path, chunk_rows=CHUNK_ROWS):
+    return read_table(path, PARKING_DTYPES, chunk_rows)
+
+
+def to_parquet(src, dst, dtypes=None, chunk_rows=CHUNK_ROWS):
+    """
+    Converts a CSV to Parquet one chunk (row group) at a time. With dtypes,
+    only those columns are kept; otherwise every column is copied and
+    pandas infers the types per chunk. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if dtypes is not None:
+        chunks = iter_chunks(src, dtypes, chunk_rows)
+    else:
+        chunks = pd.read_csv(src, chunksize=chunk_rows)
+
+    tmp_path = f"{dst}.tmp"
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"{src} has no rows")
+    os.replace(tmp_path, dst)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a dataset CSV to Parquet")
+    parser.add_argument("src", help="CSV to convert")
+    parser.add_argument("dst", help="Parquet file to write")
+    parser.add_argument(
+        "--schema",
+        choices=("occupancy", "parking", "all"),
+        default="occupancy",
+        help="typed training/seed columns only, or every column as inferred",
+    )
+    args = parser.parse_args(argv)
+
+    dtypes = {"occupancy": OCCUPANCY_DTYPES, "parking": PARKING_DTYPES, "all": None}
+    rows = to_parquet(args.src, args.dst, dtypes[args.schema])
+    print(
+        f"Wrote {args.dst}: {rows} rows, "
+        f"{os.path.getsize(args.src) / 1e6:.2f} MB -> {os.path.getsize(args.dst) / 1e6:.2f} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,325 @@
-import pandas as pd
+import contextlib
+import os
+import threading
+
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 
+from .artifacts import (
+    FEATURES,
+    ArtifactError,
+    data_hash,
+    fingerprint,
+    load_artifact,
+    read_metadata,
+    save_artifact,
+)
+from .datasets import read_occupancy
+from .flat_forest import FlatForest
+
 FIXED_SEARCH_TIME = 2.5
 TIME_PER_SPOT = 1.2
 TIME_PENALTY = 10
 FACTOR = 2
 
+# Day type buckets (weekday, Saturday, Sunday/holiday) and hours of day
+DAY_TYPES = ("WT", "SA", "SO")
+HOURS = 24
+
+FOREST_PARAMS = {"n_estimators": 300, "max_depth": 12, "random_state": 42}
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def _no_stage(name):
+    return _NULL_STAGE
+
+
+# Regressors the pipeline can be built with, see build_pipeline
+REGRESSORS = {
+    "forest": RandomForestRegressor,
+    "hist_gradient_boosting": HistGradientBoostingRegressor,
+}
+
 
 class ParkingCapacityEstimator:
-    def __init__(self, csv_path):
+    """
+    The model is loaded lazily on first use: from the artifact written by
+    `python -m parking_time_estimators.train` when it exists, otherwise by
+    training on csv_path, CSV or Parquet (and saving the artifact for the
+    next start).
+
+    If flat_path holds a `python -m parking_time_estimators.flat_forest`
+    export of the same model, predictions run on those memory-mapped arrays
+    and the sklearn model is never unpickled.
+
+    stage_timer(name), if given, returns a context manager timing a step of
+    the prediction ("estimator.features", "estimator.forest_predict", ...);
+    the web app passes its request profiler's (profiling.stage).
+    """
+
+    def __init__(self, csv_path, artifact_path=None, flat_path=None, stage_timer=None):
         self.csv_path = csv_path
-        self.model = None
-        self.preprocessor = None
+        self.artifact_path = artifact_path
+        self.flat_path = flat_path
+        self.stage_timer = stage_timer or _no_stage
+        self.metadata = None
+        self._model = None
+        self._artifact_fingerprint = None
+        self._flat = None
+        self._flat_checked = None
+        self._lock = threading.Lock()
 
-        self._load_and_train()
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._load_or_train()
+        return self._model
 
-    def _load_and_train(self):
-        df = pd.read_csv(self.csv_path)
+    @property
+    def loaded(self):
+        return self._model is not None or self._flat is not None
 
-        features = ["day_type", "hour", "total_capacity", "latitude", "longitude"]
-        target = "occupancy_rate"
+    def load(self):
+        """
+        Loads what predictions run on (the flat export when there is a
+        current one, else the model) instead of waiting for the first call.
+        """
+        if self.flat is None:
+            self.model
 
-        df["hour_sin"] = np.sin(2 * np.pi * df["hour"] / 24)
-        df["hour_cos"] = np.cos(2 * np.pi * df["hour"] / 24)
+    @property
+    def fingerprint(self):
+        """
+        Fingerprint of the model that is (or will be) served, read from the
+        artifact sidecar so it does not force the model to load.
+        """
+        if self.metadata is None and self.artifact_path:
+            if self._artifact_fingerprint is None:
+                try:
+                    self._artifact_fingerprint = fingerprint(read_metadata(self.artifact_path))
+                except (OSError, ValueError, KeyError):
+                    return None
+            return self._artifact_fingerprint
+        return fingerprint(self.metadata) if self.metadata else None
 
-        features = [
-            "day_type",
-            "total_capacity",
-            "latitude",
-            "longitude",
-            "hour_sin",
-            "hour_cos",
-        ]
+    @property
+    def flat(self):
+        """
+        The flat export, or None if there is none for the current model.
+        Checked once per model fingerprint.
+        """
+        if not self.flat_path:
+            return None
+        current = self.fingerprint
+        if current is not None and current != self._flat_checked:
+            flat = FlatForest.load(self.flat_path)
+            if flat is not None and flat.meta.get("model_fingerprint") != current:
+                print(f"Ignoring flat forest in {self.flat_path}: built from another model")
+                flat = None
+            self._flat = flat
+            self._flat_checked = current
+        return self._flat
+
+    @property
+    def preprocessor(self):
+        return self.model.named_steps["preprocessor"]
+
+    def _load_or_train(self):
+        if self.artifact_path and os.path.exists(self.artifact_path):
+            try:
+                artifact = load_artifact(self.artifact_path)
+            except ArtifactError as e:
+                print(f"Ignoring estimator artifact: {e}")
+            else:
+                self.metadata = {k: v for k, v in artifact.items() if k != "model"}
+                self._model = artifact["model"]
+                return
+
+        model = self.train(self.csv_path)
+        if self.artifact_path:
+            try:
+                artifact = save_artifact(
+                    model, self.artifact_path, data_hash(self.csv_path), FOREST_PARAMS
+                )
+                self.metadata = {k: v for k, v in artifact.items() if k != "model"}
+            except OSError as e:
+                print(f"Could not write estimator artifact: {e}")
+        self._model = model
+
+    def reload(self):
+        """
+        Swaps in the artifact if it was replaced since it was loaded (e.g. by
+        a retrain). The new model is loaded completely before the swap, so
+        in-flight predictions finish on the old one. Returns True on a swap.
+        """
+        if not self.artifact_path:
+            return False
+        if self._model is None:
+            # not loaded (or only served from the flat export): the next use
+            # picks up the current artifact; True if that is a new model
+            previous = self._artifact_fingerprint
+            self._artifact_fingerprint = None
+            return previous is not None and self.fingerprint != previous
+        try:
+            current = fingerprint(read_metadata(self.artifact_path))
+        except (OSError, ValueError, KeyError):
+            return False
+        if self.metadata is not None and current == fingerprint(self.metadata):
+            return False
 
-        X = df[features]
-        y = df[target]
-
-        self.preprocessor = ColumnTransformer(
-            transformers=[
-                ("cat", OneHotEncoder(handle_unknown="ignore"), ["day_type"]),
-                (
-                    "num",
-                    "passthrough",
-                    ["total_capacity", "latitude", "longitude", "hour_sin", "hour_cos"],
-                ),
-            ]
+        try:
+            artifact = load_artifact(self.artifact_path)
+        except (ArtifactError, OSError) as e:
+            print(f"Ignoring estimator artifact: {e}")
+            return False
+        with self._lock:
+            self.metadata = {k: v for k, v in artifact.items() if k != "model"}
+            self._model = artifact["model"]
+            self._artifact_fingerprint = None
+        return True
+
+    @staticmethod
+    def train(data_path, params=None, kind="forest", n_jobs=-1):
+        """
+        Fits the pipeline on a CSV or Parquet occupancy history. Only the
+        feature and target columns are loaded, with compact dtypes.
+        """
+        df = read_occupancy(data_path)
+        return fit_pipeline(df, kind, FOREST_PARAMS if params is None else params, n_jobs)
+
+    def _features(
+        self, day_type, hour, total_capacity, latitude, longitude, model=None, categories=None
+    ):
+        """
+        Builds the regressor input matrix directly with NumPy, in the same
+        column order the fitted ColumnTransformer produces: one-hot day type
+        followed by the passthrough numeric columns. Scalars broadcast.
+        """
+        day_type, hour, total_capacity, latitude, longitude = np.broadcast_arrays(
+            np.asarray(day_type),
+            np.asarray(hour, dtype=float),
+            np.asarray(total_capacity, dtype=float),
+            np.asarray(latitude, dtype=float),
+            np.asarray(longitude, dtype=float),
         )
+        if categories is None:
+            preprocessor = (model or self.model).named_steps["preprocessor"]
+            categories = preprocessor.named_transformers_["cat"].categories_[0]
+
+        X = np.empty((day_type.size, len(categories) + 5))
+        # unknown day types end up all-zero, like handle_unknown="ignore"
+        X[:, : len(categories)] = day_type.reshape(-1, 1) == categories
+        X[:, -5] = total_capacity.ravel()
+        X[:, -4] = latitude.ravel()
+        X[:, -3] = longitude.ravel()
+        X[:, -2] = np.sin(2 * np.pi * hour.ravel() / 24)
+        X[:, -1] = np.cos(2 * np.pi * hour.ravel() / 24)
+        return X
+
+    def predict_many(
+        self,
+        day_type=None,
+        hour=None,
+        total_capacity=None,
+        latitude=None,
+        longitude=None,
+        records=None,
+    ):
+        """
+        Vectorized predict. Takes either arrays/scalars per feature (scalars
+        are broadcast, e.g. one day_type and hour for many spots) or a list
+        of records with the same keys. Skips pandas and the sklearn Pipeline
+        and calls the forest on a plain NumPy matrix (or the flat export).
+        """
+        if records is not None:
+            day_type, hour, total_capacity, latitude, longitude = _columns(records)
+        stage = self.stage_timer
+        flat = self.flat
+        if flat is not None:
+            with stage("estimator.features"):
+                X = self._features(
+                    day_type, hour, total_capacity, latitude, longitude,
+                    categories=np.array(flat.meta["categories"], dtype=object),
+                )
+            with stage("estimator.flat_predict"):
+                return flat.predict(X)
+        # one model for the whole call, even if reload() swaps it meanwhile
+        model = self.model
+        with stage("estimator.features"):
+            X = self._features(day_type, hour, total_capacity, latitude, longitude, model)
+        if len(X) == 0:
+            return np.empty(0)
+        with stage("estimator.forest_predict"):
+            return model.named_steps["regressor"].predict(X)
+
+    def predict_trees(self, day_type, hour, total_capacity, latitude, longitude):
+        """
+        Per-tree predictions, shape (n_rows, n_trees); their mean is the
+        forest prediction. None for regressors without independent trees
+        (gradient boosting).
+        """
+        stage = self.stage_timer
+        flat = self.flat
+        if flat is not None:
+            with stage("estimator.features"):
+                X = self._features(
+                    day_type, hour, total_capacity, latitude, longitude,
+                    categories=np.array(flat.meta["categories"], dtype=object),
+                )
+            with stage("estimator.flat_leaves"):
+                return flat.leaf_values(X)
+        model = self.model
+        regressor = model.named_steps["regressor"]
+        if not isinstance(regressor, RandomForestRegressor):
+            return None
+        with stage("estimator.features"):
+            X = self._features(day_type, hour, total_capacity, latitude, longitude, model)
+        with stage("estimator.tree_predict"):
+            return np.column_stack([tree.predict(X) for tree in regressor.estimators_])
 
-        self.model = Pipeline(
-            [
-                ("preprocessor", self.preprocessor),
-                (
-                    "regressor",
-                    RandomForestRegressor(
-                        n_estimators=300, max_depth=12, random_state=42
-                    ),
-                ),
-            ]
+    def predict_profile(self, total_capacity, latitude, longitude, quantiles=None):
+        """
+        Occupancy of every spot for every day type and hour, shape
+        (n_spots, len(DAY_TYPES), HOURS), in one vectorized pass.
+
+        With quantiles (e.g. (0.1, 0.9)) also returns those quantiles of
+        the per-tree predictions, one array of the same shape each: the
+        spread of the ensemble, not a calibrated interval. None where the
+        regressor has no per-tree predictions.
+        """
+        total_capacity = np.asarray(total_capacity, dtype=float)
+        n_spots = len(total_capacity)
+        per_spot = len(DAY_TYPES) * HOURS
+        grid = (
+            np.tile(np.repeat(DAY_TYPES, HOURS), n_spots),
+            np.tile(np.arange(HOURS), n_spots * len(DAY_TYPES)),
+            np.repeat(total_capacity, per_spot),
+            np.repeat(np.asarray(latitude, dtype=float), per_spot),
+            np.repeat(np.asarray(longitude, dtype=float), per_spot),
         )
-        self.model.fit(X, y)
+        shape = (n_spots, len(DAY_TYPES), HOURS)
+        if quantiles is None:
+            return self.predict_many(*grid).reshape(shape)
+
+        per_tree = self.predict_trees(*grid) if n_spots else None
+        if per_tree is None:
+            return self.predict_many(*grid).reshape(shape), [None] * len(quantiles)
+        with self.stage_timer("estimator.quantiles"):
+            mean = per_tree.mean(axis=1, dtype=np.float64).reshape(shape)
+            bounds = np.quantile(per_tree, quantiles, axis=1)
+        return mean, [bound.reshape(shape) for bound in bounds]
 
     def predict(self, day_type, hour, total_capacity, latitude, longitude):
-        hour_sin = np.sin(2 * np.pi * hour / 24)
-        hour_cos = np.cos(2 * np.pi * hour / 24)
-
-        X_new = pd.DataFrame(
-            [
-                {
-                    "day_type": day_type,
-                    "total_capacity": total_capacity,
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "hour_sin": hour_sin,
-                    "hour_cos": hour_cos,
-                }
-            ]
+        return float(
+            self.predict_many(day_type, hour, total_capacity, latitude, longitude)[0]
         )
 
-        return float(self.model.predict(X_new)[0])
-
     def predict_search_time(self, day_type, hour, total_capacity, latitude, longitude):
         p_occupied = self.predict(day_type, hour, total_capacity, latitude, longitude)
 
@@ -98,6 +335,100 @@ class ParkingCapacityEstimator:
 
         return 2 * total_time
 
+    def predict_search_time_many(
+        self,
+        day_type=None,
+        hour=None,
+        total_capacity=None,
+        latitude=None,
+        longitude=None,
+        records=None,
+    ):
+        """
+        Batch version of predict_search_time, same inputs as predict_many.
+        """
+        if records is not None:
+            day_type, hour, total_capacity, latitude, longitude = _columns(records)
+        p_occupied = self.predict_many(day_type, hour, total_capacity, latitude, longitude)
+        total_capacity = np.broadcast_to(
+            np.asarray(total_capacity, dtype=float), p_occupied.shape
+        )
+        return search_time_from_occupancy(p_occupied, total_capacity)
+
+
+def add_features(df):
+    """
+    Adds the cyclic hour encoding the pipeline is trained on.
+    """
+    df["hour_sin"] = np.sin(2 * np.pi * df["hour"] / 24)
+    df["hour_cos"] = np.cos(2 * np.pi * df["hour"] / 24)
+    return df
+
+
+def build_pipeline(kind="forest", params=None):
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), ["day_type"]),
+            (
+                "num",
+                "passthrough",
+                ["total_capacity", "latitude", "longitude", "hour_sin", "hour_cos"],
+            ),
+        ]
+    )
+    return Pipeline(
+        [
+            ("preprocessor", preprocessor),
+            ("regressor", REGRESSORS[kind](**(params or {}))),
+        ]
+    )
+
+
+def fit_pipeline(df, kind="forest", params=None, n_jobs=-1):
+    """
+    Fits a pipeline on an occupancy frame as returned by read_occupancy.
+    Forests are fitted on n_jobs cores (-1: all), then reset to a single
+    job: the served model predicts a handful of rows per call, where
+    spinning up a thread pool costs more than it saves.
+    """
+    df = add_features(df.copy())
+    model = build_pipeline(kind, params)
+    regressor = model.named_steps["regressor"]
+    if "n_jobs" in regressor.get_params():
+        regressor.set_params(n_jobs=n_jobs)
+    model.fit(df[FEATURES], df["occupancy_rate"])
+    if "n_jobs" in regressor.get_params():
+        regressor.set_params(n_jobs=None)
+    return model
+
+
+def search_time_from_occupancy(p_occupied, total_capacity):
+    """
+    Vectorized form of the queueing formula in predict_search_time.
+    """
+    p_free = 1 - np.asarray(p_occupied, dtype=float)
+    total_capacity = np.asarray(total_capacity, dtype=float)
+
+    with np.errstate(divide="ignore"):
+        expected_spots = np.where(p_free < 1e-3, total_capacity * 2, 1 / p_free)
+    total_time = expected_spots * TIME_PER_SPOT + FIXED_SEARCH_TIME
+    total_time = np.where(p_free < 0.05, total_time + TIME_PENALTY, total_time)
+
+    return 2 * total_time
+
+
+def _columns(records):
+    """
+    Splits a list of feature dicts into per-feature arrays.
+    """
+    return (
+        np.array([r["day_type"] for r in records]),
+        np.array([r["hour"] for r in records], dtype=float),
+        np.array([r["total_capacity"] for r in records], dtype=float),
+        np.array([r["latitude"] for r in records], dtype=float),
+        np.array([r["longitude"] for r in records], dtype=float),
+    )
+
 
 if __name__ == "__main__":
     # use like this:
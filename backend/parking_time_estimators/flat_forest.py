@@ -0,0 +1,301 @@
+"""
+Flat, array-backed export of the fitted random forest.
+
+All trees are stored back to back in a handful of contiguous arrays
+(split feature, float32 threshold, right child, NaN direction, leaf
+value), in preorder so the left child of node i is always i + 1. Leaves
+point to themselves, so a batch of rows walks every tree with max_depth
+vectorized steps and no per-node Python code.
+
+Thresholds are rounded down to the nearest float32, which gives exactly
+sklearn's decisions (it compares float32 inputs against float64
+thresholds); leaf values are float32, so predictions match to ~1e-7.
+
+Optional variants trade accuracy for size and speed: fewer trees,
+truncated depth (a cut node predicts its training mean) and 8-bit leaf
+values. The export CLI reports the accuracy delta of each variant:
+
+    python -m parking_time_estimators.flat_forest \
+        --artifact artifacts/estimator.joblib \
+        --data synthentic_parking_occupancy.csv --out artifacts/forest_flat
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+FLAT_VERSION = 1
+
+# rows per evaluation step; the traversal state is rows x trees indices
+PREDICT_CHUNK_ROWS = 2048
+
+_ARRAYS = ("feature", "threshold", "right", "missing_left", "value", "roots")
+
+
+class FlatForest:
+    def __init__(
+        self,
+        feature,
+        threshold,
+        right,
+        missing_left,
+        value,
+        roots,
+        max_depth,
+        value_scale=None,
+        meta=None,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.right = right
+        self.missing_left = missing_left
+        # float32 leaf values, or uint8 codes with value_scale = (offset, step)
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.value_scale = value_scale
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in _ARRAYS)
+
+    @classmethod
+    def from_sklearn(cls, forest, max_trees=None, max_depth=None, quantize=False, meta=None):
+        """
+        Flattens a fitted RandomForestRegressor (single output). max_trees
+        keeps the first trees only, max_depth cuts deeper subtrees.
+        """
+        estimators = forest.estimators_[:max_trees]
+        feature, threshold, right, missing_left, value, roots = [], [], [], [], [], []
+        depth_reached = 0
+
+        for estimator in estimators:
+            tree = estimator.tree_
+            values = tree.value[:, 0, 0]
+            missing = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+            roots.append(len(feature))
+            # preorder: (sklearn node, depth, index of the parent whose right child this is)
+            stack = [(0, 0, -1)]
+            while stack:
+                node, depth, parent = stack.pop()
+                index = len(feature)
+                if parent >= 0:
+                    right[parent] = index
+                depth_reached = max(depth_reached, depth)
+
+                left_child = tree.children_left[node]
+                if left_child == -1 or (max_depth is not None and depth >= max_depth):
+                    # leaf: never goes left, right points to itself
+                    feature.append(0)
+                    threshold.append(-np.inf)
+                    right.append(index)
+                    missing_left.append(False)
+                    value.append(values[node])
+                    continue
+
+                t = np.float32(tree.threshold[node])
+                if t > tree.threshold[node]:
+                    t = np.nextafter(t, np.float32(-np.inf))
+                feature.append(tree.feature[node])
+                threshold.append(t)
+                right.append(-1)  # set when the right subtree is emitted
+                missing_left.append(bool(missing[node]))
+                value.append(values[node])
+                stack.append((tree.children_right[node], depth + 1, index))
+                stack.append((left_child, depth + 1, -1))
+
+        value = np.asarray(value, dtype=np.float64)
+        value_scale = None
+        if quantize:
+            low, high = float(value.min()), float(value.max())
+            step = (high - low) / 255 or 1.0
+            value = np.round((value - low) / step).astype(np.uint8)
+            value_scale = (low, step)
+        else:
+            value = value.astype(np.float32)
+
+        return cls(
+            feature=np.asarray(feature, dtype=np.int16),
+            threshold=np.asarray(threshold, dtype=np.float32),
+            right=np.asarray(right, dtype=np.int32),
+            missing_left=np.asarray(missing_left, dtype=bool),
+            value=value,
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=depth_reached,
+            value_scale=value_scale,
+            meta=meta,
+        )
+
+    def leaf_values(self, X):
+        """
+        Leaf value per row and tree, shape (n_rows, n_trees).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        # everything 1-d with np.take, noticeably faster than 2-d fancy indexing
+        inputs = X.ravel()
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, n_trees)
+        node = np.tile(self.roots.astype(np.intp), n_rows)
+        has_missing = np.isnan(X).any()
+        for _ in range(self.max_depth):
+            x = inputs.take(row_offset + self.feature.take(node))
+            go_left = x <= self.threshold.take(node)
+            if has_missing:
+                go_left |= np.isnan(x) & self.missing_left.take(node)
+            node = np.where(go_left, node + 1, self.right.take(node))
+
+        values = self.value.take(node).reshape(n_rows, n_trees)
+        if self.value_scale is not None:
+            offset, step = self.value_scale
+            return offset + values * step
+        return values
+
+    def predict(self, X):
+        if len(X) <= PREDICT_CHUNK_ROWS:
+            if len(X) == 0:
+                return np.empty(0)
+            return self.leaf_values(X).mean(axis=1, dtype=np.float64)
+        return np.concatenate(
+            [
+                self.leaf_values(X[start : start + PREDICT_CHUNK_ROWS]).mean(axis=1, dtype=np.float64)
+                for start in range(0, len(X), PREDICT_CHUNK_ROWS)
+            ]
+        )
+
+    def save(self, directory):
+        """
+        Writes the arrays (.npy, so they can be memory-mapped and shared
+        between workers) plus meta.json, replacing any previous export.
+        """
+        tmp = f"{directory}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        meta = dict(
+            self.meta,
+            version=FLAT_VERSION,
+            max_depth=self.max_depth,
+            value_scale=self.value_scale,
+        )
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        old = f"{directory}.old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old)
+        os.replace(tmp, directory)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-maps an export. Returns None if there is none (or it has an
+        older layout).
+        """
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != FLAT_VERSION:
+            return None
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in _ARRAYS
+        }
+        scale = meta.get("value_scale")
+        return cls(
+            max_depth=meta["max_depth"],
+            value_scale=tuple(scale) if scale else None,
+            meta=meta,
+            **arrays,
+        )
+
+
+def compare(flat, forest, X, y=None, repeat=200):
+    """
+    Accuracy of the flat forest against sklearn's predictions (and the
+    target, if given), plus size and single-row latency of both.
+    """
+    reference = forest.predict(X)
+    predicted = flat.predict(X)
+    delta = np.abs(predicted - reference)
+    report = {
+        "trees": len(flat),
+        "nodes": int(len(flat.feature)),
+        "max_depth": flat.max_depth,
+        "quantized": flat.value_scale is not None,
+        "size_bytes": int(flat.nbytes),
+        "max_abs_delta": float(delta.max()),
+        "mean_abs_delta": float(delta.mean()),
+    }
+    if y is not None:
+        y = np.asarray(y, dtype=float)
+        report["rmse"] = float(np.sqrt(np.mean((predicted - y) ** 2)))
+        report["sklearn_rmse"] = float(np.sqrt(np.mean((reference - y) ** 2)))
+
+    row = X[:1]
+    for name, fn in (("flat", flat.predict), ("sklearn", forest.predict)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(row)
+        report[f"{name}_single_row_us"] = (time.perf_counter() - start) / repeat * 1e6
+    return report
+
+
+def main(argv=None):
+    from .artifacts import fingerprint, load_artifact
+    from .datasets import read_occupancy
+    from .estimator import ParkingCapacityEstimator
+
+    parser = argparse.ArgumentParser(description="Export the forest to flat arrays")
+    parser.add_argument("--artifact", required=True, help="estimator artifact")
+    parser.add_argument("--data", required=True, help="data for the accuracy report")
+    parser.add_argument("--out", required=True, help="export directory")
+    parser.add_argument("--trees", type=int, help="keep only the first N trees")
+    parser.add_argument("--max-depth", type=int, help="cut trees at this depth")
+    parser.add_argument("--quantize", action="store_true", help="8-bit leaf values")
+    args = parser.parse_args(argv)
+
+    artifact = load_artifact(args.artifact, mmap_mode=None)
+    model = artifact["model"]
+    forest = model.named_steps["regressor"]
+    categories = model.named_steps["preprocessor"].named_transformers_["cat"].categories_[0]
+
+    df = read_occupancy(args.data)
+    X = ParkingCapacityEstimator(args.data)._features(
+        df["day_type"].astype(str),
+        df["hour"],
+        df["total_capacity"],
+        df["latitude"],
+        df["longitude"],
+        categories=categories,
+    )
+
+    flat = FlatForest.from_sklearn(
+        forest,
+        max_trees=args.trees,
+        max_depth=args.max_depth,
+        quantize=args.quantize,
+        meta={
+            "model_fingerprint": fingerprint(artifact),
+            "categories": [str(c) for c in categories],
+        },
+    )
+    report = compare(flat, forest, X, df["occupancy_rate"])
+    flat.meta["report"] = report
+    flat.save(args.out)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
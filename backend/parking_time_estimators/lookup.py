@@ -0,0 +1,313 @@
+"""
+Precomputed occupancy for every parking spot x day type x hour.
+
+The estimator only depends on (day_type, hour) and static per-spot
+attributes, so the whole prediction space fits in a small float32 array.
+Serving then becomes an index lookup plus the queueing formula instead of
+a forest evaluation.
+
+    python -m parking_time_estimators.lookup \
+        --artifact artifacts/estimator.joblib --out artifacts/search_times
+
+Rebuilding is incremental: spots whose capacity and coordinates are
+unchanged keep their rows as long as the model fingerprint is the same.
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from .estimator import DAY_TYPES, HOURS, ParkingCapacityEstimator, search_time_from_occupancy
+
+TABLE_VERSION = 1
+
+_ARRAYS = ("ids", "capacity", "latitude", "longitude", "occupancy")
+
+
+class SearchTimeTable:
+    def __init__(self, ids, capacity, latitude, longitude, occupancy, model_fingerprint):
+        self.ids = ids
+        self.capacity = capacity
+        self.latitude = latitude
+        self.longitude = longitude
+        # shape (n_spots, len(DAY_TYPES), HOURS)
+        self.occupancy = occupancy
+        self.model_fingerprint = model_fingerprint
+        self.index = {spot_id: i for i, spot_id in enumerate(ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, spot_ids):
+        """
+        Row index per spot id, -1 for ids not in the table.
+        """
+        return np.fromiter(
+            (self.index.get(spot_id, -1) for spot_id in spot_ids),
+            dtype=np.int64,
+            count=len(spot_ids),
+        )
+
+    def matching_rows(self, spot_ids, capacity, latitude, longitude):
+        """
+        Row index per spot id, -1 for ids not in the table and for spots
+        whose capacity or coordinates differ from the table's: their rows
+        were predicted for other inputs.
+        """
+        rows = self.rows(spot_ids)
+        found = rows >= 0
+        known = rows[found]
+        same = (
+            _same(self.capacity[known], np.asarray(capacity, dtype=np.float32)[found])
+            & _same(self.latitude[known], np.asarray(latitude, dtype=np.float64)[found])
+            & _same(self.longitude[known], np.asarray(longitude, dtype=np.float64)[found])
+        )
+        rows[np.flatnonzero(found)[~same]] = -1
+        return rows
+
+    def lookup(self, spot_ids, day_type, hour, capacity=None, latitude=None, longitude=None):
+        """
+        Occupancy per spot id, NaN where the spot (or day type) is unknown.
+        Given the spots' capacity and coordinates, also NaN where those do
+        not match the table (see matching_rows).
+        """
+        if capacity is None:
+            rows = self.rows(spot_ids)
+        else:
+            rows = self.matching_rows(spot_ids, capacity, latitude, longitude)
+        result = np.full(len(rows), np.nan)
+        if day_type not in DAY_TYPES:
+            return result
+        found = rows >= 0
+        result[found] = self.occupancy[rows[found], DAY_TYPES.index(day_type), hour]
+        return result
+
+    def search_times(self, spot_ids, day_type, hour):
+        """
+        Estimated search time per spot id, NaN where the spot is unknown.
+        """
+        rows = self.rows(spot_ids)
+        occupancy = self.lookup(spot_ids, day_type, hour)
+        capacity = np.full(len(rows), np.nan)
+        found = rows >= 0
+        capacity[found] = self.capacity[rows[found]]
+        return search_time_from_occupancy(occupancy, capacity)
+
+    def save(self, directory):
+        """
+        Writes the arrays to a fresh versioned subdirectory and then swaps
+        the `current` symlink, so readers never see a partial table.
+        """
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.join(directory, f"table-{time.time_ns()}")
+        os.makedirs(target)
+        for name in _ARRAYS:
+            np.save(os.path.join(target, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(target, "meta.json"), "w") as f:
+            json.dump(
+                {"version": TABLE_VERSION, "model_fingerprint": self.model_fingerprint},
+                f,
+            )
+
+        link = os.path.join(directory, "current")
+        tmp_link = f"{link}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.basename(target), tmp_link)
+        os.replace(tmp_link, link)
+
+        # keep the previous table around for readers that still map it
+        tables = sorted(
+            name for name in os.listdir(directory) if name.startswith("table-")
+        )
+        for name in tables[:-2]:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        return target
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-maps the current table, so every worker shares the same pages.
+        Returns None when no table has been built yet.
+        """
+        path = os.path.join(directory, "current")
+        if not os.path.exists(path):
+            return None
+        path = os.path.realpath(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != TABLE_VERSION:
+            return None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in _ARRAYS
+        }
+        return cls(model_fingerprint=meta["model_fingerprint"], **arrays)
+
+
+class SearchTimeLookup:
+    """
+    Serves the current table of a directory. Picks up tables rebuilt by
+    other processes and ignores tables built from a different model than
+    the one the estimator serves.
+    """
+
+    def __init__(self, directory, estimator, check_interval=30):
+        self.directory = directory
+        self.estimator = estimator
+        self.check_interval = check_interval
+        self._table = None
+        self._target = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at > self.check_interval:
+            self._checked_at = now
+            self._reload()
+        table = self._table
+        fingerprint = self.estimator.fingerprint
+        # a model of unknown provenance never matches
+        if table is None or fingerprint is None or table.model_fingerprint != fingerprint:
+            return None
+        return table
+
+    def _reload(self):
+        try:
+            target = os.readlink(os.path.join(self.directory, "current"))
+        except OSError:
+            return
+        if target != self._target:
+            self._table = SearchTimeTable.load(self.directory)
+            self._target = target
+
+    def rebuild(self, ids, capacity, latitude, longitude):
+        """
+        Incremental rebuild from the given spots. Serialized across
+        processes with a lock file, so concurrent workers do the work once.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = SearchTimeTable.load(self.directory)
+            table, recomputed = build_table(
+                self.estimator, ids, capacity, latitude, longitude, previous=previous
+            )
+            if recomputed or previous is None or len(previous) != len(table):
+                table.save(self.directory)
+            self._checked_at = 0.0
+        return recomputed
+
+
+def build_table(estimator, ids, capacity, latitude, longitude, previous=None):
+    """
+    Evaluates the estimator for every spot and (day type, hour) bucket in
+    one vectorized call. Rows of `previous` are reused for spots
+    whose inputs did not change, as long as it was built from the same model.
+    """
+    ids = np.asarray(ids, dtype=str)
+    capacity = np.asarray(capacity, dtype=np.float32)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    model_fingerprint = estimator.fingerprint
+
+    occupancy = np.empty((len(ids), len(DAY_TYPES), HOURS), dtype=np.float32)
+    stale = np.ones(len(ids), dtype=bool)
+
+    if (
+        previous is not None
+        and model_fingerprint is not None
+        and previous.model_fingerprint == model_fingerprint
+    ):
+        rows = previous.rows(ids.tolist())
+        found = rows >= 0
+        prev_rows = rows[found]
+        unchanged = found.copy()
+        unchanged[found] = (
+            _same(previous.capacity[prev_rows], capacity[found])
+            & _same(previous.latitude[prev_rows], latitude[found])
+            & _same(previous.longitude[prev_rows], longitude[found])
+        )
+        occupancy[unchanged] = previous.occupancy[rows[unchanged]]
+        stale = ~unchanged
+
+    if stale.any():
+        occupancy[stale] = estimator.predict_profile(
+            capacity[stale], latitude[stale], longitude[stale]
+        )
+
+    table = SearchTimeTable(ids, capacity, latitude, longitude, occupancy, model_fingerprint)
+    return table, int(stale.sum())
+
+
+def _same(a, b):
+    # NaN attributes (e.g. unknown capacity) count as unchanged
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def read_parking_from_db():
+    from sqlalchemy import text
+
+    from models.database import engine
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT id, capacity, latitude, longitude FROM parking ORDER BY id")
+        ).fetchall()
+    ids, capacity, latitude, longitude = zip(*rows) if rows else ((), (), (), ())
+    return (
+        ids,
+        np.asarray(capacity, dtype=float),
+        np.asarray(latitude, dtype=float),
+        np.asarray(longitude, dtype=float),
+    )
+
+
+def _read_parking_from_csv(path):
+    import pandas as pd
+
+    df = pd.read_csv(path, usecols=["id", "capacity", "latitude", "longitude"])
+    return df["id"], df["capacity"], df["latitude"], df["longitude"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the search-time table")
+    parser.add_argument("--artifact", required=True, help="estimator artifact")
+    parser.add_argument(
+        "--data",
+        default="synthentic_parking_occupancy.csv",
+        help="training data (CSV or Parquet), only used if the artifact is missing",
+    )
+    parser.add_argument("--out", required=True, help="table directory")
+    parser.add_argument(
+        "--parking-csv",
+        help="read spots from this CSV instead of the parking table",
+    )
+    parser.add_argument("--full", action="store_true", help="ignore the previous table")
+    args = parser.parse_args(argv)
+
+    if args.parking_csv:
+        spots = _read_parking_from_csv(args.parking_csv)
+    else:
+        spots = read_parking_from_db()
+
+    estimator = ParkingCapacityEstimator(args.data, artifact_path=args.artifact)
+    previous = None if args.full else SearchTimeTable.load(args.out)
+
+    start = time.perf_counter()
+    table, recomputed = build_table(estimator, *spots, previous=previous)
+    target = table.save(args.out)
+    print(
+        f"Wrote {target}: {len(table)} spots, {recomputed} recomputed "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
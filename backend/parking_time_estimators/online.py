@@ -0,0 +1,186 @@
+"""
+Online occupancy updates from live observations.
+
+Observations are aggregated per (spot, day type, hour) into means, which
+are blended with the forest prediction as a prior:
+
+    occupancy = (PRIOR_WEIGHT * forest + n * observed_mean) / (PRIOR_WEIGHT + n)
+
+A bucket's mean is over its latest MAX_COUNT observations (by observed_at),
+so it keeps following recent data once a bucket has enough of it. It is
+computed in SQL from the table, never folded into a previous value, so it
+only depends on the rows visible to the refresh: workers agree on it
+whatever their refresh history. Each refresh recomputes only the buckets
+that got new observations into a new snapshot and swaps the reference, so
+readers always see one complete snapshot.
+
+"New" is by id, with a watermark. Ids are taken at INSERT but rows become
+visible at COMMIT, so a concurrent /observations transaction can commit
+ids below the watermark after a refresh passed them. Missing ids among
+the last GAP_WINDOW below the watermark are therefore kept and looked up
+again by the following refreshes, for GAP_SECONDS (after that they are
+taken as rolled back). Each refresh reads one REPEATABLE READ snapshot.
+"""
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+PRIOR_WEIGHT = 5.0
+MAX_COUNT = 200
+GAP_WINDOW = 10_000
+GAP_SECONDS = 600.0
+
+LATEST_ID_SQL = text("SELECT coalesce(max(id), 0) FROM occupancy_observations")
+
+# ids without a row: new ones in (since, upto] and the known gaps
+MISSING_IDS_SQL = text("""
+    SELECT g.id
+    FROM (
+        SELECT generate_series(CAST(:since AS bigint) + 1, CAST(:upto AS bigint)) AS id
+        UNION ALL
+        SELECT unnest(CAST(:gaps AS bigint[]))
+    ) g
+    WHERE NOT EXISTS (SELECT 1 FROM occupancy_observations o WHERE o.id = g.id)
+""")
+
+# Mean and count of the latest :max_count observations of every
+# (spot, day type, hour) bucket with an observation that is new: id in
+# (after, upto] or one of the gaps. Day type / hour buckets as in
+# get_current_hour_and_day_initial().
+BUCKETS_SQL = text("""
+    WITH observations AS (
+        SELECT
+            id,
+            parking_id,
+            CASE extract(isodow FROM observed_at)
+                WHEN 6 THEN 'SA' WHEN 7 THEN 'SO' ELSE 'WT'
+            END AS day_type,
+            extract(hour FROM observed_at)::int AS hour,
+            observed_at,
+            occupied::float / (occupied + free) AS share
+        FROM occupancy_observations
+        WHERE parking_id IN (
+            SELECT parking_id FROM occupancy_observations
+            WHERE (id > :after AND id <= :upto) OR id = ANY(CAST(:gaps AS bigint[]))
+        )
+    ),
+    touched AS (
+        SELECT DISTINCT parking_id, day_type, hour
+        FROM observations
+        WHERE (id > :after AND id <= :upto) OR id = ANY(CAST(:gaps AS bigint[]))
+    ),
+    latest AS (
+        SELECT o.parking_id, o.day_type, o.hour, o.share, row_number() OVER (
+            PARTITION BY o.parking_id, o.day_type, o.hour
+            ORDER BY o.observed_at DESC, o.id DESC
+        ) AS rank
+        FROM observations o
+        JOIN touched t USING (parking_id, day_type, hour)
+    )
+    SELECT parking_id, day_type, hour, count(*) AS n, avg(share) AS mean
+    FROM latest
+    WHERE rank <= :max_count
+    GROUP BY 1, 2, 3
+""")
+
+
+class OccupancyStats:
+    """
+    Immutable snapshot of the bucket means, keyed (spot id, day type, hour),
+    as of the observation id watermark last_id.
+    """
+
+    def __init__(self, buckets=None, last_id=0, gaps=None):
+        self.buckets = buckets or {}
+        self.last_id = last_id
+        # ids below last_id not seen yet -> when they were first missed
+        self.gaps = gaps or {}
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def version(self):
+        """
+        The watermark and the number of ids below it still awaited, which
+        is what the snapshot's content depends on.
+        """
+        return (self.last_id, len(self.gaps))
+
+    def updated(self, rows, last_id, gaps=None):
+        """
+        New snapshot with the (spot id, day type, hour, n, mean) rows of
+        recomputed buckets replacing their previous values; self is left
+        untouched.
+        """
+        buckets = dict(self.buckets)
+        for spot_id, day_type, hour, n, mean in rows:
+            buckets[(spot_id, day_type, int(hour))] = (int(n), float(mean))
+        return OccupancyStats(buckets, last_id, gaps)
+
+    def blend(self, spot_ids, day_type, hour, prior, prior_weight=PRIOR_WEIGHT):
+        """
+        Blends the prior occupancy per spot with the observed mean of its
+        (day type, hour) bucket; spots without observations keep the prior.
+        """
+        prior = np.asarray(prior, dtype=float)
+        if not self.buckets:
+            return prior
+        counts = np.zeros(len(prior))
+        means = np.zeros(len(prior))
+        for i, spot_id in enumerate(spot_ids):
+            bucket = self.buckets.get((spot_id, day_type, hour))
+            if bucket is not None:
+                counts[i], means[i] = bucket
+        return (prior_weight * prior + counts * means) / (prior_weight + counts)
+
+
+class OnlineOccupancy:
+    """
+    Keeps the current OccupancyStats up to date from the
+    occupancy_observations table.
+    """
+
+    def __init__(self, engine, prior_weight=PRIOR_WEIGHT, max_count=MAX_COUNT):
+        self.engine = engine
+        self.prior_weight = prior_weight
+        self.max_count = max_count
+        self.stats = OccupancyStats()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.stats.version
+
+    def refresh(self):
+        """
+        Recomputes the buckets with observations committed since the last
+        refresh. Returns the number of (spot, day type, hour) buckets
+        recomputed.
+        """
+        with self._lock:
+            stats = self.stats
+            now = time.monotonic()
+            gaps = [i for i, missed in stats.gaps.items() if now - missed < GAP_SECONDS]
+            with self.engine.connect() as conn:
+                # the same snapshot for the watermark, the gaps and the rows
+                conn.execution_options(isolation_level="REPEATABLE READ")
+                upto = max(conn.execute(LATEST_ID_SQL).scalar(), stats.last_id)
+                if upto <= stats.last_id and not gaps:
+                    return 0
+                params = {"after": stats.last_id, "upto": upto, "gaps": gaps}
+                missing = conn.execute(
+                    MISSING_IDS_SQL,
+                    {**params, "since": max(stats.last_id, upto - GAP_WINDOW)},
+                ).scalars().all()
+                rows = conn.execute(
+                    BUCKETS_SQL, {**params, "max_count": self.max_count}
+                ).fetchall()
+            gaps = {i: stats.gaps.get(i, now) for i in missing}
+            self.stats = stats.updated(rows, upto, gaps)
+            return len(rows)
+
+    def blend(self, spot_ids, day_type, hour, prior):
+        return self.stats.blend(spot_ids, day_type, hour, prior, self.prior_weight)
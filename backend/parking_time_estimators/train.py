@@ -0,0 +1,36 @@
+"""
+Fits the parking occupancy model once and writes a versioned artifact that
+ParkingCapacityEstimator loads at startup instead of training.
+
+    python -m parking_time_estimators.train \
+        --data synthentic_parking_occupancy.csv --out artifacts/estimator.joblib
+
+It fits the default FOREST_PARAMS; parking_time_estimators.tune searches
+other sizes and regressors and writes the artifact for the one it picks.
+"""
+import argparse
+import time
+
+from .artifacts import data_hash, save_artifact
+from .estimator import FOREST_PARAMS, ParkingCapacityEstimator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--data", required=True, help="training data, CSV or Parquet")
+    parser.add_argument("--out", required=True, help="artifact path to write")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model = ParkingCapacityEstimator.train(args.data)
+    print(f"Trained in {time.perf_counter() - start:.1f}s")
+
+    artifact = save_artifact(model, args.out, data_hash(args.data), FOREST_PARAMS)
+    print(
+        f"Wrote {args.out} (version {artifact['version']}, "
+        f"data sha256 {artifact['data_sha256'][:12]})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Hyperparameter search for the occupancy model: fits candidate models in
+parallel worker processes and validates them on the most recent days of
+the history (trained on everything before), so the score reflects
+predicting the future rather than interpolating shuffled hours.
+
+For every candidate it reports validation error next to what the model
+costs to serve: artifact size, load time and per-row inference latency
+(single row, and amortized over a batch). The cheapest candidate within
+the accuracy bar is refitted on the whole history and written as the
+serving artifact (plus its flat export, for forests):
+
+    python -m parking_time_estimators.tune \
+        --data synthentic_parking_occupancy.csv \
+        --out artifacts/estimator.joblib --flat-out artifacts/forest_flat \
+        --report artifacts/tune_report.json
+"""
+import argparse
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from .artifacts import data_hash, fingerprint, save_artifact
+from .datasets import OCCUPANCY_DTYPES, read_table
+from .estimator import FOREST_PARAMS, ParkingCapacityEstimator, fit_pipeline
+from .flat_forest import FlatForest
+
+# (name, regressor kind, params); the first entry is the current default
+CANDIDATES = [
+    ("forest_300_d12", "forest", FOREST_PARAMS),
+    *(
+        (f"forest_{n}_d{depth}", "forest", {"n_estimators": n, "max_depth": depth, "random_state": 42})
+        for n in (30, 100)
+        for depth in (8, 12, 16)
+    ),
+    ("forest_300_d8", "forest", {"n_estimators": 300, "max_depth": 8, "random_state": 42}),
+    *(
+        (
+            f"hgb_{iterations}_l{leaves}",
+            "hist_gradient_boosting",
+            {
+                "max_iter": iterations,
+                "max_leaf_nodes": leaves,
+                "learning_rate": 0.1,
+                "random_state": 42,
+            },
+        )
+        for iterations in (100, 300)
+        for leaves in (15, 31)
+    ),
+]
+
+LATENCY_ROWS = 200
+BATCH_ROWS = 1000
+
+_data = {}
+
+
+def read_history(path):
+    """
+    Occupancy history with its timestamps, oldest first.
+    """
+    df = read_table(path, {**OCCUPANCY_DTYPES, "timestamp": "string"})
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df.sort_values("timestamp", kind="stable", ignore_index=True)
+
+
+def time_split(df, validation_days):
+    """
+    Index of the first validation row: everything from `validation_days`
+    before the last timestamp (by calendar day) on is held out.
+    """
+    days = df["timestamp"].dt.normalize()
+    cutoff = days.max() - pd.Timedelta(days=validation_days - 1)
+    split = int(np.searchsorted(days.to_numpy(), cutoff.to_datetime64()))
+    if split == 0 or split == len(df):
+        raise ValueError(
+            f"--validation-days {validation_days} leaves no training or validation rows"
+        )
+    return split
+
+
+def _init_worker(data_path, validation_days):
+    df = read_history(data_path)
+    split = time_split(df, validation_days)
+    _data["train"], _data["validation"] = df.iloc[:split], df.iloc[split:]
+    _data["data_path"] = data_path
+
+
+def _latency(predict, X, repeat):
+    """
+    Median seconds per predict(X) call.
+    """
+    predict(X)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predict(X)
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+
+def evaluate(candidate):
+    """
+    Fits one candidate (single-threaded, the pool provides the parallelism)
+    and measures its error and serving cost.
+    """
+    name, kind, params = candidate
+    train, validation = _data["train"], _data["validation"]
+
+    start = time.perf_counter()
+    model = fit_pipeline(train, kind, params, n_jobs=1)
+    fit_seconds = time.perf_counter() - start
+
+    # served through the estimator's own NumPy feature path
+    estimator = ParkingCapacityEstimator(_data["data_path"])
+    estimator._model = model
+    X = estimator._features(
+        validation["day_type"].astype(str),
+        validation["hour"],
+        validation["total_capacity"],
+        validation["latitude"],
+        validation["longitude"],
+    )
+    regressor = model.named_steps["regressor"]
+    error = regressor.predict(X) - validation["occupancy_rate"].to_numpy(dtype=float)
+
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    size = buffer.tell()
+    start = time.perf_counter()
+    joblib.load(io.BytesIO(buffer.getvalue()))
+    load_seconds = time.perf_counter() - start
+
+    batch = X[np.arange(BATCH_ROWS) % len(X)]
+    result = {
+        "name": name,
+        "kind": kind,
+        "params": params,
+        "mae": float(np.abs(error).mean()),
+        "rmse": float(np.sqrt(np.mean(error**2))),
+        "fit_seconds": fit_seconds,
+        "size_bytes": size,
+        "load_seconds": load_seconds,
+        "single_row_us": _latency(regressor.predict, X[:1], LATENCY_ROWS) * 1e6,
+        "batch_row_us": _latency(regressor.predict, batch, 5) / BATCH_ROWS * 1e6,
+    }
+    if kind == "forest":
+        flat = FlatForest.from_sklearn(regressor)
+        result["flat_size_bytes"] = int(flat.nbytes)
+        result["flat_single_row_us"] = _latency(flat.predict, X[:1], LATENCY_ROWS) * 1e6
+        result["flat_batch_row_us"] = _latency(flat.predict, batch, 5) / BATCH_ROWS * 1e6
+    return result
+
+
+def serving_latency(result):
+    """
+    Single-row latency as served: forests run on their flat export.
+    """
+    return result.get("flat_single_row_us", result["single_row_us"])
+
+
+def choose(results, max_mae=None, tolerance=0.02):
+    """
+    The candidate with the lowest serving latency whose validation MAE is
+    within the bar: max_mae if given, else the best MAE plus `tolerance`
+    (relative). Ties go to the smaller model.
+    """
+    bar = max_mae if max_mae is not None else min(r["mae"] for r in results) * (1 + tolerance)
+    eligible = [r for r in results if r["mae"] <= bar]
+    if not eligible:
+        return None, bar
+    return min(eligible, key=lambda r: (serving_latency(r), r["size_bytes"])), bar
+
+
+def print_report(results, chosen, bar):
+    print(
+        f"{'candidate':<20} {'MAE':>8} {'RMSE':>8} {'size MB':>8} {'load ms':>8} "
+        f"{'row us':>9} {'flat us':>9} {'batch us':>9} {'fit s':>7}"
+    )
+    for r in sorted(results, key=lambda r: r["mae"]):
+        flat = f"{r['flat_single_row_us']:>9.1f}" if "flat_single_row_us" in r else f"{'-':>9}"
+        marker = " *" if chosen is not None and r["name"] == chosen["name"] else ""
+        print(
+            f"{r['name']:<20} {r['mae']:>8.4f} {r['rmse']:>8.4f} {r['size_bytes'] / 1e6:>8.2f} "
+            f"{r['load_seconds'] * 1000:>8.1f} {r['single_row_us']:>9.1f} {flat} "
+            f"{r['batch_row_us']:>9.2f} {r['fit_seconds']:>7.1f}{marker}"
+        )
+    print(f"MAE bar: {bar:.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search estimator hyperparameters")
+    parser.add_argument("--data", required=True, help="occupancy history, CSV or Parquet")
+    parser.add_argument("--out", help="write the chosen model as the serving artifact")
+    parser.add_argument("--flat-out", help="also write its flat export (forests only)")
+    parser.add_argument("--report", help="write the full report as JSON")
+    parser.add_argument(
+        "--validation-days", type=int, default=1, help="most recent days held out"
+    )
+    parser.add_argument("--max-mae", type=float, help="accuracy bar (validation MAE)")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="without --max-mae: accept MAE up to this fraction above the best",
+    )
+    parser.add_argument(
+        "--only", nargs="+", metavar="NAME", help="evaluate only these candidates"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    args = parser.parse_args(argv)
+
+    candidates = [c for c in CANDIDATES if not args.only or c[0] in args.only]
+    if not candidates:
+        parser.error(f"no candidates match --only; known: {', '.join(c[0] for c in CANDIDATES)}")
+    # validates the split before starting the workers
+    history = read_history(args.data)
+    split = time_split(history, args.validation_days)
+    print(
+        f"{len(candidates)} candidates, {split} training rows until "
+        f"{history['timestamp'].iloc[split - 1]}, {len(history) - split} validation rows"
+    )
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=min(args.jobs, len(candidates)),
+        initializer=_init_worker,
+        initargs=(args.data, args.validation_days),
+    ) as pool:
+        results = list(pool.map(evaluate, candidates))
+    print(f"Evaluated in {time.perf_counter() - start:.1f}s")
+
+    chosen, bar = choose(results, args.max_mae, args.tolerance)
+    print_report(results, chosen, bar)
+    report = {
+        "data": args.data,
+        "validation_days": args.validation_days,
+        "training_rows": split,
+        "validation_rows": len(history) - split,
+        "mae_bar": bar,
+        "chosen": chosen["name"] if chosen else None,
+        "results": results,
+    }
+
+    if chosen is None:
+        print("No candidate meets the accuracy bar; nothing written.")
+    elif args.out:
+        # refit on the whole history, on all cores
+        model = fit_pipeline(history, chosen["kind"], chosen["params"])
+        params = {"kind": chosen["kind"], **chosen["params"]}
+        artifact = save_artifact(model, args.out, data_hash(args.data), params)
+        print(f"Wrote {args.out} ({chosen['name']})")
+        if args.flat_out and chosen["kind"] == "forest":
+            categories = model.named_steps["preprocessor"].named_transformers_["cat"].categories_[0]
+            flat = FlatForest.from_sklearn(
+                model.named_steps["regressor"],
+                meta={
+                    "model_fingerprint": fingerprint(artifact),
+                    "categories": [str(c) for c in categories],
+                },
+            )
+            flat.save(args.flat_out)
+            print(f"Wrote {args.flat_out}")
+        report["artifact"] = {k: v for k, v in artifact.items() if k != "model"}
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
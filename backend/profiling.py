@@ -0,0 +1,379 @@
+"""
+Opt-in per-request profiling and slow-request capture.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` (only
+if PROFILE_TOKEN is set) or is picked at random, at PROFILE_SAMPLE_RATE.
+While it runs, a sampler thread records its call stacks every
+PROFILE_INTERVAL_MS: the event loop thread whenever the request's task is
+the one running, and worker threads while they run an instrumented stage
+for it (stage()).
+
+Profiled requests also get a cheap trace: the SQL statements they ran
+with their durations (engine events, see models/database.py) and the
+time per stage, e.g. the estimator's input matrix build and forest
+predict. That is a context variable lookup per statement or stage. With
+SLOW_REQUEST_SECONDS set (it is off by default) every request is traced,
+to catch the slow ones; the stack sampler still only runs while a
+profiled request is in flight.
+
+Profiled requests, and requests slower than SLOW_REQUEST_SECONDS, are
+written as JSON files to a ring buffer of the last SLOW_REQUEST_KEEP in
+SLOW_REQUEST_DIR, shared by the workers. For requests profiled by header
+the X-Profile-Id response header names the file; /debug/slow_requests
+lists and serves them to the admin token. Stacks are in collapsed format
+("outer;inner;leaf": samples), for flamegraph.pl or speedscope. Statement
+parameters and request headers are not recorded.
+"""
+import asyncio
+import contextlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+# 0 (the default) disables the capture (and the trace of unprofiled requests)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+SLOW_REQUEST_DIR = os.getenv("SLOW_REQUEST_DIR", "/tmp/parkiest-slow-requests")
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "200"))
+
+ENABLED = PROFILE_TOKEN is not None or PROFILE_SAMPLE_RATE > 0 or SLOW_REQUEST_SECONDS > 0
+
+HEADER = "x-profile"
+# long-lived streams, scrapes and the debug endpoints themselves
+EXCLUDED_PATHS = ("/updates", "/metrics", "/debug/")
+
+MAX_STATEMENTS = 500
+MAX_STATEMENT_CHARS = 2000
+MAX_STACK_DEPTH = 64
+
+_current = ContextVar("profiling_trace", default=None)
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def current():
+    return _current.get()
+
+
+def is_admin(token):
+    return (
+        PROFILE_TOKEN is not None
+        and token is not None
+        and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+    )
+
+
+class Trace:
+    """
+    What one request did: SQL statements, stage timings and, if sampled,
+    call stacks.
+    """
+
+    def __init__(self, trigger=None):
+        # "header", "sample" or None (traced only)
+        self.trigger = trigger
+        self.sampled = trigger is not None
+        self.id = f"{time.time_ns()}-{os.getpid()}"
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.statements = []
+        self.statements_dropped = 0
+        self.stages = {}
+        self.stacks = Counter()
+        self.ticks = 0
+        # thread id -> number of active stages; the loop thread counts
+        # only while self.task runs
+        self.threads = {}
+        self.loop_thread = None
+        self.task = None
+        self._lock = threading.Lock()
+
+    def add_statement(self, statement, seconds, executemany):
+        if len(self.statements) >= MAX_STATEMENTS:
+            self.statements_dropped += 1
+            return
+        self.statements.append(
+            {
+                "at_s": time.perf_counter() - self.started - seconds,
+                "seconds": seconds,
+                "statement": " ".join(statement.split())[:MAX_STATEMENT_CHARS],
+                "executemany": executemany,
+            }
+        )
+
+    def enter_thread(self):
+        thread = threading.get_ident()
+        with self._lock:
+            self.threads[thread] = self.threads.get(thread, 0) + 1
+
+    def exit_thread(self):
+        thread = threading.get_ident()
+        with self._lock:
+            self.threads[thread] -= 1
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            count, total = self.stages.get(name, (0, 0.0))
+            self.stages[name] = (count + 1, total + seconds)
+
+    def sample(self, frames):
+        with self._lock:
+            threads = [thread for thread, depth in self.threads.items() if depth > 0]
+        stacks = []
+        for thread in threads:
+            frame = frames.get(thread)
+            if frame is None:
+                continue
+            if thread == self.loop_thread and asyncio.current_task(self.task.get_loop()) is not self.task:
+                continue
+            stacks.append(_collapse(frame))
+        # record() may be reading them, if this tick raced the request's end
+        with self._lock:
+            self.ticks += 1
+            self.stacks.update(stacks)
+
+    def record(self, scope, status, duration):
+        record = {
+            "id": self.id,
+            "started_at": self.started_at.isoformat(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": status,
+            "duration_s": duration,
+            "trigger": self.trigger,
+            "pid": os.getpid(),
+            "sql_seconds": sum(s["seconds"] for s in self.statements),
+            "sql": self.statements,
+            "sql_dropped": self.statements_dropped,
+            "stages": {
+                name: {"count": count, "seconds": seconds}
+                for name, (count, seconds) in sorted(self.stages.items())
+            },
+            "profile": None,
+        }
+        if self.sampled:
+            with self._lock:
+                ticks, stacks = self.ticks, self.stacks.copy()
+            record["profile"] = {
+                "interval_s": PROFILE_INTERVAL,
+                "ticks": ticks,
+                "samples": sum(stacks.values()),
+                "stacks": dict(stacks.most_common()),
+            }
+        return record
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        if self.trace.sampled:
+            self.trace.enter_thread()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_stage(self.name, time.perf_counter() - self.start)
+        if self.trace.sampled:
+            self.trace.exit_thread()
+
+
+def stage(name):
+    """
+    Times a stage of the current request; in a worker thread, it is also
+    stack-sampled meanwhile. A shared no-op outside of traced requests.
+    """
+    trace = _current.get()
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name)
+
+
+class _Sampler:
+    """
+    One background thread sampling the stacks of the profiled requests in
+    flight; it exits when there are none.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._traces = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, trace):
+        with self._lock:
+            self._traces.discard(trace)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._traces:
+                    self._thread = None
+                    return
+                traces = list(self._traces)
+            frames = sys._current_frames()
+            for trace in traces:
+                trace.sample(frames)
+
+
+class SlowRequestLog:
+    """
+    Ring buffer of request records, one JSON file each, keeping the newest
+    `keep`. Files are named by start time and pid, so several workers can
+    share the directory.
+    """
+
+    NAME = re.compile(r"^\d+-\d+$")
+
+    def __init__(self, directory=SLOW_REQUEST_DIR, keep=SLOW_REQUEST_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, record_id):
+        return os.path.join(self.directory, f"{record_id}.json")
+
+    def write(self, record):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(record["id"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(f"{path}.tmp", path)
+
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in names[: max(len(names) - self.keep, 0)]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+
+    def ids(self):
+        """
+        Record ids, newest first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith(".json")), reverse=True)
+
+    def read(self, record_id):
+        """
+        The record as JSON text, or None.
+        """
+        if not self.NAME.match(record_id):
+            return None
+        try:
+            with open(self._path(record_id)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def summaries(self):
+        summaries = []
+        for record_id in self.ids():
+            text = self.read(record_id)
+            if text is None:
+                continue
+            record = json.loads(text)
+            summaries.append(
+                {
+                    key: record[key]
+                    for key in ("id", "started_at", "method", "path", "query", "status", "duration_s", "trigger", "sql_seconds")
+                }
+            )
+        return summaries
+
+
+slow_requests = SlowRequestLog()
+_sampler = _Sampler()
+
+
+def _trigger(scope):
+    if PROFILE_TOKEN is not None:
+        for name, value in scope["headers"]:
+            if name == HEADER.encode():
+                return "header" if is_admin(value.decode("latin-1")) else None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware tracing requests, sampling the profiled ones and
+    writing profiled and slow ones to the ring buffer.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        trigger = _trigger(scope)
+        if trigger is None and SLOW_REQUEST_SECONDS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(trigger)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if trigger == "header":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-profile-id", trace.id.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current.set(trace)
+        if trace.sampled:
+            trace.loop_thread = threading.get_ident()
+            trace.task = asyncio.current_task()
+            trace.threads[trace.loop_thread] = 1
+            _sampler.add(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _sampler.remove(trace)
+            _current.reset(token)
+            duration = time.perf_counter() - trace.started
+
+        if trigger is not None or 0 < SLOW_REQUEST_SECONDS <= duration:
+            try:
+                await asyncio.to_thread(slow_requests.write, trace.record(scope, status_code, duration))
+            except OSError as e:
+                print(f"Could not write slow request record: {e}")
@@ -0,0 +1,86 @@
+"""
+Seeds the parking table from combined_parking_data as CSV or Parquet.
+
+    python seed_parking.py --data ../data/combined_parking_data.parquet
+
+The file is read column-pruned and in chunks, each chunk is streamed to
+Postgres with COPY, and the geography column and parking zones are filled
+afterwards, all in one transaction. script.sql does the same for the CSV
+at container init, except for the zones (see zones.py). It only appends;
+to refresh a populated table use ingest_parking.py. --truncate empties
+the parking table first, and refuses to while history or occupancy
+observations reference spots.
+"""
+import argparse
+import io
+import time
+
+from models.database import engine
+from parking_time_estimators.datasets import PARKING_DTYPES, iter_chunks
+from zones import rebuild_zones
+
+COPY_SQL = (
+    f"COPY parking ({', '.join(PARKING_DTYPES)}) FROM STDIN WITH (FORMAT csv)"
+)
+
+GEOM_SQL = """
+    UPDATE parking
+    SET geom = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+    WHERE geom IS NULL
+"""
+
+# tables with rows referencing parking(id)
+DEPENDENT_TABLES = ("history", "occupancy_observations")
+
+
+def seed_parking(path, truncate=False):
+    conn = engine.raw_connection()
+    rows = 0
+    try:
+        with conn.cursor() as cur:
+            if truncate:
+                for table in DEPENDENT_TABLES:
+                    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE parking_id IS NOT NULL)")
+                    if cur.fetchone()[0]:
+                        raise ValueError(
+                            f"{table} references parking spots, not truncating; "
+                            "use ingest_parking.py to refresh a populated table"
+                        )
+                cur.execute("DELETE FROM parking")
+            for chunk in iter_chunks(path, PARKING_DTYPES):
+                buffer = io.StringIO()
+                chunk.to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                cur.copy_expert(COPY_SQL, buffer)
+                rows += len(chunk)
+            cur.execute(GEOM_SQL)
+            rebuild_zones(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the parking table")
+    parser.add_argument("--data", required=True, help="parking data, CSV or Parquet")
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="empty the parking table first; fails if history or observations reference it",
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        rows = seed_parking(args.data, truncate=args.truncate)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Seeded {rows} parking spots in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
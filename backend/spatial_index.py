@@ -0,0 +1,144 @@
+"""
+In-memory nearest-parking index.
+
+The parking table is small and mostly static, so each worker keeps a
+KD-tree over the spots (as 3D unit vectors, so chord distances map
+exactly onto great-circle distances) and answers radius + k-nearest
+queries without touching PostGIS. PostGIS stays the fallback while the
+index is not loaded.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import text
+
+# Mean earth radius. ST_Distance on geography uses the WGS84 spheroid, so
+# distances agree to within ~0.5%.
+EARTH_RADIUS_M = 6371008.8
+
+PARKING_COLUMNS = ("id", "address", "capacity", "latitude", "longitude", "parking_type")
+
+FINGERPRINT_SQL = text("""
+    SELECT count(*), md5(string_agg(
+        concat_ws(':', id, address, capacity, latitude, longitude, parking_type),
+        ',' ORDER BY id
+    ))
+    FROM parking
+""")
+
+
+def _unit_vectors(latitude, longitude):
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def haversine_m(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distance in meters from one point to many.
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=float) - longitude)
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+class SpatialIndex:
+    def __init__(self, columns, fingerprint=None):
+        latitude = np.asarray(columns["latitude"], dtype=float)
+        longitude = np.asarray(columns["longitude"], dtype=float)
+        # spots without coordinates have no geom and never match in PostGIS
+        valid = ~(np.isnan(latitude) | np.isnan(longitude))
+
+        self.columns = {
+            name: [value for value, ok in zip(columns[name], valid) if ok]
+            for name in PARKING_COLUMNS
+        }
+        self.fingerprint = fingerprint
+        self.tree = cKDTree(_unit_vectors(latitude[valid], longitude[valid]))
+
+    def __len__(self):
+        return self.tree.n
+
+    def within(self, latitude, longitude, radius_m):
+        """
+        Row indices (into self.columns) and distances in meters of all
+        spots within radius_m, unordered.
+        """
+        if len(self) == 0 or radius_m < 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        angle = min(radius_m / EARTH_RADIUS_M, np.pi)
+        point = _unit_vectors([latitude], [longitude])[0]
+        rows = np.asarray(
+            self.tree.query_ball_point(point, np.nextafter(2 * np.sin(angle / 2), np.inf)),
+            dtype=np.intp,
+        )
+        chord = np.linalg.norm(self.tree.data[rows] - point, axis=1)
+        return rows, 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord / 2, 1.0))
+
+    def nearest(self, latitude, longitude, radius_m, limit=20):
+        """
+        Same result shape and ordering as the PostGIS query in main.py.
+        """
+        if len(self) == 0 or radius_m < 0:
+            return []
+        k = min(limit, len(self))
+        angle = min(radius_m / EARTH_RADIUS_M, np.pi)
+        chord = 2 * np.sin(angle / 2)
+        distances, indices = self.tree.query(
+            _unit_vectors([latitude], [longitude])[0],
+            k=k,
+            # distance_upper_bound is exclusive, ST_DWithin is inclusive
+            distance_upper_bound=np.nextafter(chord, np.inf),
+        )
+        distances = np.atleast_1d(distances)
+        indices = np.atleast_1d(indices)
+        found = np.isfinite(distances)
+        arc_m = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(distances[found] / 2, 1.0))
+        return self.records(indices[found], arc_m)
+
+    def records(self, rows, distances):
+        """
+        Spot dicts for row indices, with their distances in meters.
+        """
+        columns = self.columns
+        return [
+            {
+                "id": columns["id"][i],
+                "address": columns["address"][i],
+                "capacity": columns["capacity"][i],
+                "latitude": columns["latitude"][i],
+                "longitude": columns["longitude"][i],
+                "parking_type": columns["parking_type"][i],
+                "distance_m": float(d),
+            }
+            for i, d in zip(np.asarray(rows).tolist(), np.asarray(distances).tolist())
+        ]
+
+
+def parking_fingerprint(conn):
+    """
+    Cheap digest of the parking table, used to detect when the index (and
+    anything else derived from the table) needs a refresh.
+    """
+    count, digest = conn.execute(FINGERPRINT_SQL).one()
+    return f"{count}:{digest}"
+
+
+def load_parking_columns(conn):
+    rows = conn.execute(
+        text(f"SELECT {', '.join(PARKING_COLUMNS)} FROM parking ORDER BY id")
+    ).fetchall()
+    columns = {name: [getattr(row, name) for row in rows] for name in PARKING_COLUMNS}
+    columns["capacity"] = [
+        float(c) if c is not None else None for c in columns["capacity"]
+    ]
+    columns["latitude"] = [
+        float(v) if v is not None else np.nan for v in columns["latitude"]
+    ]
+    columns["longitude"] = [
+        float(v) if v is not None else np.nan for v in columns["longitude"]
+    ]
+    return columns
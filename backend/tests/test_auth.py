@@ -0,0 +1,32 @@
+import pytest
+
+import auth
+
+
+@pytest.fixture
+def handler():
+    return auth.pwd_context.handler(auth._HASH_SCHEME)
+
+
+def test_current_hash_needs_no_rehash():
+    assert not auth.needs_rehash(auth.get_password_hash("secret"))
+
+
+def test_changed_rounds_need_rehash(handler):
+    rounds = handler.default_rounds - 1
+    if rounds < handler.min_rounds:
+        rounds = handler.default_rounds + 1
+    assert auth.needs_rehash(handler.using(rounds=rounds).hash("secret"))
+
+
+def test_changed_argon2_parameters_need_rehash(handler):
+    if auth._HASH_SCHEME != "argon2":
+        pytest.skip("argon2 is not available")
+    assert auth.needs_rehash(handler.using(memory_cost=handler.memory_cost // 2).hash("secret"))
+    assert auth.needs_rehash(handler.using(parallelism=handler.parallelism + 1).hash("secret"))
+
+
+def test_verify_and_update():
+    hashed = auth.get_password_hash("secret")
+    assert auth.verify_and_update("secret", hashed) == (True, None)
+    assert auth.verify_and_update("wrong", hashed) == (False, None)
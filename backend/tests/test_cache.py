@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import cache
+import main
+from cache import GeoCellCache, InMemoryCacheBackend, TTLCache
+from spatial_index import SpatialIndex
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def _index(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    latitude = 52.52 + rng.uniform(-0.01, 0.01, n)
+    longitude = 13.40 + rng.uniform(-0.015, 0.015, n)
+    return SpatialIndex(
+        {
+            "id": [f"p{i}" for i in range(n)],
+            "address": [f"Street {i}" for i in range(n)],
+            "capacity": rng.integers(1, 50, n).tolist(),
+            "latitude": latitude.tolist(),
+            "longitude": longitude.tolist(),
+            "parking_type": ["street"] * n,
+        }
+    )
+
+
+def test_ttl_cache_expires_entries(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=5)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2, ttl=20)
+    clock.now += 4.9
+    assert ttl_cache.get("a") == 1
+    clock.now += 0.1
+    assert ttl_cache.get("a") is None
+    assert ttl_cache.get("b") == 2
+    assert len(ttl_cache) == 1
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    ttl_cache = TTLCache(maxsize=2, ttl=5)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.get("a")
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is None
+    assert (ttl_cache.get("a"), ttl_cache.get("c")) == (1, 3)
+
+
+def test_geo_cell_cache_entries_expire(clock):
+    geo_cache = GeoCellCache(InMemoryCacheBackend(ttl=300), ttl=300)
+    geo_cache.ttl_now = lambda now=None: 60
+
+    async def run():
+        await geo_cache.set("k", [{"id": "p1"}])
+        first = await geo_cache.get("k")
+        first[0]["id"] = "changed"
+        clock.now += 59
+        second = await geo_cache.get("k")
+        clock.now += 1
+        return second, await geo_cache.get("k")
+
+    second, expired = asyncio.run(run())
+    # every get decodes its own copy
+    assert second == [{"id": "p1"}]
+    assert expired is None
+
+
+def test_geo_cell_cache_key_and_ttl_follow_the_hour():
+    geo_cache = GeoCellCache(InMemoryCacheBackend(), ttl=300)
+    cell, _, _ = geo_cache.cell(52.52, 13.40)
+    keys = {
+        geo_cache.key("nearest", cell, 500, "W", hour)
+        for hour in (10, 11)
+    }
+    assert len(keys) == 2
+    assert geo_cache.key("nearest", cell, 500, "W", 10) != geo_cache.key("nearest", cell, 500, "S", 10)
+    assert geo_cache.key("nearest", cell, 500, "W", 10, version="a") != geo_cache.key(
+        "nearest", cell, 500, "W", 10, version="b"
+    )
+
+    assert geo_cache.ttl_now(datetime(2024, 5, 6, 10, 59, 30)) == 30
+    assert geo_cache.ttl_now(datetime(2024, 5, 6, 10, 0, 0)) == 300
+
+
+def test_cell_contains_its_points():
+    geo_cache = GeoCellCache(InMemoryCacheBackend(), cell_size_m=25)
+    rng = np.random.default_rng(1)
+    for latitude, longitude in zip(52.5 + rng.uniform(0, 0.01, 200), 13.4 + rng.uniform(0, 0.01, 200)):
+        _, center_lat, center_lon = geo_cache.cell(latitude, longitude)
+        distance = main.haversine_m(latitude, longitude, [center_lat], [center_lon])[0]
+        assert distance <= geo_cache.half_diagonal_m
+
+
+@pytest.mark.parametrize("radius_m", [50, 150, 400])
+def test_cached_nearby_is_exact_at_cell_edges(monkeypatch, radius_m):
+    index = _index()
+    geo_cache = GeoCellCache(InMemoryCacheBackend(), cell_size_m=25)
+    monkeypatch.setattr(main, "geo_cache", geo_cache)
+    monkeypatch.setattr(main, "GEO_CACHE_ENABLED", True)
+    computed = []
+
+    async def compute(latitude, longitude, radius, limit):
+        computed.append((latitude, longitude))
+        return index.nearest(latitude, longitude, radius, limit)
+
+    async def run(points):
+        return [
+            await main.cached_nearby("nearest", latitude, longitude, radius_m, compute)
+            for latitude, longitude in points
+        ]
+
+    # the corners and edge midpoints of cells, just inside
+    _, center_lat, center_lon = geo_cache.cell(52.52, 13.40)
+    lat_half = 0.4999 * geo_cache.cell_size_m / geo_cache.METERS_PER_DEGREE
+    lon_half = lat_half / np.cos(np.radians(center_lat))
+    points = [
+        (center_lat + dlat * lat_half, center_lon + dlon * lon_half)
+        for dlat in (-1, 0, 1)
+        for dlon in (-1, 0, 1)
+    ]
+    results = asyncio.run(run(points))
+
+    # one miss for the cell, the rest answered from its candidates
+    assert len({geo_cache.cell(*point)[0] for point in points}) == 1
+    assert computed[0] == (center_lat, center_lon)
+    for (latitude, longitude), result in zip(points, results):
+        expected = index.nearest(latitude, longitude, radius_m, main.NEAREST_LIMIT)
+        assert [spot["id"] for spot in result] == [spot["id"] for spot in expected]
+        assert [spot["distance_m"] for spot in result] == pytest.approx(
+            [spot["distance_m"] for spot in expected]
+        )
+        assert all(spot["distance_m"] <= radius_m for spot in result)
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from estimate_updates import EstimateBroadcaster
+
+SPOTS = [
+    {"id": "a", "capacity": 4, "latitude": 48.1, "longitude": 11.5},
+    {"id": "b", "capacity": None, "latitude": 48.2, "longitude": 11.6},
+]
+
+
+class Model:
+    def __init__(self):
+        self.version = 1
+        self.values = {"a": 3.0, "b": 5.0}
+        self.fail = False
+        self.calls = 0
+
+    def estimate(self, spot_ids, capacity, latitude, longitude):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("estimator unavailable")
+        return [self.values[spot_id] for spot_id in spot_ids], {"hour": 10}
+
+
+def test_failed_check_is_retried():
+    model = Model()
+    broadcaster = EstimateBroadcaster(model.estimate, lambda: model.version)
+
+    async def run():
+        subscription, _ = await broadcaster.subscribe(SPOTS)
+        await broadcaster.check()
+
+        model.version = 2
+        model.values["a"] = 4.0
+        model.fail = True
+        with pytest.raises(RuntimeError):
+            await broadcaster.check()
+        assert subscription.queue.empty()
+
+        model.fail = False
+        assert await broadcaster.check() == 1
+        assert await broadcaster.check() == 0
+        return subscription.queue.get_nowait()
+
+    event = asyncio.run(run())
+    assert '"a": 4.0' in event
+    # subscribe, the first check, the failed one and its retry
+    assert model.calls == 4
+
+
+def test_check_pushes_changed_spots_to_their_subscribers():
+    model = Model()
+    broadcaster = EstimateBroadcaster(model.estimate, lambda: model.version, min_change=0.5)
+
+    async def run():
+        first, snapshot = await broadcaster.subscribe(SPOTS)
+        second, _ = await broadcaster.subscribe(SPOTS[1:])
+        assert '"a": 3.0' in snapshot and '"b": 5.0' in snapshot
+        assert await broadcaster.check() == 0
+
+        # same version: nothing is computed
+        calls = model.calls
+        assert await broadcaster.check() == 0
+        assert model.calls == calls
+
+        # a moves less than min_change, b more
+        model.version = 2
+        model.values.update(a=3.4, b=6.0)
+        assert await broadcaster.check() == 1
+        return first.queue.get_nowait(), second.queue.get_nowait(), first, second
+
+    first_event, second_event, first, second = asyncio.run(run())
+    for event in (first_event, second_event):
+        assert event.startswith("event: update\n")
+        assert '"b": 6.0' in event and '"a"' not in event
+        assert '"hour": 10' in event
+    assert first.queue.empty() and second.queue.empty()
+
+
+def test_check_pushes_unknown_estimates_as_null():
+    model = Model()
+    broadcaster = EstimateBroadcaster(model.estimate, lambda: model.version)
+
+    async def run():
+        subscription, _ = await broadcaster.subscribe(SPOTS[:1])
+        await broadcaster.check()
+        model.version = 2
+        model.values["a"] = float("nan")
+        assert await broadcaster.check() == 1
+        return subscription.queue.get_nowait()
+
+    assert '"a": null' in asyncio.run(run())
+
+
+def test_check_skips_unsubscribed_spots():
+    model = Model()
+    broadcaster = EstimateBroadcaster(model.estimate, lambda: model.version)
+
+    async def run():
+        subscription, _ = await broadcaster.subscribe(SPOTS)
+        broadcaster.unsubscribe(subscription)
+        model.version = 2
+        calls = model.calls
+        assert await broadcaster.check() == 0
+        return calls
+
+    calls = asyncio.run(run())
+    assert model.calls == calls
+    assert len(broadcaster) == 0
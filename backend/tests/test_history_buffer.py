@@ -0,0 +1,129 @@
+import asyncio
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from history_buffer import HistoryWriter
+
+
+class FakeDatabase:
+    """
+    Session factory standing in for AsyncSessionLocal: rejects batches with
+    an unknown parking id, like the foreign key does.
+    """
+
+    def __init__(self, unknown=(), down=False, down_after=None):
+        self.unknown = set(unknown)
+        self.down = down
+        # goes down after this many INSERTs
+        self.down_after = down_after
+        self.rows = []
+        self.saved_time = {}
+        self.writes = 0
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+        self.deltas = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params):
+        if self.database.writes == self.database.down_after:
+            self.database.down = True
+        if self.database.down:
+            raise OperationalError("INSERT", {}, ConnectionError("connection refused"))
+        if statement.is_insert:
+            self.database.writes += 1
+            if any(row["parking_id"] in self.database.unknown for row in params):
+                raise IntegrityError("INSERT", {}, Exception("history_parking_id_fkey"))
+            self.rows += params
+        else:
+            self.deltas += params
+
+    async def commit(self):
+        self.database.rows += self.rows
+        for delta in self.deltas:
+            saved_time = self.database.saved_time
+            saved_time[delta["uid"]] = saved_time.get(delta["uid"], 0) + delta["delta"]
+
+
+def _add_events(writer, parking_ids):
+    for i, parking_id in enumerate(parking_ids):
+        writer.add(i % 3, parking_id, 1.0, None)
+
+
+def test_flush_drops_only_rejected_events():
+    database = FakeDatabase(unknown={"gone"})
+    flushed = []
+    writer = HistoryWriter(database, batch_size=100, on_flush=flushed.append)
+    parking_ids = [f"p{i}" for i in range(21)]
+    for i in (3, 10, 17):
+        parking_ids[i] = "gone"
+
+    async def run():
+        _add_events(writer, parking_ids)
+        await writer.flush()
+
+    asyncio.run(run())
+    assert [row["parking_id"] for row in database.rows] == [p for p in parking_ids if p != "gone"]
+    assert sum(database.saved_time.values()) == 18
+    assert len(writer) == 0
+    assert set().union(*flushed) == {0, 1, 2}
+
+
+def test_flush_bisects_down_to_the_rejected_event():
+    database = FakeDatabase(unknown={"gone"})
+    writer = HistoryWriter(database, batch_size=64)
+    parking_ids = [f"p{i}" for i in range(64)]
+    parking_ids[41] = "gone"
+
+    async def run():
+        _add_events(writer, parking_ids)
+        await writer.flush()
+
+    asyncio.run(run())
+    assert len(database.rows) == 63
+    # the batch, then both halves on each of the 6 levels
+    assert database.writes == 1 + 2 * 6
+
+
+def test_flush_keeps_events_while_the_database_is_down():
+    database = FakeDatabase(down=True)
+    writer = HistoryWriter(database, batch_size=4)
+
+    async def run():
+        _add_events(writer, [f"p{i}" for i in range(10)])
+        await writer.flush()
+        assert len(writer) == 10
+        database.down = False
+        await writer.flush()
+
+    asyncio.run(run())
+    assert [row["parking_id"] for row in database.rows] == [f"p{i}" for i in range(10)]
+    assert len(writer) == 0
+
+
+def test_bisection_puts_events_back_when_the_database_goes_down():
+    # down after the rejected batch and its first half
+    database = FakeDatabase(unknown={"gone"}, down_after=2)
+    writer = HistoryWriter(database, batch_size=100)
+    parking_ids = [f"p{i}" for i in range(8)]
+    parking_ids[1] = "gone"
+
+    async def run():
+        _add_events(writer, parking_ids)
+        await writer.flush()
+
+    asyncio.run(run())
+    assert database.rows == []
+    # every event is pending again, in order
+    assert [event["parking_id"] for event in writer._pending] == parking_ids
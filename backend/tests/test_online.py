@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from parking_time_estimators.online import OccupancyStats
+
+
+def test_updated_replaces_recomputed_buckets():
+    stats = OccupancyStats().updated(
+        [("a", "WT", 10, 4, 0.5), ("b", "SA", 9.0, 2, 1.0)], last_id=6
+    )
+    newer = stats.updated([("a", "WT", 10, 5, 0.8)], last_id=7, gaps={5: 0.0})
+
+    assert newer.buckets == {("a", "WT", 10): (5, 0.8), ("b", "SA", 9): (2, 1.0)}
+    assert (newer.last_id, newer.version) == (7, (7, 1))
+    # snapshots are immutable
+    assert stats.buckets[("a", "WT", 10)] == (4, 0.5)
+    assert (stats.last_id, stats.version) == (6, (6, 0))
+
+
+def test_blend_weights_prior_and_observations():
+    stats = OccupancyStats().updated(
+        [("a", "WT", 10, 5, 1.0), ("b", "WT", 11, 20, 0.0)], last_id=25
+    )
+    blended = stats.blend(["a", "b", "c"], "WT", 10, [0.2, 0.4, 0.6], prior_weight=5)
+
+    # b has observations, but not for this hour; c has none at all
+    assert blended == pytest.approx([0.6, 0.4, 0.6])
+
+
+def test_blend_without_observations_keeps_prior():
+    prior = np.array([0.1, np.nan])
+    blended = OccupancyStats().blend(["a", "b"], "WT", 10, prior)
+    np.testing.assert_array_equal(blended, prior)
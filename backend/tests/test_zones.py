@@ -0,0 +1,68 @@
+import math
+
+import pytest
+
+from spatial_index import SpatialIndex
+from zones import ZoneIndex, build_zones
+
+
+def _columns(spots):
+    names = ("id", "address", "capacity", "latitude", "longitude", "parking_type")
+    return {name: [spot[i] for spot in spots] for i, name in enumerate(names)}
+
+
+SPOTS = [
+    ("s1", "Rindermarkt", 2.0, 48.13600, 11.57400, "street"),
+    ("s2", "rindermarkt ", 6.0, 48.13610, 11.57420, "street"),
+    ("s3", "Rindermarkt", None, 48.13590, 11.57390, "street"),
+    # same street, other parking type
+    ("s4", "Rindermarkt", 10.0, 48.13600, 11.57400, "garage"),
+    # same street, far away
+    ("s5", "Rindermarkt", 3.0, 48.15000, 11.60000, "street"),
+    ("s6", "Nowhere", 1.0, None, None, "street"),
+]
+
+
+def test_build_zones_merges_street_segments_per_cell():
+    zones, spot_zone = build_zones(_columns(SPOTS), cell_m=250)
+
+    assert spot_zone[0] == spot_zone[1] == spot_zone[2]
+    assert len({spot_zone[0], spot_zone[3], spot_zone[4]}) == 3
+    assert spot_zone[5] is None
+    assert len(zones["id"]) == 3
+    assert zones["id"] == sorted(zones["id"])
+
+    zone = zones["id"].index(spot_zone[0])
+    assert zones["spot_count"][zone] == 3
+    # unknown capacities do not count, but their spot weighs in once
+    assert zones["capacity"][zone] == 8.0
+    assert zones["latitude"][zone] == pytest.approx((2 * 48.136 + 6 * 48.1361 + 48.1359) / 9)
+    assert zones["longitude"][zone] == pytest.approx((2 * 11.574 + 6 * 11.5742 + 11.5739) / 9)
+    assert zones["representative_id"][zone] == "s2"
+
+
+def test_build_zones_ids_are_stable():
+    first, _ = build_zones(_columns(SPOTS))
+    second, _ = build_zones(_columns(list(reversed(SPOTS))))
+    assert first == second
+
+
+def test_build_zones_of_unknown_capacity():
+    zones, _ = build_zones(_columns([("s1", "A", None, 48.1, 11.5, "street")]))
+    assert zones["capacity"] == [None]
+
+
+def test_build_zones_without_coordinates():
+    zones, spot_zone = build_zones(_columns([SPOTS[-1]]))
+    assert zones == {name: [] for name in zones}
+    assert spot_zone.tolist() == [None]
+
+
+def test_zone_index_nearest():
+    index = ZoneIndex(SpatialIndex(_columns(SPOTS)))
+    zones = index.nearest(48.13600, 11.57400, 100, limit=10)
+
+    assert len(zones) == 2
+    assert {zone["spot_count"] for zone in zones} == {1, 3}
+    assert [zone["distance_m"] for zone in zones] == sorted(zone["distance_m"] for zone in zones)
+    assert math.isclose(index.nearest_member_m(zones[0]["id"], 48.13600, 11.57400), 0.0, abs_tol=1e-6)
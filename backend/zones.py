@@ -0,0 +1,334 @@
+"""
+Parking zones: the street parking segments of one street (and parking
+type) within a grid cell, merged into a single candidate.
+
+The opendata inventory has ~12.7k short street segments, so the 20
+nearest spots are often slivers of the same two streets, each estimated
+on its own. A zone has the summed capacity, a capacity-weighted centroid
+and a representative segment (the one closest to the centroid) whose
+occupancy stands in for the zone; with the default 250 m cells there are
+about 3.4k zones. /nearest?group=zones returns zones and
+/zones/{zone_id}/spots expands one into its segments.
+
+Zones are derived from the parking table alone, by build_zones: every
+worker builds them in memory on each parking refresh (ZoneIndex), and
+ingest_parking.py / seed_parking.py write the same layer to parking_zones
+and parking.zone_id in their transaction, for the PostGIS fallback. On a
+database initialized by script.sql the app fills it on its first parking
+refresh (fill_missing_zones); `python zones.py` rebuilds it by hand.
+"""
+import argparse
+import hashlib
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from spatial_index import EARTH_RADIUS_M, PARKING_COLUMNS, haversine_m
+
+ZONE_CELL_M = float(os.getenv("ZONE_CELL_M", "250"))
+
+ZONE_COLUMNS = (
+    "id",
+    "address",
+    "capacity",
+    "latitude",
+    "longitude",
+    "parking_type",
+    "spot_count",
+    "representative_id",
+)
+
+ASSIGNMENT_STAGING_SQL = """
+    CREATE TEMPORARY TABLE parking_zone_staging (id VARCHAR(200), zone_id VARCHAR(64))
+    ON COMMIT DROP
+"""
+
+COPY_ZONES_SQL = (
+    f"COPY parking_zones ({', '.join(ZONE_COLUMNS)}, geom) FROM STDIN WITH (FORMAT csv)"
+)
+COPY_ASSIGNMENT_SQL = "COPY parking_zone_staging (id, zone_id) FROM STDIN WITH (FORMAT csv)"
+
+# Only rows whose zone changed are written
+ASSIGN_SQL = """
+    UPDATE parking p
+    SET zone_id = s.zone_id
+    FROM parking_zone_staging s
+    WHERE s.id = p.id AND p.zone_id IS DISTINCT FROM s.zone_id
+"""
+# zones missing: none at all, but spots to build them from
+ZONES_MISSING_SQL = """
+    SELECT NOT EXISTS (SELECT 1 FROM parking_zones) AND EXISTS (SELECT 1 FROM parking)
+"""
+
+UNASSIGN_SQL = """
+    UPDATE parking p
+    SET zone_id = NULL
+    WHERE p.zone_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM parking_zone_staging s WHERE s.id = p.id)
+"""
+
+
+def zone_ids(address, parking_type, latitude, longitude, cell_m=ZONE_CELL_M):
+    """
+    Zone id per spot: a digest of parking type, street (case-insensitive)
+    and grid cell, so ids stay the same across rebuilds. Cells are cell_m
+    wide on an equirectangular projection, which is plenty within a city.
+    """
+    latitude = np.radians(np.asarray(latitude, dtype=float))
+    longitude = np.radians(np.asarray(longitude, dtype=float))
+    x = np.floor(longitude * np.cos(latitude) * EARTH_RADIUS_M / cell_m).astype(np.int64)
+    y = np.floor(latitude * EARTH_RADIUS_M / cell_m).astype(np.int64)
+    street = pd.Series(address, dtype=object).fillna("").astype(str).str.strip().str.lower()
+    keys = (
+        pd.Series(parking_type, dtype=object).fillna("").astype(str).to_numpy(dtype=object)
+        + ":" + street.to_numpy(dtype=object)
+        + ":" + x.astype(str).astype(object)
+        + ":" + y.astype(str).astype(object)
+    )
+    unique, inverse = np.unique(keys.astype(str), return_inverse=True)
+    digests = np.array(
+        ["zone_" + hashlib.md5(key.encode()).hexdigest()[:16] for key in unique], dtype=object
+    )
+    return digests[inverse.ravel()]
+
+
+def build_zones(columns, cell_m=ZONE_CELL_M):
+    """
+    Zones of the spots in `columns` (as load_parking_columns returns them).
+    Returns the zone columns (ZONE_COLUMNS, ordered by id) and the zone id
+    per spot, None for spots without coordinates.
+    """
+    frame = pd.DataFrame({name: list(columns[name]) for name in PARKING_COLUMNS})
+    for name in ("capacity", "latitude", "longitude"):
+        frame[name] = pd.to_numeric(frame[name], errors="coerce").astype(float)
+    valid = (frame["latitude"].notna() & frame["longitude"].notna()).to_numpy()
+    spot_zone = np.full(len(frame), None, dtype=object)
+    frame = frame[valid].copy()
+    if frame.empty:
+        return {name: [] for name in ZONE_COLUMNS}, spot_zone
+
+    frame["zone"] = spot_zone[valid] = zone_ids(
+        frame["address"], frame["parking_type"], frame["latitude"], frame["longitude"], cell_m
+    )
+    # capacity-weighted centroid; spots of unknown capacity count once
+    weight = frame["capacity"].where(frame["capacity"] > 0, 1.0)
+    frame["weight"] = weight
+    frame["weighted_latitude"] = weight * frame["latitude"]
+    frame["weighted_longitude"] = weight * frame["longitude"]
+
+    grouped = frame.groupby("zone", sort=True)
+    zones = grouped.agg(
+        address=("address", "first"),
+        parking_type=("parking_type", "first"),
+        spot_count=("id", "size"),
+        weight=("weight", "sum"),
+        weighted_latitude=("weighted_latitude", "sum"),
+        weighted_longitude=("weighted_longitude", "sum"),
+    )
+    # unknown (null) only if no spot of the zone has a capacity on record
+    zones["capacity"] = grouped["capacity"].sum(min_count=1)
+    zones["latitude"] = zones["weighted_latitude"] / zones["weight"]
+    zones["longitude"] = zones["weighted_longitude"] / zones["weight"]
+
+    # representative: the spot closest to the centroid (ties by id)
+    centroid_latitude = frame["zone"].map(zones["latitude"])
+    centroid_longitude = frame["zone"].map(zones["longitude"])
+    frame["offset"] = (frame["latitude"] - centroid_latitude) ** 2 + (
+        (frame["longitude"] - centroid_longitude) * np.cos(np.radians(centroid_latitude))
+    ) ** 2
+    representatives = (
+        frame.sort_values(["zone", "offset", "id"]).drop_duplicates("zone").set_index("zone")["id"]
+    )
+    zones["representative_id"] = representatives
+
+    result = {
+        "id": zones.index.tolist(),
+        "address": [a if isinstance(a, str) else None for a in zones["address"]],
+        "capacity": [float(c) if np.isfinite(c) else None for c in zones["capacity"]],
+        "latitude": zones["latitude"].tolist(),
+        "longitude": zones["longitude"].tolist(),
+        "parking_type": [t if isinstance(t, str) else None for t in zones["parking_type"]],
+        "spot_count": zones["spot_count"].astype(int).tolist(),
+        "representative_id": zones["representative_id"].tolist(),
+    }
+    return result, spot_zone
+
+
+class ZoneIndex:
+    """
+    Zones over the spots of a SpatialIndex. Radius queries return the
+    zones with a spot within the radius, by distance to their centroid
+    (like the PostGIS fallback in main.py, and what the geo-cell cache
+    re-measures).
+    """
+
+    def __init__(self, spots, cell_m=ZONE_CELL_M):
+        self.spots = spots
+        self.columns, spot_zone = build_zones(spots.columns, cell_m)
+        row = {zone_id: i for i, zone_id in enumerate(self.columns["id"])}
+        # the spatial index only holds spots with coordinates, all zoned
+        self.spot_zone = np.array([row[zone_id] for zone_id in spot_zone], dtype=np.intp)
+        order = np.argsort(self.spot_zone, kind="stable")
+        counts = np.bincount(self.spot_zone, minlength=len(row))
+        self._members = np.split(order, np.cumsum(counts)[:-1])
+        self._rows = row
+        self._spot_rows = {spot_id: i for i, spot_id in enumerate(spots.columns["id"])}
+        self._latitude = np.asarray(self.columns["latitude"], dtype=float)
+        self._longitude = np.asarray(self.columns["longitude"], dtype=float)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def nearest(self, latitude, longitude, radius_m, limit=20):
+        rows, distances = self.spots.within(latitude, longitude, radius_m)
+        if len(rows) == 0:
+            return []
+        zones = np.unique(self.spot_zone[rows])
+        distances = haversine_m(latitude, longitude, self._latitude[zones], self._longitude[zones])
+        nearest = np.argsort(distances, kind="stable")[:limit]
+        return [self._record(z, d) for z, d in zip(zones[nearest].tolist(), distances[nearest].tolist())]
+
+    def _record(self, zone, distance):
+        record = {name: self.columns[name][zone] for name in ZONE_COLUMNS}
+        record["distance_m"] = float(distance)
+        return record
+
+    def nearest_member_m(self, zone_id, latitude, longitude):
+        """
+        Distance in meters to the zone's nearest spot, None for an unknown
+        zone.
+        """
+        zone = self._rows.get(zone_id)
+        if zone is None:
+            return None
+        rows = self._members[zone]
+        columns = self.spots.columns
+        return float(
+            haversine_m(
+                latitude,
+                longitude,
+                [columns["latitude"][i] for i in rows],
+                [columns["longitude"][i] for i in rows],
+            ).min()
+        )
+
+    def spots_by_id(self, spot_ids):
+        """
+        Spot records (without distance) by id, for the ids that are known.
+        """
+        columns = self.spots.columns
+        records = {}
+        for spot_id in spot_ids:
+            i = self._spot_rows.get(spot_id)
+            if i is not None:
+                records[spot_id] = {name: columns[name][i] for name in PARKING_COLUMNS}
+        return records
+
+    def members(self, zone_id, latitude, longitude):
+        """
+        Spots of a zone, nearest to (latitude, longitude) first. None for an
+        unknown zone.
+        """
+        zone = self._rows.get(zone_id)
+        if zone is None:
+            return None
+        rows = self._members[zone]
+        columns = self.spots.columns
+        distances = haversine_m(
+            latitude,
+            longitude,
+            [columns["latitude"][i] for i in rows],
+            [columns["longitude"][i] for i in rows],
+        )
+        order = np.argsort(distances, kind="stable")
+        return self.spots.records(rows[order], distances[order])
+
+
+def rebuild_zones(cur, cell_m=ZONE_CELL_M):
+    """
+    Recomputes parking_zones and parking.zone_id from the parking table,
+    on the DB-API cursor of an open transaction. Returns the zone count.
+    """
+    cur.execute(f"SELECT {', '.join(PARKING_COLUMNS)} FROM parking ORDER BY id")
+    rows = cur.fetchall()
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(PARKING_COLUMNS)}
+    zones, spot_zone = build_zones(columns, cell_m)
+
+    frame = pd.DataFrame(zones, columns=list(ZONE_COLUMNS))
+    frame["geom"] = (
+        "SRID=4326;POINT("
+        + frame["longitude"].map(repr)
+        + " "
+        + frame["latitude"].map(repr)
+        + ")"
+    )
+    cur.execute("DELETE FROM parking_zones")
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert(COPY_ZONES_SQL, buffer)
+
+    zoned = pd.notna(spot_zone)
+    assignment = pd.DataFrame(
+        {"id": np.asarray(columns["id"], dtype=object)[zoned], "zone_id": spot_zone[zoned]}
+    )
+    cur.execute(ASSIGNMENT_STAGING_SQL)
+    buffer = io.StringIO()
+    assignment.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert(COPY_ASSIGNMENT_SQL, buffer)
+    cur.execute(ASSIGN_SQL)
+    cur.execute(UNASSIGN_SQL)
+    return len(frame)
+
+
+def fill_missing_zones(engine, cell_m=ZONE_CELL_M):
+    """
+    Builds parking_zones if it is empty while parking is not, as after a
+    script.sql init. Returns the zone count, or None if nothing was
+    missing. Workers take turns on an advisory lock, so the first one
+    builds the zones and the others find them.
+    """
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('parking_zones'))")
+            cur.execute(ZONES_MISSING_SQL)
+            count = rebuild_zones(cur, cell_m) if cur.fetchone()[0] else None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return count
+
+
+def main(argv=None):
+    from models.database import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild the parking zones")
+    parser.add_argument(
+        "--cell-m", type=float, default=ZONE_CELL_M, help="grid cell size in meters"
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            count = rebuild_zones(cur, args.cell_m)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"Rebuilt {count} parking zones in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
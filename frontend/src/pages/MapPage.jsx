@@ -68,7 +68,7 @@ function MapPage({ user, onUserUpdate }) {
       setStatus("Searching for nearby parking at your destination…");
 
       const nearestRes = await fetch(
-        `${API_BASE_URL}/nearest?latitude=${encodeURIComponent(
+        `${API_BASE_URL}/nearest_with_estimates?latitude=${encodeURIComponent(
           latitude,
         )}&longitude=${encodeURIComponent(longitude)}&radius_m=500`,
       );
@@ -77,6 +77,7 @@ function MapPage({ user, onUserUpdate }) {
         throw new Error("Failed to fetch nearest parking spots");
       }
 
+      // Spots come back ranked by estimated search time
       const spots = await nearestRes.json();
 
       if (!spots || spots.length === 0) {
@@ -85,40 +86,8 @@ function MapPage({ user, onUserUpdate }) {
         return;
       }
 
-      setStatus(
-        `Found ${spots.length} parking spots. Estimating search times…`,
-      );
-
-      const estimates = await Promise.all(
-        spots.map(async (spot) => {
-          try {
-            const estRes = await fetch(`${API_BASE_URL}/estimate_search_time`, {
-              method: "POST",
-              headers: {
-                "Content-Type": "application/json",
-              },
-              body: JSON.stringify({
-                total_capacity: spot.capacity,
-                latitude: spot.latitude,
-                longitude: spot.longitude,
-              }),
-            });
-
-            if (!estRes.ok) {
-              throw new Error("Failed to estimate search time");
-            }
-
-            const data = await estRes.json();
-            return data.estimated_search_time_minutes;
-          } catch (e) {
-            console.error("Estimate error for spot", spot.id, e);
-            return null;
-          }
-        }),
-      );
-
-      const mappedLocations = spots.map((spot, idx) => {
-        const est = estimates[idx];
+      const mappedLocations = spots.map((spot) => {
+        const est = spot.estimated_search_time_minutes;
         const roundedMinutes =
           est != null && Number.isFinite(est) ? Math.round(est) : null;
 
@@ -1,7 +1,24 @@
-import pandas as pd
-import numpy as np
+"""
+Generates synthetic hourly occupancy for the P+R facilities from the
+historic color patterns (grün/gelb/rot per day type and time slot).
+
+    python generate_data.py --days 7 --seed 42 \
+        --out data/synthetic_parking_occupancy.csv
+
+Writing to a .parquet path (or --format parquet) produces Parquet with
+compact column types instead of CSV.
+
+Patterns are joined to the garage metadata once and every chunk of rows is
+produced with a handful of array operations, so the output is streamed to
+disk in bounded memory no matter how many days are generated. With a seed
+the output is identical for any --chunk-rows.
+"""
+import argparse
+import os
 from datetime import datetime, timedelta
-import re
+
+import numpy as np
+import pandas as pd
 
 # ==========================================
 # 1. CONFIGURATION & FILES
@@ -9,64 +26,65 @@ import re
 
 HISTORIC_DATA_FILE = "data/historic_data.csv"
 GARAGE_DATA_FILE = "data/parking_garage.csv"
-COMBINED_DATA_FILE = "data/combined_parking_data.csv"
 OUTPUT_FILE = "data/synthetic_parking_occupancy.csv"
 
-# Configuration for generation
 DAYS_TO_GENERATE = 7
-START_DATE = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+CHUNK_ROWS = 200_000
 
 # Color to Percentage Mapping (Uniform Distribution)
 # Green: 0% - 75%
 # Yellow: 75% - 90%
 # Red: 90% - 100%
 COLOR_MAP = {"grün": (0.00, 0.75), "gelb": (0.75, 0.90), "rot": (0.90, 1.00)}
-
-# ==========================================
-# 2. DATA LOADING
-# ==========================================
-
-# A. Load Historic Pattern Data
-print(f"Loading patterns from {HISTORIC_DATA_FILE}...")
-# We expect the file to look like: _id,p+r_anlage,wt_06-07_uhr,...
-df_patterns = pd.read_csv(HISTORIC_DATA_FILE)
-
-# B. Load Garage Metadata (for Address and Capacity)
-print(f"Loading garage details from {GARAGE_DATA_FILE}...")
-df_garages = pd.read_csv(GARAGE_DATA_FILE)
+DEFAULT_COLOR = "grün"
+
+DAY_TYPES = ("wt", "sa", "so")
+
+# Time slot suffix of the historic_data.csv columns for every hour of the day
+HOUR_SLOTS = np.array(
+    ["20-06_uhr"] * 6
+    + ["06-07_uhr", "07-08_uhr", "08-09_uhr", "09-10_uhr"]
+    + ["10-12_uhr"] * 2
+    + ["12-14_uhr"] * 2
+    + ["14-16_uhr"] * 2
+    + ["16-18_uhr"] * 2
+    + ["18-20_uhr"] * 2
+    + ["20-06_uhr"] * 4
+)
+
+DMS_PATTERN = r"(\d+)°(\d+)'(\d+\.?\d*)"
+
+OUTPUT_COLUMNS = [
+    "timestamp",
+    "name",
+    "address",
+    "day_type",
+    "hour",
+    "rule_color",
+    "occupancy_rate",
+    "occupied_spots",
+    "total_capacity",
+    "latitude",
+    "longitude",
+]
 
 
 # ==========================================
-# 3. HELPER FUNCTIONS
+# 2. HELPER FUNCTIONS
 # ==========================================
 
 
-def dms_to_decimal(dms_str):
+def dms_to_decimal(dms):
     """
-    Parses a DMS string (e.g., "48°08'56.5""N") into decimal degrees.
+    Parses DMS strings (e.g., "48°08'56.5""N") into decimal degrees.
+    Works on a Series; unparseable values become NaN.
     """
-    # 1. Clean up the string to handle potential extra quotes (like ""N)
-    clean_str = str(dms_str).replace('""', '"')
-
-    # 2. Use regex to capture Degrees, Minutes, and Seconds
-    # The pattern captures three groups of digits/decimals
-    match = re.search(r"(\d+)°(\d+)'(\d+\.?\d*)", clean_str)
-
-    if not match:
-        return None
-
-    # 3. Extract and convert groups to floating-point numbers
-    d, m, s = map(float, match.groups())
-
-    # 4. Apply the conversion formula
-    decimal = d + m / 60 + s / 3600
-
-    # Check for Southern or Western coordinates (Negative values)
-    # Your example is 'N', so we assume positive, but this is a standard addition:
-    if "S" in clean_str or "W" in clean_str:
-        return -decimal
-
-    return decimal
+    # Clean up the strings to handle potential extra quotes (like ""N)
+    clean = pd.Series(dms, dtype="object").astype(str).str.replace('""', '"')
+    parts = clean.str.extract(DMS_PATTERN).astype(float)
+    decimal = parts[0] + parts[1] / 60 + parts[2] / 3600
+    # Southern or Western coordinates are negative
+    return decimal.where(~clean.str.contains("[SW]"), -decimal)
 
 
 def get_day_type(date_obj):
@@ -86,117 +104,203 @@ def get_column_name(hour, day_type):
     """
     Maps a specific hour (0-23) to the correct column name in historic_data.csv.
     """
-    # Logic based on the provided header structure
-    if 6 <= hour < 7:
-        suffix = "06-07_uhr"
-    elif 7 <= hour < 8:
-        suffix = "07-08_uhr"
-    elif 8 <= hour < 9:
-        suffix = "08-09_uhr"
-    elif 9 <= hour < 10:
-        suffix = "09-10_uhr"
-    elif 10 <= hour < 12:
-        suffix = "10-12_uhr"
-    elif 12 <= hour < 14:
-        suffix = "12-14_uhr"
-    elif 14 <= hour < 16:
-        suffix = "14-16_uhr"
-    elif 16 <= hour < 18:
-        suffix = "16-18_uhr"
-    elif 18 <= hour < 20:
-        suffix = "18-20_uhr"
-    else:
-        # Covers 20:00 to 06:00 (Night shift)
-        suffix = "20-06_uhr"
+    return f"{day_type}_{HOUR_SLOTS[hour]}"
 
-    return f"{day_type}_{suffix}"
+
+def load_facilities(patterns_file, garages_file):
+    """
+    Joins the historic patterns to the garage metadata (capacity, address,
+    coordinates). Facilities without metadata are skipped, as before.
+    """
+    print(f"Loading patterns from {patterns_file}...")
+    df_patterns = pd.read_csv(patterns_file)
+    print(f"Loading garage details from {garages_file}...")
+    df_garages = pd.read_csv(garages_file)
+
+    garages = df_garages.drop_duplicates("name_anlage")[
+        ["name_anlage", "stellplaetze_gesamt", "adresse", "latitude", "longitude"]
+    ]
+    facilities = df_patterns.merge(
+        garages, left_on="p+r_anlage", right_on="name_anlage", how="left", indicator=True
+    )
+    for name in facilities.loc[facilities["_merge"] == "left_only", "p+r_anlage"]:
+        print(f"Warning: Could not find metadata for '{name}'. Skipping.")
+    facilities = facilities[facilities["_merge"] == "both"].reset_index(drop=True)
+    # the left join made capacity float; keep it integral when it is
+    facilities["stellplaetze_gesamt"] = pd.to_numeric(
+        facilities["stellplaetze_gesamt"], downcast="integer"
+    )
+
+    facilities["latitude"] = dms_to_decimal(facilities["latitude"])
+    facilities["longitude"] = dms_to_decimal(facilities["longitude"])
+    return facilities
+
+
+def color_rules(facilities):
+    """
+    Color rule per facility, day type and hour, shape (n, 3, 24).
+    Missing pattern columns fall back to green.
+    """
+    rules = np.empty((len(facilities), len(DAY_TYPES), 24), dtype=object)
+    for d, day_type in enumerate(DAY_TYPES):
+        for slot in np.unique(HOUR_SLOTS):
+            column = f"{day_type}_{slot}"
+            if column in facilities:
+                values = facilities[column].to_numpy(dtype=object)
+            else:
+                values = np.full(len(facilities), DEFAULT_COLOR, dtype=object)
+            rules[:, d, HOUR_SLOTS == slot] = values[:, None]
+    return rules
 
 
 # ==========================================
-# 4. GENERATION LOOP
+# 3. GENERATION
 # ==========================================
 
-print("Generating synthetic data...")
-synthetic_data = []
 
-# Loop through each facility in the historic patterns
-for _, row_pattern in df_patterns.iterrows():
-    # Get Facility Name
-    facility_name = row_pattern["p+r_anlage"]
+def generate_chunks(facilities, start_date, days, rng, chunk_rows=CHUNK_ROWS):
+    """
+    Yields DataFrames of at most chunk_rows rows, ordered by facility, day
+    and hour. One uniform draw per chunk covers every color rule.
+    """
+    rules = color_rules(facilities)
+    colors, rule_codes = np.unique(rules.astype(str), return_inverse=True)
+    rule_codes = rule_codes.reshape(rules.shape)
+    # unknown colors use the green range
+    bounds = np.array([COLOR_MAP.get(color, COLOR_MAP[DEFAULT_COLOR]) for color in colors])
+
+    day_types = np.array(
+        [DAY_TYPES.index(get_day_type(start_date + timedelta(days=i))) for i in range(days)]
+    )
+    day_type_labels = np.array([day_type.upper() for day_type in DAY_TYPES])
+    start = np.datetime64(start_date, "h")
+
+    names = facilities["p+r_anlage"].to_numpy()
+    addresses = facilities["adresse"].to_numpy()
+    capacity = facilities["stellplaetze_gesamt"].to_numpy()
+    latitude = facilities["latitude"].to_numpy()
+    longitude = facilities["longitude"].to_numpy()
+
+    hours_per_facility = days * 24
+    total = len(facilities) * hours_per_facility
+    for begin in range(0, total, chunk_rows):
+        index = np.arange(begin, min(begin + chunk_rows, total))
+        facility, offset = np.divmod(index, hours_per_facility)
+        day, hour = np.divmod(offset, 24)
+        day_type = day_types[day]
+
+        codes = rule_codes[facility, day_type, hour]
+        occupancy_rate = rng.uniform(bounds[codes, 0], bounds[codes, 1])
+
+        yield pd.DataFrame(
+            {
+                "timestamp": start + offset.astype("timedelta64[h]"),
+                "name": names[facility],
+                "address": addresses[facility],
+                "day_type": day_type_labels[day_type],
+                "hour": hour,
+                "rule_color": colors[codes],
+                "occupancy_rate": occupancy_rate.round(4),
+                "occupied_spots": (occupancy_rate * capacity[facility]).astype(np.int64),
+                "total_capacity": capacity[facility],
+                "latitude": latitude[facility],
+                "longitude": longitude[facility],
+            },
+            columns=OUTPUT_COLUMNS,
+        )
 
-    # Find matching facility in the garage file to get Capacity & Address
-    # We look for a match in 'name_anlage'
-    match = df_garages[df_garages["name_anlage"] == facility_name]
 
-    if not match.empty:
-        capacity = match.iloc[0]["stellplaetze_gesamt"]
-        address = match.iloc[0]["adresse"]
-        lat = dms_to_decimal(match.iloc[0]["latitude"])
-        lon = dms_to_decimal(match.iloc[0]["longitude"])
+def write_csv(chunks, path):
+    """
+    Streams the chunks into path via a temporary file, so readers never
+    see a partial output. Returns the number of rows written.
+    """
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    with open(tmp_path, "w", newline="") as f:
+        for chunk in chunks:
+            chunk.to_csv(f, header=rows == 0, index=False)
+            rows += len(chunk)
+    os.replace(tmp_path, path)
+    return rows
+
+
+# Compact column types for the Parquet output
+PARQUET_DTYPES = {
+    "day_type": pd.CategoricalDtype(["WT", "SA", "SO"]),
+    "hour": np.int8,
+    "occupancy_rate": np.float32,
+    "latitude": np.float32,
+    "longitude": np.float32,
+}
+
+
+def write_parquet(chunks, path):
+    """
+    Writes each chunk as a Parquet row group with compact column types,
+    via a temporary file. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk.astype(PARQUET_DTYPES), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("no rows to write")
+    os.replace(tmp_path, path)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic parking occupancy")
+    parser.add_argument("--patterns", default=HISTORIC_DATA_FILE, help="historic color patterns CSV")
+    parser.add_argument("--garages", default=GARAGE_DATA_FILE, help="garage metadata CSV")
+    parser.add_argument("--out", default=OUTPUT_FILE, help="output file")
+    parser.add_argument("--days", type=int, default=DAYS_TO_GENERATE, help="number of days")
+    parser.add_argument(
+        "--start-date",
+        type=datetime.fromisoformat,
+        default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+        help="first day, YYYY-MM-DD (default: today)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("csv", "parquet"),
+        help="output format (default: from the --out suffix, else csv)",
+    )
+    parser.add_argument("--seed", type=int, help="random seed for reproducible output")
+    parser.add_argument(
+        "--chunk-rows", type=int, default=CHUNK_ROWS, help="rows generated per chunk"
+    )
+    args = parser.parse_args(argv)
+
+    facilities = load_facilities(args.patterns, args.garages)
+    rng = np.random.default_rng(args.seed)
+
+    print("Generating synthetic data...")
+    chunks = generate_chunks(facilities, args.start_date, args.days, rng, args.chunk_rows)
+    output_format = args.format or ("parquet" if args.out.endswith(".parquet") else "csv")
+    if output_format == "parquet":
+        rows = write_parquet(chunks, args.out)
     else:
-        # Fallback if names don't match exactly
-        print(
-            f"Warning: Could not find metadata for '{facility_name}'. Using defaults."
-        )
-        continue
-
-    # Loop through the next X days
-    for i in range(DAYS_TO_GENERATE):
-        current_day = START_DATE + timedelta(days=i)
-        day_type = get_day_type(current_day)
-
-        # Loop through 24 hours
-        for hour in range(24):
-            # 1. Identify the column to read (e.g., 'wt_06-07_uhr')
-            col_name = get_column_name(hour, day_type)
-
-            # 2. Get the color rule
-            try:
-                color_rule = row_pattern[col_name]
-            except KeyError:
-                # Handle edge cases where column might be missing or typo
-                color_rule = "grün"
-
-            # 3. Determine Random Occupancy based on Color
-            # Default to Green logic if color is unknown
-            low, high = COLOR_MAP.get(color_rule, (0.0, 0.75))
-
-            # Generate random float
-            occupancy_rate = np.random.uniform(low, high)
-
-            # Calculate integer spots
-            occupied_spots = int(occupancy_rate * capacity)
-
-            # 4. Build the record
-            timestamp = current_day.replace(hour=hour)
-
-            synthetic_data.append(
-                {
-                    "timestamp": timestamp,
-                    "name": facility_name,
-                    "address": address,
-                    "day_type": day_type.upper(),
-                    "hour": hour,
-                    "rule_color": color_rule,
-                    "occupancy_rate": round(occupancy_rate, 4),
-                    "occupied_spots": occupied_spots,
-                    "total_capacity": capacity,
-                    "latitude": lat,
-                    "longitude": lon,
-                }
-            )
-
-# ==========================================
-# 5. EXPORT
-# ==========================================
+        rows = write_csv(chunks, args.out)
 
-df_synthetic = pd.DataFrame(synthetic_data)
+    print("-" * 30)
+    print(f"Done! Generated {rows} rows.")
+    print(f"Saved to: {args.out}")
+    print("-" * 30)
 
-# Save
-df_synthetic.to_csv(OUTPUT_FILE, index=False)
 
-print("-" * 30)
-print(f"Done! Generated {len(df_synthetic)} rows.")
-print(f"Saved to: {OUTPUT_FILE}")
-print("-" * 30)
-print(df_synthetic.head(10))
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 -- Enable PostGIS extension
 CREATE EXTENSION IF NOT EXISTS postgis;
+-- Trigram matching for the /parking address search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- Drop tables if they exist
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS parking;
 DROP TABLE IF EXISTS history;
+DROP TABLE IF EXISTS occupancy_observations;
+DROP TABLE IF EXISTS parking_zones;
 
 -- Create users table (unchanged)
 CREATE TABLE users (
@@ -29,7 +33,24 @@ CREATE TABLE parking (
     latitude DOUBLE PRECISION,
     longitude DOUBLE PRECISION,
     parking_type VARCHAR(50),
-    geom GEOGRAPHY(Point, 4326)  -- GIS column for coordinates
+    geom GEOGRAPHY(Point, 4326),  -- GIS column for coordinates
+    zone_id VARCHAR(64)           -- see parking_zones
+);
+
+-- Street segments of one street and parking type within a grid cell,
+-- merged into one candidate for /nearest?group=zones. Written by
+-- backend/zones.py (and by ingest_parking.py / seed_parking.py). After this
+-- script the app fills it on its first refresh, or run `python zones.py`.
+CREATE TABLE parking_zones (
+    id VARCHAR(64) PRIMARY KEY,
+    address VARCHAR(255),
+    capacity DECIMAL(10,2),        -- summed over the segments
+    latitude DOUBLE PRECISION,     -- capacity-weighted centroid
+    longitude DOUBLE PRECISION,
+    parking_type VARCHAR(50),
+    spot_count INTEGER NOT NULL,
+    representative_id VARCHAR(200),  -- segment closest to the centroid
+    geom GEOGRAPHY(Point, 4326)
 );
 
 CREATE TABLE history (
@@ -40,6 +61,20 @@ CREATE TABLE history (
     timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
 );
 
+-- Append-only occupancy observations (sensors, manual counts). observed_at
+-- is local time, like the day type / hour buckets of the estimator.
+CREATE TABLE occupancy_observations (
+    id BIGSERIAL PRIMARY KEY,
+    parking_id VARCHAR(200) NOT NULL REFERENCES parking(id),
+    observed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    occupied INTEGER NOT NULL CHECK (occupied >= 0),
+    free INTEGER NOT NULL CHECK (free >= 0),
+    CHECK (occupied + free > 0)
+);
+
+-- online updates recompute the buckets of observed spots
+CREATE INDEX idx_occupancy_observations_parking_id ON occupancy_observations (parking_id);
+
 -- Import CSV (lat/lon will populate numeric columns)
 COPY parking (id, address, capacity, latitude, longitude, parking_type)
 FROM '/config/data/combined_parking_data.csv'
@@ -52,3 +87,8 @@ SET geom = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography;
 
 -- Optional: create spatial index for faster GIS queries
 CREATE INDEX idx_parking_geom ON parking USING GIST (geom);
+CREATE INDEX idx_parking_zone_id ON parking (zone_id);
+CREATE INDEX idx_parking_zones_geom ON parking_zones USING GIST (geom);
+
+-- Trigram index for substring / similarity address search (/parking)
+CREATE INDEX idx_parking_address_trgm ON parking USING GIN (address gin_trgm_ops);